@@ -3,68 +3,19 @@ import os
 import glob
 import re
 import math
-import uuid
 import warnings
-from operator import attrgetter
-from typing import List, Dict, Optional
-from deepmultilingualpunctuation import PunctuationModel
-from tqdm import tqdm
+from typing import Iterable, Iterator, List, Dict, Optional, Tuple
 from utils import extract_speaker_name
-
-class WtWordEncoder(json.JSONEncoder):
-    def default(self, o):
-        if isinstance(o, (WtWord, WtWordList)):
-            return o.to_dict()
-        return super().default(o)
-    
-class WtWordList:
-    def __init__(self, words):
-        if len(set(word.speaker for word in words)) > 1:
-            raise ValueError("All words in a WtWordList must have the same speaker")
-        self.words = words
-
-    @property
-    def speaker(self):
-        return self.words[0].speaker if self.words else None
-
-    @property
-    def start(self):
-        return min(word.start for word in self.words)
-
-    @property
-    def end(self):
-        return max(word.end for word in self.words)
-
-    @property
-    def text(self):
-        return " ".join(word.text for word in self.words)
-
-    def to_dict(self):
-        return {
-            'speaker': self.speaker,
-            'start': self.start,
-            'end': self.end,
-            'text': self.text,
-            'words': [word.to_dict() for word in self.words]
-        }
-    
-class WtWord:
-    def __init__(self, speaker, text, start, end):
-        self.id = uuid.uuid4()
-        self.speaker = speaker
-        self.text = text
-        self.start = start
-        self.end = end
-    def to_dict(self):
-        return {
-            'id': str(self.id),
-            'speaker': self.speaker,
-            'text': self.text,
-            'start': self.start,
-            'end': self.end
-        }
-
-def assemble(input_dir, corrections, names, no_ellipses, disfluent_comma, no_asterisks, show_timestamps):
+from corrections import CorrectionsMatcher, print_corrections_report
+from punctuation import load_punctuation_model, restore_punctuation_cached
+from wordtable import DISFLUENCY, StemWords, WordTable, WtWord, WtWordList, WtWordEncoder
+from sidecar import load_all_stem_words
+from stemcache import read_cleaned_stem, write_cleaned_stem
+from compact import render_compact_transcript, describe_token_savings
+from repair import repair_collapsed_items
+import profiling
+
+def assemble(input_dir, corrections, names, no_ellipses, disfluent_comma, no_asterisks, show_timestamps, corrections_whole_words=False, corrections_ignore_case=False, store_path=None):
     if input_dir is None:
         print("Please provide an input directory.")
         return
@@ -87,137 +38,196 @@ def assemble(input_dir, corrections, names, no_ellipses, disfluent_comma, no_ast
     print(f" Found {len(files)} .{ext} files at {input_dir}.")
     print()
 
-    all_chunks = extract_all_chunks(names, no_ellipses, disfluent_comma, no_asterisks, files)
-
-    # Sort all chunks by start timestamp
-    print(" Sorting...")
-    sorted_chunks = sorted(all_chunks, key=attrgetter('start', 'speaker', 'end'))
-    print(" Normalizing...")
-    normalized_items = normalize_items(sorted_chunks)
-    """normaljson = os.path.join(input_dir, 'normalized.json')
-    with open(normaljson, 'w') as f:
-        f.write(json.dumps(normalized_items, cls=WtWordEncoder, indent=2))"""
-    print(" Collapsing...")
-    collapsed_items = collapse_adjacent(normalized_items)
+    stems = extract_all_chunks(input_dir, names, no_ellipses, disfluent_comma, no_asterisks, files)
+    with profiling.stage('assemble.build_table', stems=len(stems)) as stage:
+        table = WordTable.from_stems(stems)
+        stage['words'] = len(table)
+
+    # Merge the already time-ordered words of each speaker into one stream by start timestamp,
+    # and break that up into sentences and then lines as it goes
+    print(" Merging, normalizing and collapsing...")
+    with profiling.stage('assemble.collapse') as stage:
+        collapsed_items = list(collapse_adjacent(normalize_items(table, merge_chunk_streams(table))))
+        stage['lines'] = len(collapsed_items)
     """collapsejson = os.path.join(input_dir, 'collapsed.json')
     with open(collapsejson, 'w') as f:
         f.write(json.dumps(collapsed_items, cls=WtWordEncoder, indent=2))"""
     print(" Formatting...")
     # max timestamp value for formatting 
-    max_timestamp =  max(value for chunk in sorted_chunks for value in [chunk.start, chunk.end])
+    max_timestamp =  max(max(table.starts), max(table.ends))
     timestamp_digits = int(math.ceil(math.log10(max_timestamp)))
     format_string = "{:0{}.2f}".format(max_timestamp, timestamp_digits)
 
     # Find the maximum width of the speaker name
-    max_speaker_width = max(len(chunk.speaker) for chunk in sorted_chunks)
+    max_speaker_width = max(len(speaker) for speaker in table.speakers)
     print(" Checking for problems...")
-    out_of_sync_items = get_out_of_sync_items(input_dir, format_string, max_speaker_width, collapsed_items)  
+    with profiling.stage('assemble.check_sync'):
+        out_of_sync_items = get_out_of_sync_items(input_dir, format_string, max_speaker_width, collapsed_items)  
     if len(out_of_sync_items) > 0:
         #run them through the punctuation model and collapse again
         print(f"  Found {len(out_of_sync_items)} out-of-sync items. Attempting to auto-punctuate and re-collapse...")
 
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
-            punctuationModel = PunctuationModel()
+            # the lines don't overlap, so they can all go through the model together
+            with profiling.stage('assemble.repunctuate', lines=len(out_of_sync_items)):
+                repunctuated_texts = restore_punctuation_cached(input_dir, [item.text for item, _ in out_of_sync_items])
             changesMade = 0
-            for item, _ in out_of_sync_items:
-                repunctuated = punctuationModel.restore_punctuation(item.text)
+            changed_ids = []
+            for (item, _), repunctuated in zip(out_of_sync_items, repunctuated_texts):
                 if len(repunctuated) > len(item.text):
-                    update_word_texts(item, repunctuated, all_chunks)
+                    changed_ids.extend(update_word_texts(item, repunctuated, table))
                     changesMade += 1
             if changesMade > 0:
                 print(f"  Made changes to punctuation on {changesMade} lines.")
-                print("  Re-sorting...")
-                sorted_chunks = sorted(all_chunks, key=attrgetter('start', 'speaker', 'end'))
-                print("  Re-normalizing...")
-                normalized_items = normalize_items(sorted_chunks)
-                print("  Re-collapsing...")
-                collapsed_items = collapse_adjacent(normalized_items)
+                print("  Re-merging, re-normalizing and re-collapsing...")
+                with profiling.stage('assemble.recollapse', changed_words=len(changed_ids)) as stage:
+                    # only the lines around the changed words need redoing, unless they reach the unfinished sentences at the end
+                    repaired_items = repair_collapsed_items(table, collapsed_items, changed_ids)
+                    stage['local'] = repaired_items is not None
+                    if repaired_items is None:
+                        repaired_items = list(collapse_adjacent(normalize_items(table, merge_chunk_streams(table))))
+                    collapsed_items = repaired_items
                 print("  Checking for problems again...")
-                out_of_sync_items = get_out_of_sync_items(input_dir, format_string, max_speaker_width, collapsed_items)  
+                with profiling.stage('assemble.check_sync'):
+                    out_of_sync_items = get_out_of_sync_items(input_dir, format_string, max_speaker_width, collapsed_items)  
                 if len(out_of_sync_items) > 0:     
                     write_out_of_sync_items(input_dir, max_speaker_width, out_of_sync_items)
 
     # option repunctuate everything
     """print(" Repunctuating all items...")                    
-    punctuationModel = PunctuationModel()
+    from tqdm import tqdm
+    punctuationModel = load_punctuation_model()
     for item in tqdm(collapsed_items):
         repunctuated = punctuationModel.restore_punctuation(item.text)
-        update_word_texts(item, repunctuated, item.words)"""
+        update_word_texts(item, repunctuated, table)"""
     print(" Writing Output...")
-    output_items(input_dir, corrections, show_timestamps, format_string, max_speaker_width, collapsed_items)
+    matcher = CorrectionsMatcher(corrections, corrections_whole_words, corrections_ignore_case) if corrections else None
+    with profiling.stage('assemble.output', corrections=len(corrections) if corrections else 0):
+        transcript, texts = output_items(input_dir, matcher, show_timestamps, format_string, max_speaker_width, collapsed_items)
+    with profiling.stage('assemble.output_compact'):
+        output_compact_items(input_dir, show_timestamps, collapsed_items, texts, transcript)
+    if store_path:
+        import sqlite3
+        from store import save_session
+        with profiling.stage('assemble.store', lines=len(collapsed_items)):
+            try:
+                save_session(store_path, input_dir, collapsed_items, texts)
+            except sqlite3.Error as ex:
+                print(f"  Could not save to the store at {store_path}: {str(ex)}")
+    if matcher is not None:
+        print_corrections_report(matcher)
     print("--------------------")
 
-def extract_all_chunks(names: Optional[Dict[str, str]], no_ellipses: bool, disfluent_comma: bool, no_asterisks: bool, file_names: List[str]) -> List[WtWord]:
-    all_chunks = []
-
+def extract_all_chunks(input_dir: str, names: Optional[Dict[str, str]], no_ellipses: bool, disfluent_comma: bool, no_asterisks: bool, file_names: List[str]) -> List[Tuple[str, StemWords]]:
+    """
+    Returns the speaker and words of each file separately, with the words in (start, end) order.
+    """
+    skipped = set()
     for file_name in file_names:
-        print(f" - {os.path.basename(file_name)}")
         original_speaker = extract_speaker_name(file_name, 'words.json')
         if names and original_speaker in names and (names[original_speaker] is None or names[original_speaker] == ''):
+            skipped.add(file_name)
+    # a stem that hasn't changed since last time (and is being cleaned up the same way) is just
+    # picked up already cleaned up, and only the rest get read in, all up front, so that any that
+    # need parsing can be parsed at the same time
+    flags = {'no_ellipses': no_ellipses, 'disfluent_comma': disfluent_comma, 'no_asterisks': no_asterisks}
+    with profiling.stage('assemble.load_words') as stage:
+        cleaned = {}
+        for file_name in file_names:
+            if file_name not in skipped:
+                words = read_cleaned_stem(input_dir, file_name, flags)
+                if words is not None:
+                    cleaned[file_name] = words
+        loaded = load_all_stem_words(input_dir, [file_name for file_name in file_names if file_name not in skipped and file_name not in cleaned])
+        stage['from_cache'] = len(cleaned)
+        stage['from_sidecar'] = sum(1 for _, from_sidecar in loaded.values() if from_sidecar)
+        stage['parsed'] = len(loaded) - stage['from_sidecar']
+
+    stems = []
+    for file_name in file_names:
+        print(f" - {os.path.basename(file_name)}")
+        original_speaker = extract_speaker_name(file_name, 'words.json')
+        if file_name in skipped:
             print(f"    Skipping because '{original_speaker}' is specified as blank.")
             print()
             continue
 
         speaker = names[original_speaker] if names and original_speaker in names else original_speaker
-        print(f"    Extracting chunks for {speaker} ({original_speaker})...")
-        extracted_chunks = extract_chunks_from_file(file_name, speaker)
-        if disfluent_comma:
-            insert_commas_at_disfluencies(extracted_chunks, no_asterisks)
-        undisfluent_chunks = [c for c in extracted_chunks if c.text.strip() != "[*]"]
-        if not no_ellipses:
-            insert_ellipses_at_likely_breaks(undisfluent_chunks, no_asterisks)
-        all_chunks.extend(undisfluent_chunks)
+        if file_name in cleaned:
+            print(f"    Extracted chunks for {speaker} ({original_speaker}) from the assemble cache, as it hasn't changed since last time...")
+            stems.append((speaker, cleaned[file_name]))
+            print()
+            continue
+
+        extracted_chunks, from_sidecar = loaded[file_name]
+        print(f"    Extracted chunks for {speaker} ({original_speaker}){' from the words sidecar' if from_sidecar else ''}...")
+        with profiling.stage('assemble.clean_stem', stem=os.path.basename(file_name), words=len(extracted_chunks.texts)):
+            if disfluent_comma:
+                insert_commas_at_disfluencies(extracted_chunks, no_asterisks)
+            undisfluent_chunks = remove_disfluencies(extracted_chunks)
+            if not no_ellipses:
+                insert_ellipses_at_likely_breaks(undisfluent_chunks, no_asterisks)
+            # whisper's words are already in order, so this is just a cheap check that they really are
+            words = sort_stem_words(undisfluent_chunks)
+            stems.append((speaker, words))
+        try:
+            write_cleaned_stem(input_dir, file_name, flags, words)
+        except OSError as ex:
+            print(f"    Could not save the cleaned up words for next time: {str(ex)}")
         print()
 
-    return all_chunks
+    return stems
+
+def merge_chunk_streams(table: WordTable) -> Iterator[int]:
+    # the same order as sorting all of the words together by start, speaker and end would give,
+    # without ever holding more than one word per speaker at a time
+    return table.merged_order()
 
-def normalize_items(sorted_chunks: List[WtWord]) -> List[WtWordList]:
-    normalized_items = []
+def normalize_items(table: WordTable, sorted_ids: Iterable[int]) -> Iterator[WtWordList]:
+    # each speaker's words come along in the same order they're stored in the table, so an
+    # unfinished sentence is just where it started and the last word added to it
     current_sentences = {}
+    texts = table.texts
+    speaker_column = table.speaker_column
 
-    for chunk in sorted_chunks:
-        if chunk.text == "[*]":
+    for word_id in sorted_ids:
+        if texts[word_id] == DISFLUENCY:
             # this is just a scrubbed disfluency, skip it
             continue
 
-        if chunk.speaker not in current_sentences or current_sentences[chunk.speaker] is None:
-            current_sentences[chunk.speaker] = WtWordList([chunk])
+        speaker_id = speaker_column[word_id]
+        if current_sentences.get(speaker_id) is None:
+            current_sentences[speaker_id] = [word_id, word_id + 1]
         else:
-            current_sentences[chunk.speaker].words.append(chunk)
+            current_sentences[speaker_id][1] = word_id + 1
 
-        last_character = chunk.text.strip()[-1]
+        last_character = texts[word_id].strip()[-1]
         if last_character in ['.', '!', '?', '-', ',', '~']:
-            normalized_items.append(current_sentences[chunk.speaker])
-            current_sentences[chunk.speaker] = None
+            yield WtWordList(table, *current_sentences[speaker_id])
+            current_sentences[speaker_id] = None
 
     # catch any leftovers
-    leftovers = [v for k, v in current_sentences.items() if v is not None]
+    leftovers = [WtWordList(table, *v) for k, v in current_sentences.items() if v is not None]
     leftovers.sort(key=lambda x: x.start)
-    normalized_items.extend(leftovers)
+    yield from leftovers
 
-    return normalized_items
-
-def collapse_adjacent(normalized_items: List[WtWordList]) -> List[WtWordList]:
+def collapse_adjacent(normalized_items: Iterable[WtWordList]) -> Iterator[WtWordList]:
     current_chunk = None
 
-    collapsed_items = []
-
     for nextchunk in normalized_items:
         if current_chunk is None:
             current_chunk = nextchunk
             continue
         elif nextchunk.speaker != current_chunk.speaker:
-            collapsed_items.append(current_chunk)
+            yield current_chunk
             current_chunk = nextchunk
         else:
-            current_chunk.words.extend(nextchunk.words)
+            current_chunk.extend(nextchunk)
 
     # Output the last chunk
     if current_chunk is not None:
-        collapsed_items.append(current_chunk)
-
-    return collapsed_items
+        yield current_chunk
 
 def get_out_of_sync_items(input_dir, format_string, max_speaker_width, collapsed_items):
     now_running_time = 0
@@ -253,82 +263,74 @@ def write_out_of_sync_items(input_dir, max_speaker_width, potentially_needing_pu
     print(f"  This list has been saved to {punctuation_review_path} for review.")
     print()
 
-def update_word_texts(word_list: WtWordList, new_text: str, original_words: List[WtWord]):
+def update_word_texts(word_list: WtWordList, new_text: str, table: WordTable) -> List[int]:
+    # returns the ids of the words that actually changed
     new_words = new_text.split()
 
-    if len(new_words) != len(word_list.words):
-        raise ValueError(f"The new text does not have the same number of words as the original. New count: {len(new_words)}, Old count: {len(word_list.words)}, text: '{new_text}' Original text: '{word_list.text}'")
+    if len(new_words) != len(word_list):
+        raise ValueError(f"The new text does not have the same number of words as the original. New count: {len(new_words)}, Old count: {len(word_list)}, text: '{new_text}' Original text: '{word_list.text}'")
 
-    for wt_word, new_word in zip(word_list.words, new_words):
-        if wt_word.text != new_word:
-            for original_word in original_words:
-                if original_word.id == wt_word.id:
-                    original_word.text = new_word
-                    break
+    changed_ids = []
+    for word_id, new_word in zip(word_list.ids, new_words):
+        if table.texts[word_id] != new_word:
+            table.set_text(word_id, new_word)
+            changed_ids.append(word_id)
+    return changed_ids
 
-def output_items(input_dir, corrections, show_timestamps, format_string, max_speaker_width, collapsed_items):
+def output_items(input_dir, corrections: Optional[CorrectionsMatcher], show_timestamps, format_string, max_speaker_width, collapsed_items) -> Tuple[str, List[str]]:
+    """
+    Writes transcript.txt, returning what was written along with the corrected text of each item.
+    """
     output_builder = []
+    texts = []
 
     for item in collapsed_items:
         timestamp = f"[{item.start}-{item.end}] " if show_timestamps else ""
-        out_string = f"{timestamp}{item.speaker.rjust(max_speaker_width)}: \"{item.text}\""
-
-        if corrections is not None:
-            for key, value in corrections.items():
-                out_string = out_string.replace(key, value)
+        # corrections only apply to what was said, never to the speaker names or timestamps
+        text = corrections.apply(item.text) if corrections is not None else item.text
+        out_string = f"{timestamp}{item.speaker.rjust(max_speaker_width)}: \"{text}\""
 
         output_builder.append(out_string)
+        texts.append(text)
 
+    transcript = '\n'.join(output_builder)
     output_path = os.path.join(input_dir, "transcript.txt")
     with open(output_path, 'w') as file:
-        file.write('\n'.join(output_builder))
+        file.write(transcript)
     print(f"  {len(output_builder)} lines saved as {output_path}")
+    return transcript, texts
+
+def output_compact_items(input_dir, show_timestamps, collapsed_items, texts: List[str], transcript: str):
+    # the same transcript, but written for summarize to send to the model rather than for people to read
+    starts = [item.start for item in collapsed_items] if show_timestamps else None
+    compact = render_compact_transcript([item.speaker for item in collapsed_items], texts, starts)
+    output_path = os.path.join(input_dir, "transcript.compact.txt")
+    with open(output_path, 'w') as file:
+        file.write(compact)
+    print(f"  Compact version saved as {output_path}, {describe_token_savings(compact, transcript)}.")
 
 def ends_with_break(chunk_text):
     last_character = chunk_text.strip()[-1]
     return last_character in ['.', '!', '?', '-', ',', '~']
 
-def extract_chunks_from_file(file_path: str, speaker: str) -> List[WtWord]:
-    chunks = []
-
-    try:
-        with open(file_path, 'r') as file:
-            json_content = file.read()
-        jsonData = json.loads(json_content)
-
-        for chunkData in jsonData['segments']:
-            segment_chunks = []
-            for word in chunkData['words']:
-                chunk = WtWord(
-                    speaker = speaker,
-                    text = word['text'].strip() if word['text'] else "",
-                    start = word['start'],
-                    end = word['end']
-                )
-                segment_chunks.append(chunk)
-
-            chunks.extend(segment_chunks)
-    except Exception as ex:
-        print(f"Error processing file {file_path}: {str(ex)}")
-
-    return chunks
-
-def insert_commas_at_disfluencies(segment_chunks: List[WtWord], no_asterisks: bool):
-    if len(segment_chunks) > 1:
-        for i in range(1, len(segment_chunks)):
-            current_word = segment_chunks[i]
-            prvs_word = segment_chunks[i - 1]
-            if current_word.speaker != prvs_word.speaker:
-                raise ValueError("Only meant to be used on single-speaker collection")
-            if current_word.text == "[*]" and not ends_with_break(prvs_word.text):
-                prvs_word.text = prvs_word.text.strip() + ("" if no_asterisks else "*") + ","
-
-def insert_ellipses_at_likely_breaks(segment_chunks: List[WtWord], no_asterisks: bool):
-    if len(segment_chunks) > 1:
-        for i in range(1, len(segment_chunks)):
-            current_word = segment_chunks[i]
-            prvs_word = segment_chunks[i - 1]
-            if current_word.speaker != prvs_word.speaker:
-                raise ValueError("Only meant to be used on single-speaker collection")
-            if current_word.start - prvs_word.end > 10 and not ends_with_break(prvs_word.text):
-                prvs_word.text = prvs_word.text.strip() + ("" if no_asterisks else "*") + "..."
\ No newline at end of file
+def remove_disfluencies(segment_chunks: StemWords) -> StemWords:
+    keep = [i for i, text in enumerate(segment_chunks.texts) if text.strip() != "[*]"]
+    return StemWords([segment_chunks.texts[i] for i in keep], [segment_chunks.starts[i] for i in keep], [segment_chunks.ends[i] for i in keep])
+
+def sort_stem_words(segment_chunks: StemWords) -> StemWords:
+    order = sorted(range(len(segment_chunks.texts)), key=lambda i: (segment_chunks.starts[i], segment_chunks.ends[i]))
+    return StemWords([segment_chunks.texts[i] for i in order], [segment_chunks.starts[i] for i in order], [segment_chunks.ends[i] for i in order])
+
+def insert_commas_at_disfluencies(segment_chunks: StemWords, no_asterisks: bool):
+    texts = segment_chunks.texts
+    if len(texts) > 1:
+        for i in range(1, len(texts)):
+            if texts[i] == "[*]" and not ends_with_break(texts[i - 1]):
+                texts[i - 1] = texts[i - 1].strip() + ("" if no_asterisks else "*") + ","
+
+def insert_ellipses_at_likely_breaks(segment_chunks: StemWords, no_asterisks: bool):
+    texts = segment_chunks.texts
+    if len(texts) > 1:
+        for i in range(1, len(texts)):
+            if segment_chunks.starts[i] - segment_chunks.ends[i - 1] > 10 and not ends_with_break(texts[i - 1]):
+                texts[i - 1] = texts[i - 1].strip() + ("" if no_asterisks else "*") + "..."
\ No newline at end of file
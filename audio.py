@@ -0,0 +1,36 @@
+import subprocess
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+def get_audio_duration(audio_file: str) -> float:
+    command = ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+               "-of", "default=noprint_wrappers=1:nokey=1", audio_file]
+    try:
+        output = subprocess.run(command, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as ex:
+        raise RuntimeError(f"Failed to read the duration of {audio_file}: {ex.stderr.decode()}") from ex
+    return float(output.decode().strip())
+
+def load_audio(audio_file: str) -> np.ndarray:
+    # the whole file as 16kHz mono float32, the same as whisper.load_audio, without needing whisper to do it
+    command = ["ffmpeg", "-nostdin", "-threads", "0", "-i", audio_file,
+               "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-"]
+    try:
+        output = subprocess.run(command, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as ex:
+        raise RuntimeError(f"Failed to load audio from {audio_file}: {ex.stderr.decode()}") from ex
+    return np.frombuffer(output, np.int16).flatten().astype(np.float32) / 32768.0
+
+def load_audio_window(audio_file: str, start: float, duration: float) -> np.ndarray:
+    """
+    Decodes just `duration` seconds of the file starting at `start`, as 16kHz mono float32 the same
+    way whisper.load_audio does, without ever holding the rest of the file in memory.
+    """
+    command = ["ffmpeg", "-nostdin", "-threads", "0", "-ss", f"{start:.3f}", "-t", f"{duration:.3f}", "-i", audio_file,
+               "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-"]
+    try:
+        output = subprocess.run(command, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError as ex:
+        raise RuntimeError(f"Failed to load audio from {audio_file}: {ex.stderr.decode()}") from ex
+    return np.frombuffer(output, np.int16).flatten().astype(np.float32) / 32768.0
@@ -0,0 +1,196 @@
+import os
+import glob
+import json
+import time
+from typing import Dict, List, Optional, Sequence, Union
+
+import profiling
+from session_runner import SessionRunner, STEPS, fingerprint_files
+from tasmas import load_names, load_corrections, check_names
+from utils import get_cache_dir, write_file_atomically
+
+# what the batch remembers about each session, inside the parent folder's .tasmas folder
+STATUS_FILE = 'batch.json'
+# the options that change what assemble writes, so a session gets assembled again when they do
+ASSEMBLE_OPTIONS = ['noEllipses', 'disfluentComma', 'noAsterisks', 'showTimestamps', 'correctionsWholeWords', 'correctionsIgnoreCase', 'store']
+
+def find_sessions(parent_dir: str, audio_ext: str) -> List[str]:
+    # any folder directly inside the parent with audio (or already recognized .words.json files) in it
+    sessions = []
+    for entry in sorted(os.scandir(parent_dir), key=lambda entry: entry.name):
+        if not entry.is_dir() or entry.name.startswith('.'):
+            continue
+        if glob.glob(os.path.join(entry.path, f'*.{audio_ext}')) or glob.glob(os.path.join(entry.path, '*.words.json')):
+            sessions.append(entry.path)
+    return sessions
+
+class Batch:
+    """
+    Runs the steps on every session folder in a parent folder, one session after another, all with
+    the same loaded models. How each step went is saved after it finishes, along with a fingerprint
+    of the files it ran on, so a batch that gets stopped (or that had some sessions fail) can just be
+    started again, and it'll skip whatever was already done and hasn't changed since.
+    """
+    def __init__(self, parent_dir: str, runner: SessionRunner, audio_ext: str = 'ogg', steps: Sequence[str] = STEPS):
+        self.parent_dir = os.path.abspath(parent_dir)
+        self.runner = runner
+        self.audio_ext = audio_ext
+        self.steps = list(steps)
+        self.status_path = os.path.join(get_cache_dir(self.parent_dir), STATUS_FILE)
+        self.status = self.read_status()
+
+    def read_status(self) -> Dict:
+        if os.path.exists(self.status_path):
+            try:
+                with open(self.status_path, 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                print(f" Could not read {self.status_path}, so starting over.")
+        return {'names': {}, 'sessions': {}}
+
+    def save_status(self):
+        write_file_atomically(self.status_path, json.dumps(self.status, indent=2))
+
+    def session_status(self, session_dir: str) -> Dict:
+        return self.status['sessions'].setdefault(os.path.basename(session_dir), {'status': 'pending', 'steps': {}, 'error': None, 'seconds': None})
+
+    def fingerprint(self, session_dir: str, step: str, names: Optional[Dict[str, str]] = None, corrections: Optional[Dict[str, str]] = None) -> Union[List, Dict]:
+        # recognize depends on the audio files, assemble on the .words.json files recognize writes, and on
+        # the names, corrections and options it's given
+        if step == 'recognize':
+            return fingerprint_files(session_dir, self.audio_ext)
+        return {
+            'files': fingerprint_files(session_dir, 'words.json'),
+            'names': names,
+            'corrections': corrections,
+            # a session's own names.json or corrections.json (or the parent folder's) is only read when it runs
+            'settings_files': [[os.path.join(os.path.basename(folder), file_name), os.stat(path).st_size, os.stat(path).st_mtime_ns]
+                               for folder in (session_dir, self.parent_dir) for file_name in ('names.json', 'corrections.json')
+                               for path in [os.path.join(folder, file_name)] if os.path.exists(path)],
+            'options': {option: self.runner.config.get(option) for option in ASSEMBLE_OPTIONS},
+        }
+
+    def pending_steps(self, session_dir: str, names: Optional[Dict[str, str]] = None, corrections: Optional[Dict[str, str]] = None) -> List[str]:
+        done = self.session_status(session_dir)['steps']
+        pending = []
+        for step in self.steps:
+            # once an earlier step has to run, everything after it has to run again as well
+            if pending or step not in done or done[step]['fingerprint'] != self.fingerprint(session_dir, step, names, corrections):
+                pending.append(step)
+        return pending
+
+    def run_session(self, session_dir: str, steps: Sequence[str], names: Optional[Dict[str, str]], corrections: Optional[Dict[str, str]]):
+        status = self.session_status(session_dir)
+        status['status'] = 'running'
+        status['error'] = None
+        started = time.time()
+        try:
+            for step in steps:
+                if step == 'recognize' and not self.fingerprint(session_dir, step):
+                    # a session that only has .words.json files has nothing to recognize
+                    status['steps'][step] = {'fingerprint': [], 'finished_at': time.time(), 'seconds': 0}
+                    continue
+                step_started = time.time()
+                fingerprint = self.fingerprint(session_dir, step, names, corrections)
+                with profiling.stage(step, session=os.path.basename(session_dir)):
+                    self.runner.run(session_dir, [step], names, corrections)
+                status['steps'][step] = {'fingerprint': fingerprint, 'finished_at': time.time(), 'seconds': round(time.time() - step_started, 1)}
+                self.save_status()
+            status['status'] = 'done'
+        except KeyboardInterrupt:
+            status['status'] = 'interrupted'
+            raise
+        except Exception as ex:
+            status['status'] = 'failed'
+            status['error'] = str(ex)
+            print(f" {os.path.basename(session_dir)} failed: {str(ex)}")
+        finally:
+            status['seconds'] = round(time.time() - started, 1)
+            self.save_status()
+
+    def print_report(self, sessions: Sequence[str]):
+        print()
+        print("--------------------")
+        print("BATCH STATUS")
+        print("--------------------")
+        print()
+        width = max(len(os.path.basename(session_dir)) for session_dir in sessions)
+        for session_dir in sessions:
+            status = self.session_status(session_dir)
+            seconds = f"{status['seconds']:.0f}s" if status['seconds'] is not None else ''
+            print(f"  {os.path.basename(session_dir):<{width}}  {status['status']:<11}  {seconds:>6}  {status['error'] or ''}")
+        print()
+        counts = {}
+        for session_dir in sessions:
+            state = self.session_status(session_dir)['status']
+            counts[state] = counts.get(state, 0) + 1
+        print(f" {', '.join(f'{count} {state}' for state, count in sorted(counts.items()))}.")
+
+def run_batch(parent_dir: str, config: Dict):
+    print()
+    print("--------------------")
+    print("BATCH")
+    print("--------------------")
+    print()
+
+    audio_ext = (config.get('extension') or 'ogg').strip() or 'ogg'
+    steps = [step.strip() for step in config.get('batchSteps', ','.join(STEPS)).split(',') if step.strip()]
+    unknown = [step for step in steps if step not in STEPS]
+    if unknown:
+        print(f" Unknown step{'s' if len(unknown) != 1 else ''} {', '.join(unknown)} (expected {', '.join(STEPS)}).")
+        return
+
+    sessions = find_sessions(parent_dir, audio_ext)
+    if not sessions:
+        print(f" No session folders (with {audio_ext} or .words.json files in them) were found in {parent_dir}.")
+        return
+
+    runner = SessionRunner(config)
+    batch = Batch(parent_dir, runner, audio_ext, steps)
+
+    # everything that needs asking gets asked now, once for the whole batch, rather than per session;
+    # a session with its own names.json or corrections.json still uses that instead (unless they were given on the command line)
+    shared_names = load_names(config.get('names'), batch.parent_dir) or {}
+    # (an empty dict rather than None, so that a corrections.json turned down here doesn't get picked up later anyway)
+    shared_corrections = load_corrections(config.get('corrections'), batch.parent_dir) or {}
+    def own_file(session_dir, file_name, setting):
+        return not config.get(setting) and os.path.exists(os.path.join(session_dir, file_name))
+
+    # answers from a previous run of this batch don't need giving again
+    shared_names = {**batch.status['names'], **shared_names}
+    stem_files = [file for session_dir in sessions if not own_file(session_dir, 'names.json', 'names')
+                  for file in glob.glob(os.path.join(session_dir, f'*.{audio_ext}'))]
+    shared_names = check_names(shared_names, stem_files, audio_ext)
+    batch.status['names'] = shared_names
+    batch.save_status()
+
+    session_settings = {session_dir: (None if own_file(session_dir, 'names.json', 'names') else shared_names,
+                                      None if own_file(session_dir, 'corrections.json', 'corrections') else shared_corrections)
+                        for session_dir in sessions}
+    work = [(session_dir, batch.pending_steps(session_dir, *session_settings[session_dir])) for session_dir in sessions]
+    for session_dir, pending in work:
+        status = batch.session_status(session_dir)
+        if pending and status['status'] == 'done':
+            # its files have changed since, so it isn't anymore
+            status['status'] = 'pending'
+    print()
+    print(f" Found {len(sessions)} session{'s' if len(sessions) != 1 else ''} in {batch.parent_dir}, {sum(1 for _, pending in work if pending)} with something to do:")
+    print()
+    for session_dir, pending in work:
+        print(f"  - {os.path.basename(session_dir)}: {', '.join(pending) if pending else 'done'}")
+    print()
+
+    try:
+        if any(pending for _, pending in work):
+            runner.warm_up(sorted({step for _, pending in work for step in pending}))
+        for index, (session_dir, pending) in enumerate(work):
+            if not pending:
+                continue
+            print()
+            print(f" Session {index + 1} of {len(sessions)}: {session_dir}")
+            names, corrections = session_settings[session_dir]
+            batch.run_session(session_dir, pending, names, corrections)
+    except KeyboardInterrupt:
+        print()
+        print(" Stopped. Run the same command again to carry on from where it left off.")
+    batch.print_report(sessions)
@@ -0,0 +1,92 @@
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+
+from audio import SAMPLE_RATE
+from windowing import offset_results
+
+# whisper only ever looks at 30 seconds at a time, so nothing gets batched that's longer than that
+MAX_SEGMENT_SECONDS = 30.0
+QUIET_FRAME_SECONDS = 0.1
+
+class SpeechSegment(NamedTuple):
+    audio_file: str
+    # where it starts in the session
+    start: float
+    audio: np.ndarray
+
+def quietest_point(audio: np.ndarray, lo: float, hi: float) -> float:
+    # the middle of the quietest QUIET_FRAME_SECONDS between lo and hi
+    frame = int(QUIET_FRAME_SECONDS * SAMPLE_RATE)
+    first = int(lo * SAMPLE_RATE)
+    count = (int(hi * SAMPLE_RATE) - first) // frame
+    if count < 1:
+        return hi
+    energy = np.mean(np.square(audio[first:first + count * frame].reshape(count, frame), dtype=np.float64), axis=1)
+    return round(first / SAMPLE_RATE + (int(np.argmin(energy)) + 0.5) * QUIET_FRAME_SECONDS, 2)
+
+def split_region(audio: np.ndarray, start: float, end: float, max_seconds: float = MAX_SEGMENT_SECONDS) -> List[Tuple[float, float]]:
+    # a region that's too long is cut where it's quietest in the last third of each piece, so as not to cut a word in half
+    pieces = []
+    while end - start > max_seconds:
+        cut = quietest_point(audio, start + max_seconds * 2 / 3, start + max_seconds)
+        pieces.append((start, cut))
+        start = cut
+    pieces.append((start, end))
+    return pieces
+
+def cut_speech_segments(audio_file: str, audio: np.ndarray, regions: List[Tuple[float, float]]) -> List[SpeechSegment]:
+    """
+    The speech regions of a stem as segments short enough for the model, each with its own copy of
+    its audio (so the rest of the stem's audio doesn't have to stay in memory).
+    """
+    segments = []
+    for region_start, region_end in regions:
+        for start, end in split_region(audio, region_start, region_end):
+            segments.append(SpeechSegment(audio_file, start, np.array(audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)], dtype=np.float32)))
+    return segments
+
+def plan_batches(segments: List[SpeechSegment], batch_size: int) -> List[List[SpeechSegment]]:
+    # segments of about the same length go together so that a batch isn't stuck waiting on one long one,
+    # and the longest go first so that if it's going to run out of memory, it does it straight away
+    ordered = sorted(segments, key=lambda segment: len(segment.audio), reverse=True)
+    return [ordered[i:i + batch_size] for i in range(0, len(ordered), batch_size)]
+
+class StemResults:
+    """
+    Collects the results of each stem's segments, which come back in whatever order their batches
+    ran in, and puts a stem's results together once the last of its segments is in.
+    """
+    def __init__(self):
+        self.remaining = {}
+        self.segments = {}
+        self.languages = {}
+
+    def expect(self, audio_file: str, count: int):
+        self.remaining[audio_file] = count
+        self.segments[audio_file] = []
+        self.languages[audio_file] = Counter()
+
+    def add(self, segment: SpeechSegment, results: Dict) -> Optional[Dict]:
+        """
+        Returns the stem's whole results if that was the last of its segments.
+        """
+        offset_results(results, segment.start)
+        self.segments[segment.audio_file].extend(results.get('segments', []))
+        if results.get('language'):
+            self.languages[segment.audio_file][results['language']] += 1
+        self.remaining[segment.audio_file] -= 1
+        if self.remaining[segment.audio_file] == 0:
+            return self.finish(segment.audio_file)
+        return None
+
+    def finish(self, audio_file: str) -> Dict:
+        segments = sorted(self.segments.pop(audio_file), key=lambda segment: segment['start'])
+        for index, segment in enumerate(segments):
+            segment['id'] = index
+        languages = self.languages.pop(audio_file)
+        return {
+            "text": "".join(segment['text'] for segment in segments),
+            "segments": segments,
+            "language": languages.most_common(1)[0][0] if languages else None,
+        }
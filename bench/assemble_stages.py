@@ -0,0 +1,181 @@
+"""
+Times (and measures the peak memory of) each stage of ASSEMBLE on synthetic sessions, with a stub
+punctuation model, and checks the results against bench/thresholds.json.
+
+    python bench/assemble_stages.py [--scenario 4h-10speakers] [--repeats 3] [--keep DIR]
+
+Prints the results as JSON, and exits with an error if any stage of any scenario went over its
+threshold. Without --scenario, every scenario in the thresholds file is run.
+"""
+import os
+import io
+import sys
+import json
+import glob
+import math
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import tracemalloc
+import contextlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import assemble
+from corrections import CorrectionsMatcher
+from punctuation import restore_punctuation_cached
+from repair import repair_collapsed_items
+from wordtable import WordTable
+from synthetic import generate_session, VOCABULARY
+from stub_punctuation import install_stub_punctuation_model
+
+STAGES = ['extract_all_chunks', 'extract_all_chunks_sidecar', 'extract_all_chunks_cached', 'build_table', 'sort', 'normalize_items',
+          'collapse_adjacent', 'get_out_of_sync_items', 'repunctuate', 'recollapse_local', 'recollapse_full', 'output_items', 'assemble',
+          'assemble_warm', 'assemble_one_edit']
+
+def make_corrections(count=200):
+    # a few that will actually match, and plenty that won't, as a real corrections.json tends to go
+    corrections = {word: word.upper() for word in VOCABULARY[:10]}
+    corrections.update({f"misheard{i}": f"Name{i}" for i in range(count - len(corrections))})
+    return corrections
+
+def clear_session_cache(input_dir, *parts):
+    shutil.rmtree(os.path.join(input_dir, '.tasmas', *parts), ignore_errors=True)
+
+def edit_one_word(file_path):
+    # what fixing up an out-of-sync line by hand looks like: a punctuation mark added to one word
+    with open(file_path, 'r') as f:
+        results = json.load(f)
+    words = [word for segment in results['segments'] for word in segment['words'] if word['text'].strip() != '[*]']
+    word = words[len(words) // 2]
+    word['text'] = word['text'].rstrip('.,?!-') + '.'
+    with open(file_path, 'w') as f:
+        json.dump(results, f)
+
+def run_stages(input_dir, files, corrections, measure):
+    """
+    Runs ASSEMBLE one stage at a time, the same way assemble() does, calling measure(stage, function)
+    to run (and measure) each stage.
+    """
+    clear_session_cache(input_dir)
+    stems = measure('extract_all_chunks', lambda: assemble.extract_all_chunks(input_dir, None, False, False, False, files))
+    clear_session_cache(input_dir, 'assemble')
+    measure('extract_all_chunks_sidecar', lambda: assemble.extract_all_chunks(input_dir, None, False, False, False, files))
+    measure('extract_all_chunks_cached', lambda: assemble.extract_all_chunks(input_dir, None, False, False, False, files))
+    table = measure('build_table', lambda: WordTable.from_stems(stems))
+    order = measure('sort', lambda: list(assemble.merge_chunk_streams(table)))
+    normalized = measure('normalize_items', lambda: list(assemble.normalize_items(table, order)))
+    collapsed = measure('collapse_adjacent', lambda: list(assemble.collapse_adjacent(normalized)))
+
+    max_timestamp = max(max(table.starts), max(table.ends))
+    format_string = "{:0{}.2f}".format(max_timestamp, int(math.ceil(math.log10(max_timestamp))))
+    max_speaker_width = max(len(speaker) for speaker in table.speakers)
+    out_of_sync_items = measure('get_out_of_sync_items', lambda: assemble.get_out_of_sync_items(input_dir, format_string, max_speaker_width, collapsed))
+    repunctuated = measure('repunctuate', lambda: restore_punctuation_cached(input_dir, [item.text for item, _ in out_of_sync_items]))
+    changed_ids = []
+    for (item, _), text in zip(out_of_sync_items, repunctuated):
+        if len(text) > len(item.text):
+            changed_ids.extend(assemble.update_word_texts(item, text, table))
+    repaired = measure('recollapse_local', lambda: repair_collapsed_items(table, collapsed, changed_ids))
+    rebuilt = measure('recollapse_full', lambda: list(assemble.collapse_adjacent(assemble.normalize_items(table, assemble.merge_chunk_streams(table)))))
+    # the whole point is that it comes out exactly the same as rebuilding everything
+    repair_matches = repaired is None or [(line.lo, line.hi) for line in repaired] == [(line.lo, line.hi) for line in rebuilt]
+    measure('output_items', lambda: assemble.output_items(input_dir, CorrectionsMatcher(corrections), False, format_string, max_speaker_width, rebuilt))
+
+    clear_session_cache(input_dir)
+    measure('assemble', lambda: assemble.assemble(input_dir, corrections, None, False, False, False, False))
+    measure('assemble_warm', lambda: assemble.assemble(input_dir, corrections, None, False, False, False, False))
+    edit_one_word(files[0])
+    measure('assemble_one_edit', lambda: assemble.assemble(input_dir, corrections, None, False, False, False, False))
+    return len(table), len(collapsed), len(out_of_sync_items), repaired is not None, repair_matches
+
+def benchmark_scenario(input_dir, repeats):
+    files = sorted(glob.glob(os.path.join(input_dir, '*.words.json')))
+    corrections = make_corrections()
+    timings = {stage: [] for stage in STAGES}
+    peaks = {}
+
+    def timed(stage, function):
+        started = time.perf_counter()
+        result = function()
+        timings[stage].append(time.perf_counter() - started)
+        return result
+
+    def traced(stage, function):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = function()
+        peaks[stage] = (tracemalloc.get_traced_memory()[1] - before) / 1024 ** 2
+        return result
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeats):
+            words, lines, out_of_sync, repaired_locally, repair_matches = run_stages(input_dir, files, corrections, timed)
+        # memory is measured on a separate run, as tracing slows everything down a lot (and it only
+        # sees this process, so not the parsing of .words.json files that happens in worker processes)
+        tracemalloc.start()
+        run_stages(input_dir, files, corrections, traced)
+        tracemalloc.stop()
+
+    return {
+        'words': words,
+        'lines': lines,
+        'out_of_sync_items': out_of_sync,
+        'repaired_locally': repaired_locally,
+        'repair_matches': repair_matches,
+        'seconds': {stage: round(statistics.median(values), 4) for stage, values in timings.items()},
+        'peak_mb': {stage: round(peak, 1) for stage, peak in peaks.items()},
+    }
+
+def check_thresholds(result, thresholds):
+    failures = []
+    if not result['repair_matches']:
+        failures.append("repairing the lines around the repunctuated words didn't give the same lines as rebuilding them all")
+    for stage, limit in thresholds.get('max_seconds', {}).items():
+        if result['seconds'].get(stage, 0) > limit:
+            failures.append(f"{stage} took {result['seconds'][stage]}s (threshold {limit}s)")
+    for stage, limit in thresholds.get('max_peak_mb', {}).items():
+        if result['peak_mb'].get(stage, 0) > limit:
+            failures.append(f"{stage} peaked at {result['peak_mb'][stage]}MB (threshold {limit}MB)")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each stage of assemble on synthetic sessions.")
+    parser.add_argument('--thresholds', default=os.path.join(BENCH_DIR, 'thresholds.json'))
+    parser.add_argument('--scenario', action='append', help="Only run this scenario (can be given more than once).")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--keep', help="Generate the sessions in this folder and leave them there, instead of a temporary one.")
+    args = parser.parse_args()
+
+    with open(args.thresholds, 'r') as f:
+        scenarios = json.load(f)['assemble']
+    names = args.scenario or list(scenarios)
+
+    punctuation_model = install_stub_punctuation_model()
+    report = {}
+    failed = False
+    base_dir = args.keep or tempfile.mkdtemp(prefix='tasmas-bench-')
+    try:
+        for name in names:
+            scenario = scenarios[name]
+            input_dir = os.path.join(base_dir, name)
+            shutil.rmtree(input_dir, ignore_errors=True)
+            generate_session(input_dir, **scenario['session'])
+            result = benchmark_scenario(input_dir, args.repeats)
+            result['failures'] = check_thresholds(result, scenario)
+            failed = failed or bool(result['failures'])
+            report[name] = result
+    finally:
+        if not args.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    report['punctuation_model'] = {'pipe_calls': punctuation_model.pipe_calls, 'texts': punctuation_model.texts}
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
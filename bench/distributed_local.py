@@ -0,0 +1,117 @@
+"""
+Runs a coordinator and several workers on this machine, with the stub engine, to check that a
+session gets transcribed all the way through when one of the jobs is leased by a worker that then
+goes away without a word (so that its lease has to run out, and the job go to someone else).
+
+    python bench/distributed_local.py [--workers 3] [--stems 6] [--minutes 2] [--port 8799] [--windowMinutes 0]
+
+Needs ffmpeg, like recognize does. Prints how it went as JSON, and exits with an error if any
+.words.json is missing or the manifest doesn't count it as up to date.
+"""
+import os
+import sys
+import json
+import time
+import wave
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+SAMPLE_RATE = 16000
+LEASE_SECONDS = 4
+TASMAS = "import sys, tasmas; sys.argv[0] = 'tasmas'; tasmas.main()"
+
+def write_stems(session_dir: str, stems: int, minutes: float, seed: int = 1):
+    # bursts of tone with silence between them, which the stub engine turns into words
+    rng = np.random.default_rng(seed)
+    for index in range(stems):
+        # different lengths, so the jobs don't all take the same time
+        seconds = int(minutes * 60 * rng.uniform(0.5, 1.0))
+        audio = np.zeros(seconds * SAMPLE_RATE, dtype=np.float32)
+        for start in rng.uniform(0, seconds - 5, seconds // 6):
+            first = int(start * SAMPLE_RATE)
+            burst = np.arange(int(rng.uniform(0.5, 4) * SAMPLE_RATE))
+            audio[first:first + len(burst)] = 0.2 * np.sin(burst * 0.05)
+        with wave.open(os.path.join(session_dir, f'{index + 1}-player{index}_0.wav'), 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes((audio * 32767).astype(np.int16).tobytes())
+
+def call(url: str, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    request = urllib.request.Request(url, data=data, method='POST' if data else 'GET', headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+def wait_for(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return call(url)
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a coordinator and workers on localhost.")
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--stems', type=int, default=6)
+    parser.add_argument('--minutes', type=float, default=2)
+    parser.add_argument('--port', type=int, default=8799)
+    # short windows make the workers write lots of checkpoints, which they mustn't share
+    parser.add_argument('--windowMinutes', type=float, default=0)
+    args = parser.parse_args()
+
+    from manifest import RecognizeManifest, CURRENT
+
+    session_dir = tempfile.mkdtemp(prefix='tasmas-distributed-')
+    write_stems(session_dir, args.stems, args.minutes)
+    url = f'http://127.0.0.1:{args.port}'
+    env = dict(os.environ, TASMAS_CACHE_DIR=os.path.join(session_dir, '.cache'))
+    began = time.perf_counter()
+    coordinator = subprocess.Popen([sys.executable, '-c', TASMAS, 'coordinator', session_dir, '--extension', 'wav', '--engine', 'stub',
+                                    '--port', str(args.port), '--leaseSeconds', str(LEASE_SECONDS),
+                                    '--windowMinutes', str(args.windowMinutes)],
+                                   cwd=REPO_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    wait_for(url + '/status')
+
+    # takes a job and is never heard from again
+    ghost = call(url + '/lease', {'worker': 'ghost'})['job']
+
+    workers = [subprocess.Popen([sys.executable, '-c', TASMAS, 'worker', url, '--workerName', f'worker{index}'],
+                                cwd=REPO_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+               for index in range(args.workers)]
+    for worker in workers:
+        worker.wait(timeout=600)
+    status = call(url + '/status')
+    coordinator.wait(timeout=60)
+    seconds = time.perf_counter() - began
+
+    manifest = RecognizeManifest(session_dir)
+    audio_files = sorted(os.path.join(session_dir, name) for name in os.listdir(session_dir) if name.endswith('.wav'))
+    missing = [audio_file for audio_file in audio_files if not os.path.exists(audio_file + '.words.json')]
+    not_current = [audio_file for audio_file in audio_files if manifest.check(audio_file, status['settings'])[0] != CURRENT]
+    ghost_job = next(job for job in status['jobs'] if job['id'] == ghost['id']) if ghost else None
+    report = {
+        'session': session_dir,
+        'seconds': round(seconds, 1),
+        'counts': status['counts'],
+        'by_worker': {job['audio_file']: job['worker'] for job in status['jobs']},
+        'ghost_job_attempts': ghost_job['attempts'] if ghost_job else None,
+        'missing': missing,
+        'not_current': not_current,
+    }
+    print(json.dumps(report, indent=2))
+    if missing or not_current or status['counts'].get('done') != len(audio_files) or coordinator.returncode != 0:
+        print(coordinator.stdout.read())
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
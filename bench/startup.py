@@ -0,0 +1,67 @@
+"""
+Measures how long tasmas takes to start up before it gets to do any actual work, and checks that
+none of the heavy dependencies got imported along the way.
+
+    python bench/startup.py [--runs 5] [--budget 1.0]
+
+Prints the results as JSON, and exits with an error if the median is over the budget (in seconds)
+or if anything heavy was imported.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# none of these should be needed just to get tasmas going, or to run assemble
+HEAVY_MODULES = ['torch', 'whisper_timestamped', 'transformers', 'deepmultilingualpunctuation', 'openai', 'tqdm']
+
+# what each measurement imports, which is everything up to the point where the mode starts working
+CASES = {
+    'help': "import sys; sys.argv = ['tasmas', '--help']\nimport tasmas\ntry:\n    tasmas.main()\nexcept SystemExit:\n    pass",
+    'assemble': "import tasmas, assemble",
+}
+
+CHECK = "\nimport sys, json\nprint(json.dumps([name for name in {heavy} if name in sys.modules]))"
+
+def time_case(code: str, runs: int):
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        began = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', code + CHECK.format(heavy=HEAVY_MODULES)],
+                                cwd=REPO_DIR, capture_output=True, text=True, check=True)
+        timings.append(time.perf_counter() - began)
+        loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return timings, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure tasmas startup time.")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0, help="Maximum median startup time in seconds.")
+    args = parser.parse_args()
+
+    report = {}
+    failed = False
+    for name, code in CASES.items():
+        timings, loaded = time_case(code, args.runs)
+        median = statistics.median(timings)
+        report[name] = {
+            'median_seconds': round(median, 4),
+            'min_seconds': round(min(timings), 4),
+            'max_seconds': round(max(timings), 4),
+            'heavy_modules_loaded': loaded,
+        }
+        if median > args.budget or loaded:
+            failed = True
+
+    report['budget_seconds'] = args.budget
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+A stand-in for the OpenAI chat completions API, for trying out SUMMARIZE without paying for it.
+
+    python bench/stub_openai.py [--port 8000] [--token-delay 0.02] [--rate-limit-first 0]
+
+and then point summarize at it with `--openAiBaseUrl http://localhost:8000/v1` (any API key will do).
+
+It answers every request with a made-up summary, a word at a time, streamed or not as asked. A
+request whose messages contain "STUB_DELAY=<seconds>" waits that long before answering, so that
+prompts can be made to take different amounts of time, and the first --rate-limit-first requests
+get a 429 (with a Retry-After) instead, to exercise the retries.
+"""
+import json
+import time
+import argparse
+import threading
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DELAY_PATTERN = re.compile(r"STUB_DELAY=([0-9.]+)")
+
+class StubOptions:
+    def __init__(self, token_delay=0.02, summary_words=40, rate_limit_first=0, retry_after=0.1):
+        self.token_delay = token_delay
+        self.summary_words = summary_words
+        self.rate_limit_first = rate_limit_first
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self.lock = threading.Lock()
+
+def make_summary_words(messages, count):
+    text = " ".join(message.get('content', '') for message in messages)
+    words = [word for word in re.findall(r"[A-Za-z']+", text)] or ["nothing"]
+    return ["Summary:"] + [words[i % len(words)] for i in range(count)]
+
+class StubHandler(BaseHTTPRequestHandler):
+    options: StubOptions = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+        options = self.options
+        with options.lock:
+            options.requests += 1
+            rate_limited = options.rate_limited < options.rate_limit_first
+            if rate_limited:
+                options.rate_limited += 1
+        if rate_limited:
+            self.send_json(429, {"error": {"message": "Rate limit reached (stub).", "type": "requests", "code": "rate_limit_exceeded"}},
+                           {'Retry-After': str(options.retry_after)})
+            return
+
+        messages = request.get('messages', [])
+        delay = DELAY_PATTERN.search(" ".join(message.get('content', '') for message in messages))
+        if delay:
+            time.sleep(float(delay.group(1)))
+
+        words = make_summary_words(messages, options.summary_words)
+        completion_id = f"chatcmpl-stub{options.requests}"
+        created = int(time.time())
+        model = request.get('model', 'stub')
+
+        if not request.get('stream'):
+            time.sleep(options.token_delay * len(words))
+            self.send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        def send_chunk(delta, finish_reason=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        send_chunk({"role": "assistant", "content": ""})
+        for i, word in enumerate(words):
+            time.sleep(options.token_delay)
+            send_chunk({"content": word if i == 0 else " " + word})
+        send_chunk({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+def start_stub_server(host='127.0.0.1', port=0, options=None):
+    """
+    Starts the stub on a background thread, returning the server (whose options can be looked at
+    afterwards) and its base URL. Port 0 picks any free port.
+    """
+    handler = type('BoundStubHandler', (StubHandler,), {'options': options or StubOptions()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI chat completions server.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--token-delay', type=float, default=0.02, help="Seconds between streamed words.")
+    parser.add_argument('--summary-words', type=int, default=40)
+    parser.add_argument('--rate-limit-first', type=int, default=0, help="Answer this many requests with a 429 first.")
+    parser.add_argument('--retry-after', type=float, default=0.1)
+    args = parser.parse_args()
+
+    options = StubOptions(args.token_delay, args.summary_words, args.rate_limit_first, args.retry_after)
+    server, base_url = start_stub_server(args.host, args.port, options)
+    print(f"Stub chat completions API listening at {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
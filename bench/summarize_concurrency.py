@@ -0,0 +1,69 @@
+"""
+Runs SUMMARIZE against the stub chat completions API with prompts that take different amounts of
+time (and a couple of rate limits thrown in), and checks that the whole thing takes about as long
+as the slowest prompt rather than all of them added together.
+
+    python bench/summarize_concurrency.py [--prompts 4] [--slowest 2.0]
+
+Prints the results as JSON, and exits with an error if it took too long or anything failed.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import io
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_openai import StubOptions, start_stub_server
+from summarize import summarize, get_summary_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure concurrent summarize against a stub API.")
+    parser.add_argument('--prompts', type=int, default=4)
+    parser.add_argument('--slowest', type=float, default=2.0, help="Seconds the slowest prompt waits before answering.")
+    parser.add_argument('--rate-limit-first', type=int, default=2)
+    parser.add_argument('--slack', type=float, default=1.0, help="Seconds allowed on top of the slowest prompt.")
+    args = parser.parse_args()
+
+    options = StubOptions(token_delay=0.01, rate_limit_first=args.rate_limit_first, retry_after=0.1)
+    server, base_url = start_stub_server(options=options)
+
+    with tempfile.TemporaryDirectory() as input_dir:
+        with open(os.path.join(input_dir, 'transcript.txt'), 'w') as f:
+            f.write('Alice: "We should attack the dragon."\nBob: "No, north."\n' * 200)
+        prompt_files = []
+        delays = [args.slowest * (i + 1) / args.prompts for i in range(args.prompts)]
+        for i, delay in enumerate(delays):
+            prompt_file = os.path.join(input_dir, f'prompt_bench_{i}.txt')
+            with open(prompt_file, 'w') as f:
+                f.write(f"STUB_DELAY={delay} Summarize this.\n")
+            prompt_files.append(prompt_file)
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            summarize(input_dir, prompt_files, 'stub-key', concurrency=args.prompts, max_retries=3, base_url=base_url)
+        elapsed = time.perf_counter() - started
+        written = [os.path.exists(get_summary_path(input_dir, prompt_file)) for prompt_file in prompt_files]
+
+    server.shutdown()
+    budget = args.slowest + args.slack
+    report = {
+        'prompts': args.prompts,
+        'wall_seconds': round(elapsed, 3),
+        'slowest_prompt_seconds': args.slowest,
+        'sequential_seconds_at_least': round(sum(delays), 3),
+        'budget_seconds': budget,
+        'requests': options.requests,
+        'rate_limited': options.rate_limited,
+        'summaries_written': sum(written),
+    }
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if elapsed <= budget and all(written) else 1)
+
+if __name__ == '__main__':
+    main()
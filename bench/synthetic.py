@@ -0,0 +1,95 @@
+"""
+Makes up a session of .words.json files (in the same shape as whisper_timestamped's output) for
+trying out ASSEMBLE without any real recordings.
+
+    python bench/synthetic.py <output_dir> [--speakers 4] [--minutes 30] [--crosstalk 0.2]
+                              [--punctuation 0.15] [--disfluency 0.05] [--seed 1]
+
+The conversation is a series of turns by randomly chosen speakers. --crosstalk is the chance that a
+turn starts before the previous one has finished, --punctuation is the chance that any word ends in
+a punctuation mark (so lower is sparser), and --disfluency is the chance of any word being a "[*]".
+"""
+import os
+import json
+import random
+import argparse
+
+VOCABULARY = ("the a dragon goes north we should attack maybe yes no I think that is right hello there "
+              "rogue sneaks past guard roll for initiative cast fireball at goblin how many hit points").split()
+PUNCTUATION = ".,?!-"
+
+def generate_session(output_dir, speakers=4, minutes=30.0, crosstalk=0.2, punctuation=0.15, disfluency=0.05, seed=1):
+    """
+    Writes one .words.json per speaker into output_dir, named the way Craig names its files, and
+    returns the paths of the files written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rnd = random.Random(seed)
+    segments = [[] for _ in range(speakers)]
+    speaker_free_at = [0.0] * speakers
+
+    time = rnd.uniform(0, 5)
+    previous_end = time
+    while time < minutes * 60:
+        speaker = rnd.randrange(speakers)
+        # nobody talks over themselves
+        time = max(time, speaker_free_at[speaker])
+        words = []
+        for _ in range(rnd.randint(3, 25)):
+            duration = rnd.uniform(0.1, 0.6)
+            if rnd.random() < disfluency:
+                text = "[*]"
+            else:
+                text = rnd.choice(VOCABULARY)
+                if rnd.random() < punctuation:
+                    text += rnd.choice(PUNCTUATION)
+            words.append({"text": " " + text, "start": round(time, 2), "end": round(time + duration, 2), "confidence": round(rnd.uniform(0.5, 1.0), 3)})
+            time += duration + rnd.uniform(0, 0.2)
+        segments[speaker].append({
+            "id": len(segments[speaker]),
+            "seek": 0,
+            "start": words[0]["start"],
+            "end": words[-1]["end"],
+            "text": "".join(word["text"] for word in words),
+            # the rest of what whisper_timestamped writes, which ASSEMBLE doesn't use but still has to read past
+            "tokens": [rnd.randrange(50000) for _ in range(len(words) + 2)],
+            "temperature": 0.0,
+            "avg_logprob": round(-rnd.random(), 4),
+            "compression_ratio": round(rnd.uniform(1, 2), 4),
+            "no_speech_prob": round(rnd.random() / 10, 4),
+            "confidence": round(rnd.uniform(0.5, 1.0), 3),
+            "words": words,
+        })
+        speaker_free_at[speaker] = time
+        turn_end = time
+        if rnd.random() < crosstalk:
+            # the next turn starts partway through this one
+            time = rnd.uniform(previous_end, turn_end)
+        else:
+            time = turn_end + rnd.expovariate(1 / 0.5)
+        previous_end = turn_end
+
+    file_paths = []
+    for speaker, speaker_segments in enumerate(segments):
+        file_path = os.path.join(output_dir, f"{speaker + 1}-player{speaker}_0.ogg.words.json")
+        with open(file_path, 'w') as f:
+            json.dump({"text": " ".join(segment["text"] for segment in speaker_segments), "segments": speaker_segments, "language": "en"}, f)
+        file_paths.append(file_path)
+    return file_paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic multi-speaker .words.json session.")
+    parser.add_argument('output_dir')
+    parser.add_argument('--speakers', type=int, default=4)
+    parser.add_argument('--minutes', type=float, default=30)
+    parser.add_argument('--crosstalk', type=float, default=0.2)
+    parser.add_argument('--punctuation', type=float, default=0.15)
+    parser.add_argument('--disfluency', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    file_paths = generate_session(args.output_dir, args.speakers, args.minutes, args.crosstalk, args.punctuation, args.disfluency, args.seed)
+    print(f"Wrote {len(file_paths)} .words.json files to {args.output_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tokens import count_tokens
+
+# how the line at the top saying who each alias is starts
+LEGEND_PREFIX = "Speakers: "
+
+def make_speaker_aliases(speakers: Sequence[str]) -> Dict[str, str]:
+    """
+    The first letter of each speaker's name, numbered when more than one speaker starts with the
+    same letter, so "Alice", "Bob" and "Brian" become "A", "B" and "B2".
+    """
+    aliases = {}
+    used = set()
+    for speaker in speakers:
+        letter = next((character.upper() for character in speaker if character.isalnum()), "S")
+        alias = letter
+        number = 2
+        while alias in used:
+            alias = f"{letter}{number}"
+            number += 1
+        aliases[speaker] = alias
+        used.add(alias)
+    return aliases
+
+def format_coarse_timestamp(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    return f"[{minutes // 60}:{minutes % 60:02d}]"
+
+def render_compact_transcript(speakers: Sequence[str], texts: Sequence[str], starts: Optional[Sequence[float]] = None) -> str:
+    """
+    The transcript as it's worth sending to a language model: each speaker as a short alias (with a
+    legend at the top), no padding or quotes, and if starts are given, a timestamp to the minute
+    whenever the minute changes.
+    """
+    aliases = make_speaker_aliases(list(dict.fromkeys(speakers)))
+    lines = [LEGEND_PREFIX + ", ".join(f"{alias} = {speaker}" for speaker, alias in aliases.items())]
+    last_minute = None
+    for index, (speaker, text) in enumerate(zip(speakers, texts)):
+        stamp = ""
+        if starts is not None:
+            minute = int(starts[index] // 60)
+            if minute != last_minute:
+                stamp = format_coarse_timestamp(starts[index]) + " "
+                last_minute = minute
+        lines.append(f"{stamp}{aliases[speaker]}: {text}")
+    return "\n".join(lines)
+
+def split_legend(transcript: str) -> Tuple[Optional[str], str]:
+    # the legend of a compact transcript (None if it isn't one), and everything after it
+    first, _, rest = transcript.partition("\n")
+    # (a transcript.txt line by someone called "Speakers" has their words in quotes after it)
+    if first.startswith(LEGEND_PREFIX) and not first[len(LEGEND_PREFIX):].startswith('"'):
+        return first, rest
+    return None, transcript
+
+def describe_token_savings(compact: str, full: str) -> str:
+    compact_tokens = count_tokens(compact)
+    full_tokens = count_tokens(full)
+    saved = 1 - compact_tokens / full_tokens if full_tokens else 0
+    return f"about {compact_tokens} tokens instead of {full_tokens} ({saved:.0%} fewer)"
@@ -6,7 +6,7 @@ def get_configuration(args):
                                      description='''Multi-Stem Conversational Transcriber
 ''')
     parser.add_argument('operationMode', type=str, 
-                        choices=['recognize', 'assemble', 'summarize', 'semiauto', 'fullauto'], 
+                        choices=['recognize', 'assemble', 'summarize', 'semiauto', 'fullauto', 'daemon', 'batch', 'query', 'coordinator', 'worker'], 
                         help='''Which step to perform:
 - recognize: Transcribes all audio files found at the 
              path using whisper_timestamped and writes 
@@ -24,8 +24,39 @@ def get_configuration(args):
              assemble multiple times making manual
              tweaks to the .words.json files.)
 - fullauto:  Performs all steps in succession. 
+- daemon:    Keeps running, with the models loaded,
+             watching the path for new session folders
+             and running recognize and assemble on each
+             one without asking anything (see the daemon
+             mode options).
+- batch:     Runs recognize and assemble on every session
+             folder in the path, one after another, with
+             the models only loaded once. Any questions
+             get asked once at the start, and if it's
+             stopped, running it again carries on from
+             where it got to.
+- query:     Searches the store that assemble fills in
+             with --store (the path is the store, or the
+             folder it's in), see the query mode options.
+- coordinator: Runs recognize on the path (a session
+             folder, or a folder of them) by handing the
+             audio files out to workers, which can be on
+             other machines, and saving what they send
+             back (see the distributed mode options).
+- worker:    Takes audio files to transcribe from a
+             coordinator, whose address is the path, e.g.
+             tasmas worker http://192.168.1.20:8765
  ''')
     parser.add_argument('inputDir', type=str, help='The path to the files to process.')
+    parser.add_argument('--profile', action='store_true', help='''Record how long each step (and each file) takes, in 
+wall and CPU time, and how much memory it used, along
+with the recognize real-time factor, punctuation model
+calls and API latency and tokens. Saved in the input 
+path as profile.json, plus profile.trace.json to open
+in chrome://tracing or ui.perfetto.dev. For batch and
+coordinator, that's the whole run, saved in the parent
+folder; daemon, worker and query modes ignore it.
+''')
 
     recognizeConfigGroup = parser.add_argument_group('recognize mode options')
     recognizeConfigGroup.add_argument('--extension', type=str, help='''File extension of the audio files to transcribe.
@@ -42,6 +73,87 @@ Honestly this really doesn't work well at all and I
 do not recommend it.
 '''
 )
+    recognizeConfigGroup.add_argument('--tiered', action='store_true', help='''Decode everything with the quick (greedy) settings 
+first, then decode again with the accurate settings
+only the stretches that the first pass wasn't sure
+about (by its segment and word confidences), and 
+put the two together. Most of the speed of --fast 
+and most of the accuracy of the normal settings,
+with the same model. Shows how much of the audio 
+had to be decoded again.
+''')
+    recognizeConfigGroup.add_argument('--tieredConfidence', type=float, default=0.6, help='''With --tiered, decode a segment again if the first
+pass was less confident of it than this (0 to 1). 
+Higher means more gets decoded again. Defaults to 0.6.
+''')
+    recognizeConfigGroup.add_argument('--engine', type=str, default='whisper', choices=['whisper', 'faster-whisper', 'stub'], help='''What to run the whisper model with:
+- whisper:        whisper_timestamped, on the GPU. 
+                  The default, and what TASMAS has 
+                  always used.
+- faster-whisper: faster-whisper (pip install 
+                  faster-whisper), on the CPU with 
+                  the model quantized to int8. A lot
+                  quicker than whisper on a machine
+                  without a GPU, but it doesn't 
+                  detect disfluencies.
+- stub:           Doesn't recognize anything, just
+                  makes up words wherever the audio
+                  is loud enough to be speech. For 
+                  trying things out without a model.
+Whichever it is, the .words.json files come out the
+same shape, so assemble works just the same.
+''')
+    recognizeConfigGroup.add_argument('--threads', type=int, default=0, help='''How many CPU threads each transcription gets. 
+Defaults to the number of cores divided between the
+--workers (or whatever the engine picks with 1 worker).
+''')
+    recognizeConfigGroup.add_argument('--workers', type=int, default=1, help='''Number of audio files to transcribe at the same time.
+Each worker process loads its own copy of the model
+and gets an equal share of the CPU threads, and the
+largest files are started first. Mostly useful on
+machines without a GPU, where a single transcription
+leaves most of the cores idle. Defaults to 1.
+''')
+    recognizeConfigGroup.add_argument('--vadPrepass', action='store_true', help='''Find the speech in each audio file first, and only 
+transcribe that. Craig files are synced to the start
+of the session, so most of each file is silence; with
+this switch the speech regions are padded, packed 
+together and transcribed in one go, and the word 
+timestamps are mapped back to the session timeline.
+The detected regions are cached in the .tasmas folder
+inside the input path.
+''')
+    recognizeConfigGroup.add_argument('--batchSegments', type=int, default=0, help='''Cut the speech out of every audio file (the same way 
+--vadPrepass finds it) into segments of up to 30s,
+and transcribe the segments from all of the files 
+together, this many at a time, with segments of about
+the same length batched up together. With an engine
+that can run a whole batch at once (faster-whisper
+1.1 or later), that's a lot quicker than lots of 
+little segments one after another; with the others
+they still just go one at a time. Everything runs in
+the one process, so --workers and --windowMinutes 
+don't apply, and the speech from all of the files is
+kept in memory until it's done. Off by default.
+''')
+    recognizeConfigGroup.add_argument('--windowMinutes', type=float, default=0, help='''Transcribe each audio file in overlapping windows of
+this many minutes, instead of decoding the whole file
+into memory at once. Each finished window is saved as
+it goes, so if a run is interrupted it picks back up 
+from the last finished window, and memory use stays 
+the same however long the file is. Words in the 
+overlap between windows are only kept once. Has to
+be longer than the 15 second overlap. Off by default.
+''')
+    recognizeConfigGroup.add_argument('--pcmCacheGB', type=float, default=0, help='''Keep the decoded audio of each file on disk (up to 
+this many gigabytes in total, dropping the least 
+recently used first), so running recognize on the 
+same files again doesn't have to decode them again.
+Entries are found by the hash of the audio file, and 
+are read memory-mapped instead of loaded into memory.
+They live in ~/.cache/tasmas, or $TASMAS_CACHE_DIR if
+that is set. Off by default.
+''')
 
     assembleConfigGroup = parser.add_argument_group('assemble mode options')
     assembleConfigGroup.add_argument('--noEllipses', action='store_true', help='''This script normally inserts ellipses (...) into the
@@ -71,6 +183,13 @@ incorrect ones. For example,
 '{"Elsalor":["Elcelor", "I'll solar", "else the Lord"],
   "A'Dhem" :["Adam"] }'
 This can be a path to a .json file or the actual JSON.
+ ''')
+    assembleConfigGroup.add_argument('--correctionsWholeWords', action='store_true', help='''Only apply a correction where it is a whole word or 
+phrase, so that e.g. a correction for "Adam" doesn't 
+also change "Adamant".
+ ''')
+    assembleConfigGroup.add_argument('--correctionsIgnoreCase', action='store_true', help='''Match corrections regardless of capitalization. The
+replacement is always inserted exactly as written.
  ''')
     assembleConfigGroup.add_argument('--names', type=str, help='''Replacements for the speaker names as recorded in the 
 filenames by discord/Craig. These should reflect the 
@@ -82,8 +201,82 @@ This can be a path to a .json file or the actual JSON.
 You will be prompted individually for any values not
 found here (and given the opportunity to skip that 
 audio stem).
+ ''')
+    assembleConfigGroup.add_argument('--store', type=str, help='''Also save the transcript's lines and words into this
+SQLite file (or a tasmas.db in this folder), which 
+can hold any number of sessions, for the query mode 
+to search. Assembling a session again replaces what 
+was there for it. Works with batch and daemon too,
+so pointing every session at the same one builds up
+a searchable store of the whole campaign.
  ''')
     
+    daemonConfigGroup = parser.add_argument_group('daemon mode options')
+    daemonConfigGroup.add_argument('--port', type=int, default=8765, help='''The port for the daemon's control API, which only 
+listens on localhost. GET /status shows what it's up
+to, and POST /jobs with {"session": "<folder>"} queues
+a session up by hand. Also the port the coordinator
+listens on for workers. Defaults to 8765.
+''')
+    daemonConfigGroup.add_argument('--pollSeconds', type=float, default=30, help='''How often to look for new session folders.
+Defaults to 30.
+''')
+    daemonConfigGroup.add_argument('--settleSeconds', type=float, default=60, help='''How long a session folder's audio files have to go 
+without changing before it's picked up, so that it
+doesn't start on a session that's still being copied
+in. Defaults to 60.
+''')
+
+    distributedConfigGroup = parser.add_argument_group('distributed mode options')
+    distributedConfigGroup.add_argument('--host', type=str, default='127.0.0.1', help='''The address the coordinator listens on. Defaults to
+127.0.0.1, which only lets in workers on the same 
+machine; use 0.0.0.0 (or this machine's address on 
+the network) for workers on other machines. There's
+no password, and workers can download the audio, so
+only do that on a network you trust.
+''')
+    distributedConfigGroup.add_argument('--leaseSeconds', type=float, default=120, help='''How long a worker has a file for without checking in
+(which it does every third of this while it works on
+it) before the coordinator decides it's gone and 
+gives the file to another worker. Defaults to 120.
+''')
+    distributedConfigGroup.add_argument('--maxAttempts', type=int, default=3, help='''How many times a file gets handed out (to workers 
+that failed on it or went away) before giving up on
+it. Defaults to 3.
+''')
+    distributedConfigGroup.add_argument('--workerName', type=str, help='''What a worker calls itself, in the coordinator's 
+output and /status. Defaults to the machine's name
+and the process id.
+''')
+
+    batchConfigGroup = parser.add_argument_group('batch mode options')
+    batchConfigGroup.add_argument('--batchSteps', type=str, default='recognize,assemble', help='''Which steps to run on each session, comma separated.
+Defaults to "recognize,assemble"; "assemble" on its 
+own redoes the transcripts of sessions that have
+already been recognized (e.g. after changing the
+names or corrections).
+''')
+
+    queryConfigGroup = parser.add_argument_group('query mode options')
+    queryConfigGroup.add_argument('--search', type=str, help='''Words to look for (all of them have to be in a line),
+with corrections applied, so e.g. --search "A'Dhem". 
+Put a phrase in double quotes to look for exactly that.
+''')
+    queryConfigGroup.add_argument('--session', type=str, help='''Only look in this session (by its folder name). Can 
+use * and ? wildcards, e.g. "2024-04-*".
+''')
+    queryConfigGroup.add_argument('--speaker', type=str, help='''Only lines said by this speaker (wildcards work here too).
+''')
+    queryConfigGroup.add_argument('--fromTime', type=str, help='''Only lines from this far into the session on, as
+seconds, m:ss or h:mm:ss. With --toTime (and 
+--session) and no --search, this just shows that 
+stretch of the session.
+''')
+    queryConfigGroup.add_argument('--toTime', type=str, help='''Only lines up to this far into the session.
+''')
+    queryConfigGroup.add_argument('--limit', type=int, default=50, help='''The most lines to show. Defaults to 50.
+''')
+
     summarizeConfigGroup = parser.add_argument_group('summarize mode options')
     summarizeConfigGroup.add_argument('--promptType', type=str, help='''
 This script will call OpenAI's GPT-4 API to summarize
@@ -101,8 +294,46 @@ of much length, the summarize operation calls ChatGPT
 4 Turbo (128k tokens). As such, an OpenAI API key is 
 required to run in summarize (or fullauto) mode. 
 (It'll probably cost you about $0.10 USD per call.)
+''')
+    summarizeConfigGroup.add_argument('--summaryConcurrency', type=int, default=4, help='''How many prompts to send to the API at the same time.
+All of the prompts are sent at once (up to this many)
+and each summary is written to its file as it comes
+in, so the whole thing takes about as long as the 
+slowest prompt. Turn it down if your account keeps 
+getting rate limited. Defaults to 4.
+''')
+    summarizeConfigGroup.add_argument('--summaryRetries', type=int, default=5, help='''How many times to retry a prompt that fails because of
+a rate limit, timeout or server error, waiting longer
+each time (or as long as the API asks). Defaults to 5.
+''')
+    summarizeConfigGroup.add_argument('--summaryChunkTokens', type=int, default=0, help='''Split the transcript into chunks of about this many
+tokens (always at the end of a line), have each chunk
+summarized on its own, all at the same time, and then
+have those combined into the final summary. For 
+transcripts too long for the model, or to make
+re-running a prompt after a small change to the 
+transcript cheap, as each chunk's answer is cached in
+the .tasmas folder inside the input path and only the
+chunks that changed are sent again. Off by default
+(the whole transcript is sent in one go).
+''')
+    summarizeConfigGroup.add_argument('--compactTranscript', action='store_true', help='''Send transcript.compact.txt (which assemble writes 
+next to transcript.txt) instead of transcript.txt. It 
+has the same lines, but with short speaker aliases and
+a legend at the top, no padding or quotes, and only
+a timestamp to the minute when the minute changes,
+which comes to a lot fewer tokens (so it's cheaper
+and quicker). How many fewer is shown when it's used.
+''')
+    summarizeConfigGroup.add_argument('--openAiBaseUrl', type=str, help='''Send the summarize requests to this URL instead of to 
+OpenAI, e.g. "http://localhost:8000/v1" for another 
+server that speaks the same chat completions API 
+(like bench/stub_openai.py, for testing).
 ''')
 
     config = vars(parser.parse_args(args))
+    from windowing import WINDOW_OVERLAP
+    if config.get('windowMinutes') and config['windowMinutes'] * 60 <= WINDOW_OVERLAP:
+        parser.error(f"--windowMinutes has to be 0 (off) or longer than the {WINDOW_OVERLAP:g} second overlap between windows.")
     
     return config
\ No newline at end of file
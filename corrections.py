@@ -0,0 +1,56 @@
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+class CorrectionsMatcher:
+    """
+    All of the corrections compiled into a single regular expression, so that each line is only
+    scanned once no matter how many corrections there are. Where more than one correction could
+    match at the same spot, the longest one wins.
+    """
+    def __init__(self, corrections: Dict[str, str], whole_words: bool = False, ignore_case: bool = False):
+        self.ignore_case = ignore_case
+        self.replacements = {}
+        # how each one was actually written, for the report
+        self.spellings = {}
+        for incorrect, correct in corrections.items():
+            if incorrect:
+                key = incorrect.lower() if ignore_case else incorrect
+                self.replacements[key] = correct
+                self.spellings[key] = incorrect
+        self.hits = Counter()
+
+        # python's regex alternation takes the first alternative that matches rather than the
+        # longest, so the longest ones have to go first
+        patterns = sorted(self.replacements, key=len, reverse=True)
+        alternation = "|".join(re.escape(pattern) for pattern in patterns)
+        if whole_words:
+            alternation = rf"(?<!\w)(?:{alternation})(?!\w)"
+        self.regex = re.compile(alternation, re.IGNORECASE if ignore_case else 0) if patterns else None
+
+    def _replace(self, match) -> str:
+        key = match.group(0).lower() if self.ignore_case else match.group(0)
+        self.hits[key] += 1
+        return self.replacements[key]
+
+    def apply(self, text: str) -> str:
+        if self.regex is None:
+            return text
+        return self.regex.sub(self._replace, text)
+
+    def report(self) -> List[Tuple[str, str, int]]:
+        """
+        (incorrect, correct, times replaced) for every correction, most used first.
+        """
+        return sorted(((self.spellings[key], correct, self.hits[key]) for key, correct in self.replacements.items()),
+                      key=lambda entry: entry[2], reverse=True)
+
+def print_corrections_report(matcher: CorrectionsMatcher):
+    report = matcher.report()
+    used = [entry for entry in report if entry[2] > 0]
+    total = sum(count for _, _, count in used)
+    print(f"  Made {total} correction{'s' if total != 1 else ''} using {len(used)} of {len(report)} entries{':' if used else '.'}")
+    if used:
+        count_width = len(str(used[0][2]))
+        for incorrect, correct, count in used:
+            print(f"   {str(count).rjust(count_width)}x  \"{incorrect}\" -> \"{correct}\"")
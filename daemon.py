@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence
+
+from session_runner import SessionRunner, STEPS, fingerprint_files
+from utils import get_cache_dir, write_file_atomically
+
+# what the daemon remembers about each session it has run, inside that session's .tasmas folder
+STATUS_FILE = 'daemon.json'
+# how long to wait before trying to load the models again, if they wouldn't load
+WARM_UP_RETRY_SECONDS = 60
+
+class Daemon:
+    """
+    Watches a drop folder for session folders (one folder of audio files per session, as Craig
+    gives them), and once a new one has stopped changing, queues it up to be recognized and
+    assembled. Jobs run one at a time on a single worker thread, all with the same loaded models.
+    A session is only picked up again by the watcher if its audio files change.
+    """
+    def __init__(self, drop_dir: str, runner: SessionRunner, audio_ext: str = 'ogg', poll_seconds: float = 30, settle_seconds: float = 60):
+        self.drop_dir = os.path.abspath(drop_dir)
+        self.runner = runner
+        self.audio_ext = audio_ext
+        self.poll_seconds = poll_seconds
+        self.settle_seconds = settle_seconds
+        self.jobs: Dict[int, Dict] = {}
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.models_ready = False
+        # why the models wouldn't load last time they were tried, if they wouldn't
+        self.models_error = None
+
+    def fingerprint(self, session_dir: str) -> List:
+        return fingerprint_files(session_dir, self.audio_ext)
+
+    def read_status(self, session_dir: str) -> Optional[Dict]:
+        path = os.path.join(session_dir, '.tasmas', STATUS_FILE)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_status(self, session_dir: str, job: Dict, fingerprint: List):
+        status = {key: job[key] for key in ('status', 'steps', 'started_at', 'finished_at', 'error')}
+        status['fingerprint'] = fingerprint
+        write_file_atomically(os.path.join(get_cache_dir(session_dir), STATUS_FILE), json.dumps(status, indent=2))
+
+    def find_active_job(self, session_dir: str) -> Optional[Dict]:
+        for job in self.jobs.values():
+            if job['session'] == session_dir and job['status'] in ('queued', 'running'):
+                return job
+        return None
+
+    def submit(self, session_dir: str, steps: Sequence[str] = STEPS, source: str = 'api') -> Dict:
+        session_dir = os.path.abspath(os.path.join(self.drop_dir, session_dir))
+        if not os.path.isdir(session_dir):
+            raise ValueError(f"{session_dir} is not a folder.")
+        unknown = [step for step in steps if step not in STEPS]
+        if unknown:
+            raise ValueError(f"Unknown step{'s' if len(unknown) != 1 else ''} {', '.join(unknown)} (expected {', '.join(STEPS)}).")
+        with self.lock:
+            # asking for a session that's already waiting (or running) just gets that job back
+            active = self.find_active_job(session_dir)
+            if active is not None:
+                return active
+            job = {
+                'id': len(self.jobs) + 1,
+                'session': session_dir,
+                'steps': list(steps),
+                'source': source,
+                'status': 'queued',
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'error': None,
+            }
+            self.jobs[job['id']] = job
+        self.queue.put(job['id'])
+        print(f" Queued job {job['id']}: {', '.join(job['steps'])} for {session_dir} ({source}).")
+        return job
+
+    def scan(self):
+        """
+        Queues any session folder in the drop folder that has audio files which haven't changed for
+        settle_seconds (so aren't still being copied in) and that hasn't been run with those files yet.
+        """
+        for entry in sorted(os.scandir(self.drop_dir), key=lambda entry: entry.name):
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            fingerprint = self.fingerprint(entry.path)
+            if not fingerprint:
+                continue
+            newest = max(mtime_ns for _, _, mtime_ns in fingerprint) / 1e9
+            if time.time() - newest < self.settle_seconds:
+                continue
+            status = self.read_status(entry.path)
+            if status is not None and status.get('fingerprint') == fingerprint:
+                continue
+            with self.lock:
+                if self.find_active_job(os.path.abspath(entry.path)) is not None:
+                    continue
+            self.submit(entry.path, STEPS, source='watch')
+
+    def watch(self):
+        while True:
+            try:
+                self.scan()
+            except Exception as ex:
+                print(f" Could not scan {self.drop_dir}: {str(ex)}")
+            time.sleep(self.poll_seconds)
+
+    def warm_up(self):
+        # jobs stay queued until the models are loaded, rather than each failing (and so never being picked up again)
+        while True:
+            try:
+                self.runner.warm_up()
+                break
+            except Exception as ex:
+                self.models_error = str(ex)
+                print(f" Could not load the models ({str(ex)}), so trying again in {WARM_UP_RETRY_SECONDS}s. Any jobs will wait until then.")
+                time.sleep(WARM_UP_RETRY_SECONDS)
+        self.models_error = None
+        self.models_ready = True
+
+    def work(self):
+        self.warm_up()
+        while True:
+            job = self.jobs[self.queue.get()]
+            session_dir = job['session']
+            fingerprint = self.fingerprint(session_dir)
+            job['status'] = 'running'
+            job['started_at'] = time.time()
+            print(f" Starting job {job['id']} for {session_dir}...")
+            try:
+                self.runner.run(session_dir, job['steps'])
+                job['status'] = 'done'
+            except Exception as ex:
+                job['status'] = 'failed'
+                job['error'] = str(ex)
+                print(f" Job {job['id']} failed: {str(ex)}")
+            job['finished_at'] = time.time()
+            try:
+                self.write_status(session_dir, job, fingerprint)
+            except OSError as ex:
+                print(f" Could not save the status of {session_dir}: {str(ex)}")
+            print(f" Finished job {job['id']} ({job['status']}) in {job['finished_at'] - job['started_at']:.0f}s.")
+
+    def status(self) -> Dict:
+        with self.lock:
+            jobs = [dict(job) for job in self.jobs.values()]
+        return {
+            'drop_dir': self.drop_dir,
+            'started_at': self.started_at,
+            'models_ready': self.models_ready,
+            'models_error': self.models_error,
+            'queued': sum(1 for job in jobs if job['status'] == 'queued'),
+            'running': next((job['id'] for job in jobs if job['status'] == 'running'), None),
+            'jobs': jobs,
+        }
+
+class ControlHandler(BaseHTTPRequestHandler):
+    """
+    GET /status (or /jobs) for everything, GET /jobs/<id> for one job, and POST /jobs with
+    {"session": "<folder, relative to the drop folder or absolute>", "steps": ["recognize", "assemble"]}
+    to queue one up.
+    """
+    daemon: Daemon = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        content = json.dumps(body, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        path = self.path.rstrip('/')
+        if path in ('', '/status', '/jobs'):
+            self.send_json(200, self.daemon.status())
+        elif path.startswith('/jobs/') and path[len('/jobs/'):].isdigit():
+            job = self.daemon.jobs.get(int(path[len('/jobs/'):]))
+            self.send_json(200, job) if job else self.send_json(404, {'error': 'No such job.'})
+        else:
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not request.get('session'):
+                raise ValueError('"session" is required.')
+            job = self.daemon.submit(request['session'], request.get('steps', STEPS))
+        except ValueError as ex:
+            self.send_json(400, {'error': str(ex)})
+            return
+        self.send_json(202, job)
+
+def run_daemon(drop_dir: str, config: Dict):
+    print()
+    print("--------------------")
+    print("DAEMON")
+    print("--------------------")
+    print()
+
+    daemon = Daemon(drop_dir, SessionRunner(config), (config.get('extension') or 'ogg').strip() or 'ogg',
+                    config.get('pollSeconds', 30), config.get('settleSeconds', 60))
+    handler = type('BoundControlHandler', (ControlHandler,), {'daemon': daemon})
+    # only ever on localhost, since anyone who can reach it can make it run things
+    server = ThreadingHTTPServer(('127.0.0.1', config.get('port', 8765)), handler)
+
+    threading.Thread(target=daemon.work, name='worker', daemon=True).start()
+    threading.Thread(target=daemon.watch, name='watcher', daemon=True).start()
+    print(f" Watching {daemon.drop_dir} for new sessions, with the control API at http://127.0.0.1:{server.server_address[1]}/status")
+    print()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print()
+        print(" Stopping.")
+    finally:
+        server.server_close()
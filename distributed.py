@@ -0,0 +1,502 @@
+import os
+import json
+import glob
+import time
+import uuid
+import shutil
+import socket
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from batch import find_sessions
+from manifest import RecognizeManifest
+from tasmas import load_names
+from utils import get_user_cache_dir, file_sha256
+
+# how long a worker has a job for, unless it checks in again before then
+LEASE_SECONDS = 120
+# how many times a job is handed out before it's given up on
+MAX_ATTEMPTS = 3
+# how long a worker with nothing to do waits before asking again
+IDLE_SECONDS = 2
+# how long the coordinator keeps answering once everything's done, so that the workers hear that it's over
+FINISH_GRACE_SECONDS = 10
+# how many times in a row a worker can fail to reach the coordinator before it gives up
+MAX_CONNECT_FAILURES = 10
+
+class Coordinator:
+    """
+    Hands out the audio files that need recognizing (in one session folder, or in each of a folder
+    of them) to whichever workers ask, and writes each one's .words.json into its session folder,
+    along with its manifest entry, when a worker sends back the results. Each job is leased to one
+    worker at a time, and the worker has to check in before its lease runs out; if it doesn't (it
+    crashed, or its machine went away), the job goes back in the queue for the next worker that
+    asks, up to max_attempts times in all.
+    """
+    def __init__(self, settings: Dict, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.settings = settings
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.jobs: Dict[int, Dict] = {}
+        self.manifests: Dict[str, RecognizeManifest] = {}
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+
+    def add_session(self, session_dir: str, names: Dict[str, str], audio_ext: str) -> Tuple[int, int]:
+        # queues up whatever recognize itself would transcribe, returning how many were reused and kept
+        from recognize import check_files
+
+        files = glob.glob(os.path.join(session_dir, f'*.{audio_ext}'))
+        manifest = RecognizeManifest(session_dir)
+        files_to_do, reused, kept = check_files(manifest, files, names, audio_ext, self.settings)
+        self.manifests[session_dir] = manifest
+        # the biggest files go first so that one long file doesn't end up running alone at the end
+        for audio_file in sorted(files_to_do, key=os.path.getsize, reverse=True):
+            job_id = len(self.jobs) + 1
+            self.jobs[job_id] = {
+                'id': job_id,
+                'session': session_dir,
+                'audio_file': audio_file,
+                'audio_sha256': files_to_do[audio_file],
+                'audio_size': os.path.getsize(audio_file),
+                'status': 'pending',
+                'attempts': 0,
+                'worker': None,
+                'lease': None,
+                # every lease it's been given out under, as results are still taken from an earlier one
+                'leases': [],
+                'lease_expires_at': None,
+                'started_at': None,
+                'finished_at': None,
+                'error': None,
+            }
+        return reused, kept
+
+    def finished(self) -> bool:
+        with self.lock:
+            return all(job['status'] in ('done', 'failed') for job in self.jobs.values())
+
+    def expire_leases(self):
+        # (with the lock held)
+        now = time.time()
+        for job in self.jobs.values():
+            if job['status'] != 'leased' or job['lease_expires_at'] > now:
+                continue
+            if job['attempts'] >= self.max_attempts:
+                job['status'] = 'failed'
+                job['error'] = f"No results after {job['attempts']} attempts (the last with {job['worker']})."
+                job['finished_at'] = now
+                print(f" Giving up on job {job['id']} ({job['audio_file']}), as {job['worker']} stopped checking in and that was attempt {job['attempts']}.")
+            else:
+                job['status'] = 'pending'
+                print(f" {job['worker']} stopped checking in on job {job['id']} ({job['audio_file']}), so it's going back in the queue.")
+            job['lease'] = None
+
+    def lease(self, worker: str) -> Optional[Dict]:
+        with self.lock:
+            self.expire_leases()
+            job = next((job for job in self.jobs.values() if job['status'] == 'pending'), None)
+            if job is None:
+                return None
+            job['status'] = 'leased'
+            job['worker'] = worker
+            job['lease'] = uuid.uuid4().hex
+            job['leases'].append(job['lease'])
+            job['lease_expires_at'] = time.time() + self.lease_seconds
+            job['attempts'] += 1
+            job['started_at'] = time.time()
+            print(f" Job {job['id']} ({job['audio_file']}) goes to {worker} (attempt {job['attempts']}).")
+            return {
+                'id': job['id'],
+                'lease': job['lease'],
+                'lease_seconds': self.lease_seconds,
+                'audio_file': job['audio_file'],
+                'audio_sha256': job['audio_sha256'],
+                'audio_size': job['audio_size'],
+                'settings': self.settings,
+            }
+
+    def holds_lease(self, job_id: int, lease: Optional[str]) -> bool:
+        job = self.jobs.get(job_id)
+        return job is not None and job['status'] == 'leased' and lease is not None and job['lease'] == lease
+
+    def heartbeat(self, job_id: int, lease: str) -> bool:
+        with self.lock:
+            if not self.holds_lease(job_id, lease):
+                return False
+            self.jobs[job_id]['lease_expires_at'] = time.time() + self.lease_seconds
+            return True
+
+    def fail(self, job_id: int, lease: str, error: str):
+        with self.lock:
+            if not self.holds_lease(job_id, lease):
+                return
+            job = self.jobs[job_id]
+            job['error'] = error
+            job['lease'] = None
+            if job['attempts'] >= self.max_attempts:
+                job['status'] = 'failed'
+                job['finished_at'] = time.time()
+                print(f" Giving up on job {job_id} ({job['audio_file']}) after {job['attempts']} attempts, the last failing on {job['worker']}: {error}")
+            else:
+                job['status'] = 'pending'
+                print(f" Job {job_id} ({job['audio_file']}) failed on {job['worker']}, so it's going back in the queue: {error}")
+
+    def complete(self, job_id: int, worker: str, lease: Optional[str], audio_sha256: str, results: Dict) -> bool:
+        """
+        Saves the results for a job, returning False if they weren't needed. Results are taken from
+        any worker the job was leased to (even one whose lease has since run out) as long as they're
+        for the same audio, since they're just as good, and only the first to arrive gets saved.
+        """
+        from recognize import save_results
+
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return False
+            if lease is None or lease not in job['leases']:
+                raise ValueError(f"That isn't a lease job {job_id} was given out under.")
+            if job['status'] == 'done' or job.get('saving'):
+                return False
+            if audio_sha256 != job['audio_sha256']:
+                raise ValueError(f"Those results are for different audio than job {job_id}'s.")
+            job['saving'] = True
+        try:
+            json_file = save_results(job['session'], job['audio_file'], results)
+            with self.lock:
+                self.manifests[job['session']].record(job['audio_file'], job['audio_sha256'], self.settings, json_file)
+                job['status'] = 'done'
+                job['worker'] = worker
+                job['lease'] = None
+                job['error'] = None
+                job['finished_at'] = time.time()
+        finally:
+            job['saving'] = False
+        print(f" Saved {json_file} from {worker} ({job['finished_at'] - job['started_at']:.0f}s).")
+        return True
+
+    def audio_path(self, job_id: int, lease: Optional[str]) -> Optional[str]:
+        # only whoever holds the lease gets to download the audio
+        with self.lock:
+            return self.jobs[job_id]['audio_file'] if self.holds_lease(job_id, lease) else None
+
+    def status(self) -> Dict:
+        with self.lock:
+            jobs = [{key: value for key, value in job.items() if key not in ('lease', 'leases', 'saving')} for job in self.jobs.values()]
+        counts = {}
+        for job in jobs:
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {
+            'started_at': self.started_at,
+            'settings': self.settings,
+            'counts': counts,
+            'finished': all(job['status'] in ('done', 'failed') for job in jobs),
+            'jobs': jobs,
+        }
+
+    def print_report(self):
+        jobs = list(self.jobs.values())
+        by_worker = {}
+        for job in jobs:
+            if job['status'] == 'done':
+                by_worker[job['worker']] = by_worker.get(job['worker'], 0) + 1
+        for job in jobs:
+            if job['status'] == 'failed':
+                print(f" - {job['audio_file']} failed: {job['error']}")
+        done = sum(1 for job in jobs if job['status'] == 'done')
+        print(f" Transcribed {done} of {len(jobs)} files"
+              f"{' (' + ', '.join(f'{count} by {worker}' for worker, count in sorted(by_worker.items())) + ')' if by_worker else ''}.")
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    """
+    POST /lease with {"worker": "<name>"} for the next job (or {"job": null}), then for that job,
+    GET /jobs/<id>/audio?lease=<lease> for its audio, POST /jobs/<id>/heartbeat with {"lease"} to
+    keep the lease, and POST /jobs/<id>/result with {"worker", "lease", "audio_sha256", "results"} or
+    POST /jobs/<id>/fail with {"lease", "error"} when it's done. GET /status shows how it's going.
+    """
+    coordinator: Coordinator = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        content = json.dumps(body, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def job_path(self, path: str) -> Tuple[Optional[int], Optional[str]]:
+        # /jobs/<id>/<action>
+        parts = path.strip('/').split('/')
+        if len(parts) == 3 and parts[0] == 'jobs' and parts[1].isdigit() and int(parts[1]) in self.coordinator.jobs:
+            return int(parts[1]), parts[2]
+        return None, None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        if url.path.rstrip('/') in ('', '/status'):
+            self.send_json(200, self.coordinator.status())
+            return
+        job_id, action = self.job_path(url.path)
+        if action != 'audio':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        audio_file = self.coordinator.audio_path(job_id, urllib.parse.parse_qs(url.query).get('lease', [None])[0])
+        if audio_file is None:
+            self.send_json(409, {'error': "That lease isn't current."})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(os.path.getsize(audio_file)))
+        self.end_headers()
+        with open(audio_file, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            self.send_json(400, {'error': 'The body has to be JSON.'})
+            return
+        coordinator = self.coordinator
+        if self.path.rstrip('/') == '/lease':
+            job = coordinator.lease(request.get('worker') or self.client_address[0])
+            self.send_json(200, {'job': job, 'finished': job is None and coordinator.finished(), 'retry_after': IDLE_SECONDS})
+            return
+        job_id, action = self.job_path(self.path)
+        if action == 'heartbeat':
+            if coordinator.heartbeat(job_id, request.get('lease')):
+                self.send_json(200, {'lease_seconds': coordinator.lease_seconds})
+            else:
+                self.send_json(409, {'error': "That lease isn't current."})
+        elif action == 'fail':
+            coordinator.fail(job_id, request.get('lease'), str(request.get('error')))
+            self.send_json(200, {})
+        elif action == 'result':
+            try:
+                if not isinstance(request.get('results'), dict) or not isinstance(request['results'].get('segments'), list):
+                    raise ValueError('"results" has to be a whisper_timestamped result.')
+                saved = coordinator.complete(job_id, request.get('worker') or self.client_address[0], request.get('lease'),
+                                             request.get('audio_sha256'), request['results'])
+            except ValueError as ex:
+                self.send_json(400, {'error': str(ex)})
+                return
+            except OSError as ex:
+                # (the job stays leased, so it goes to someone else if this doesn't get sorted out)
+                self.send_json(500, {'error': f"Couldn't save the results: {str(ex)}"})
+                return
+            self.send_json(200, {'saved': saved})
+        else:
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+
+def run_coordinator(input_dir: str, config: Dict):
+    from recognize import get_settings, get_model_type, DEFAULT_ENGINE
+
+    print()
+    print("--------------------")
+    print("COORDINATOR")
+    print("--------------------")
+    print()
+
+    audio_ext = (config.get('extension') or 'ogg').strip() or 'ogg'
+    input_dir = os.path.abspath(input_dir)
+    # either a session folder, or a folder of them
+    sessions = [input_dir] if glob.glob(os.path.join(input_dir, f'*.{audio_ext}')) else find_sessions(input_dir, audio_ext)
+    if not sessions:
+        print(f" No {audio_ext} files (or session folders with them in) were found at {input_dir}.")
+        return
+    if config.get('batchSegments', 0) > 1:
+        print(" (Each worker transcribes a whole file at a time, so --batchSegments doesn't apply.)")
+
+    # the same settings recognize would use, so that what the workers do counts as up to date for it too
+    settings = get_settings(get_model_type(config.get('fast', False)), config.get('fast', False), config.get('vadPrepass', False),
+                            config.get('windowMinutes', 0), config.get('engine', DEFAULT_ENGINE), False,
+                            config.get('tiered', False), config.get('tieredConfidence', 0.6))
+    coordinator = Coordinator(settings, config.get('leaseSeconds', LEASE_SECONDS), config.get('maxAttempts', MAX_ATTEMPTS))
+    reused = 0
+    kept = 0
+    for session_dir in sessions:
+        print(f" {session_dir}:")
+        # nobody to ask, so like the daemon, names.json is used if it's there and nobody is asked about anyone
+        names = load_names(config.get('names'), session_dir, interactive=False) or {}
+        session_reused, session_kept = coordinator.add_session(session_dir, names, audio_ext)
+        reused += session_reused
+        kept += session_kept
+    print(f" {len(coordinator.jobs)} files to transcribe, {reused} up to date and {kept} edited .words.json file{'s' if kept != 1 else ''} kept.")
+    print()
+    if not coordinator.jobs:
+        return
+
+    handler = type('BoundCoordinatorHandler', (CoordinatorHandler,), {'coordinator': coordinator})
+    # only on localhost unless told otherwise, since anyone who can reach it can download the audio (with a lease)
+    server = ThreadingHTTPServer((config.get('host') or '127.0.0.1', config.get('port', 8765)), handler)
+    threading.Thread(target=server.serve_forever, name='coordinator', daemon=True).start()
+    print(f" Waiting for workers at http://{server.server_address[0]}:{server.server_address[1]} (tasmas worker http://<this machine>:{server.server_address[1]})...")
+    print()
+    try:
+        while not coordinator.finished():
+            time.sleep(1)
+            with coordinator.lock:
+                coordinator.expire_leases()
+        # so that workers asking for more hear that there isn't any, rather than finding nobody there
+        time.sleep(FINISH_GRACE_SECONDS)
+    except KeyboardInterrupt:
+        print()
+        print(" Stopping.")
+    finally:
+        server.shutdown()
+        server.server_close()
+    print()
+    coordinator.print_report()
+    print("--------------------")
+
+class Worker:
+    """
+    Asks a coordinator for jobs, one at a time, and sends back the results. The audio is read
+    straight from its path if this machine can see it (the same machine, or a shared folder),
+    and downloaded from the coordinator otherwise. The engine and settings come from the
+    coordinator, so every worker's results come out the same.
+    """
+    def __init__(self, coordinator_url: str, name: Optional[str] = None, threads: int = 0):
+        self.url = coordinator_url.rstrip('/')
+        if '://' not in self.url:
+            self.url = 'http://' + self.url
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.threads = threads
+        # downloaded audio, and the caches transcribing it makes (speech regions, window checkpoints),
+        # in a folder per job
+        self.work_dir = get_user_cache_dir('worker')
+
+    def request(self, method: str, path: str, body: Optional[Dict] = None, timeout: float = 60) -> Tuple[int, Dict]:
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return response.status, json.loads(response.read() or b'{}')
+        except urllib.error.HTTPError as ex:
+            try:
+                return ex.code, json.loads(ex.read() or b'{}')
+            except ValueError:
+                return ex.code, {}
+
+    def job_dir(self, job: Dict) -> str:
+        # named by the audio's hash, as the caches go by the file's name, and files from different sessions
+        # (or workers on the same machine) often have the same one; this way a retry of the same audio
+        # here can still pick up its window checkpoints
+        job_dir = os.path.join(self.work_dir, job['audio_sha256'][:16])
+        os.makedirs(job_dir, exist_ok=True)
+        return job_dir
+
+    def fetch_audio(self, job: Dict, job_dir: str) -> Tuple[str, bool]:
+        # the audio's path, and whether it's a download to be cleaned up afterwards
+        audio_file = job['audio_file']
+        # a file at the same path here isn't necessarily the same file (another machine's folder
+        # layout, or a copy that's since been changed), so it only counts if its hash matches
+        if (os.path.exists(audio_file) and os.path.getsize(audio_file) == job['audio_size']
+                and file_sha256(audio_file) == job['audio_sha256']):
+            return audio_file, False
+        path = os.path.join(job_dir, os.path.basename(audio_file))
+        query = urllib.parse.urlencode({'lease': job['lease']})
+        with urllib.request.urlopen(f"{self.url}/jobs/{job['id']}/audio?{query}", timeout=60) as response, open(path + '.tmp', 'wb') as f:
+            shutil.copyfileobj(response, f)
+        os.replace(path + '.tmp', path)
+        return path, True
+
+    def keep_lease(self, job: Dict, stop: threading.Event):
+        while not stop.wait(job['lease_seconds'] / 3):
+            try:
+                status, _ = self.request('POST', f"/jobs/{job['id']}/heartbeat", {'lease': job['lease']}, timeout=30)
+            except OSError:
+                # it'll get another go next time round, well before the lease runs out
+                continue
+            if status == 409:
+                print(f"  Lost the lease on job {job['id']}, but carrying on, as the results are still worth sending.")
+                return
+
+    def do_job(self, job: Dict):
+        from recognize import transcribe_audio_file, load_engine, DEFAULT_ENGINE
+
+        settings = job['settings']
+        print(f" - Job {job['id']}: {job['audio_file']}...")
+        stop = threading.Event()
+        threading.Thread(target=self.keep_lease, args=(job, stop), daemon=True).start()
+        audio_file = None
+        downloaded = False
+        started = time.perf_counter()
+        job_dir = self.job_dir(job)
+        try:
+            audio_file, downloaded = self.fetch_audio(job, job_dir)
+            recognition_engine = load_engine(settings.get('engine', DEFAULT_ENGINE), settings['model_type'], threads=self.threads)
+            results = transcribe_audio_file(recognition_engine, job_dir, audio_file, job['audio_sha256'], settings)
+        except Exception as ex:
+            stop.set()
+            print(f"  Failed: {str(ex)}")
+            try:
+                self.request('POST', f"/jobs/{job['id']}/fail", {'lease': job['lease'], 'error': str(ex)})
+            except OSError:
+                # it'll go to someone else once the lease runs out anyway
+                pass
+            return
+        finally:
+            if downloaded and os.path.exists(audio_file):
+                os.remove(audio_file)
+        # keep the lease going until the coordinator has them, as a big result takes a while to send
+        try:
+            status, reply = self.request('POST', f"/jobs/{job['id']}/result",
+                                         {'worker': self.name, 'lease': job['lease'], 'audio_sha256': job['audio_sha256'], 'results': results}, timeout=600)
+        except OSError as ex:
+            status, reply = None, {'error': str(ex)}
+        finally:
+            stop.set()
+        if status != 200:
+            print(f"  The coordinator didn't take the results: {reply.get('error')}")
+        else:
+            # the checkpoints are no use to anyone once the coordinator has the results
+            shutil.rmtree(job_dir, ignore_errors=True)
+            print(f"  Done in {time.perf_counter() - started:.0f}s{'' if reply.get('saved') else ' (but somebody else got there first)'}.")
+
+    def run(self):
+        failures = 0
+        while True:
+            try:
+                status, reply = self.request('POST', '/lease', {'worker': self.name}, timeout=30)
+            except OSError as ex:
+                failures += 1
+                if failures >= MAX_CONNECT_FAILURES:
+                    print(f" Could not reach the coordinator at {self.url} ({str(ex)}), so stopping.")
+                    return
+                time.sleep(IDLE_SECONDS * failures)
+                continue
+            failures = 0
+            job = reply.get('job') if status == 200 else None
+            if job is None:
+                if reply.get('finished'):
+                    print(" Nothing left to do.")
+                    return
+                time.sleep(reply.get('retry_after', IDLE_SECONDS))
+                continue
+            self.do_job(job)
+
+def run_worker(coordinator_url: str, config: Dict):
+    print()
+    print("--------------------")
+    print("WORKER")
+    print("--------------------")
+    print()
+
+    worker = Worker(coordinator_url, config.get('workerName'), config.get('threads', 0))
+    print(f" {worker.name} taking jobs from {worker.url}...")
+    print()
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        # whatever it was working on goes to somebody else once its lease runs out
+        print()
+        print(" Stopping.")
+    print("--------------------")
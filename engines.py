@@ -0,0 +1,209 @@
+import bisect
+import zlib
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from audio import SAMPLE_RATE
+
+DEFAULT_ENGINE = 'whisper'
+
+class RecognitionEngine:
+    """
+    Something that can turn 16kHz mono audio into words with timestamps. Whatever the engine, the
+    results are in the same shape whisper_timestamped gives them (and so what goes into a
+    .words.json): {"text", "segments": [{..., "words": [{"text", "start", "end", "confidence"}]}],
+    "language"}, so nothing after recognize needs to know which one was used.
+    """
+    name = None
+    default_device = 'cpu'
+    # whether it's worth warning that there's no GPU
+    uses_gpu = False
+
+    def __init__(self, model_type: str, device: Optional[str] = None, threads: int = 0):
+        self.model_type = model_type
+        self.device = device or self.default_device
+        # 0 leaves it up to the engine
+        self.threads = threads or 0
+        self.model = None
+
+    def load(self):
+        if self.model is None:
+            self.model = self.load_model()
+        return self
+
+    def load_model(self):
+        raise NotImplementedError
+
+    def transcribe(self, audio: np.ndarray, decode_params: Dict) -> Dict:
+        """
+        decode_params are whisper_timestamped's; each engine makes what it can of them.
+        """
+        raise NotImplementedError
+
+    def transcribe_batch(self, audios: List[np.ndarray], decode_params: Dict) -> List[Dict]:
+        """
+        The results for each of several short pieces of audio (each one's times starting from 0).
+        Engines that can run the model on several at once do; the rest just do them one at a time.
+        """
+        return [self.transcribe(audio, decode_params) for audio in audios]
+
+class WhisperEngine(RecognitionEngine):
+    # whisper_timestamped, on the GPU, which is what TASMAS has always used
+    name = 'whisper'
+    default_device = 'cuda'
+    uses_gpu = True
+
+    def load_model(self):
+        import whisper_timestamped as whisper
+        if self.threads:
+            import torch
+            torch.set_num_threads(self.threads)
+        return whisper.load_model(self.model_type, device=self.device)
+
+    def transcribe(self, audio: np.ndarray, decode_params: Dict) -> Dict:
+        import whisper_timestamped as whisper
+        return whisper.transcribe(self.model, audio, **decode_params)
+
+class FasterWhisperEngine(RecognitionEngine):
+    # the same whisper models run through CTranslate2 with int8 weights, which is a lot quicker on a CPU
+    name = 'faster-whisper'
+
+    # the silence put between pieces of audio that are decoded as one batch
+    BATCH_GAP_SECONDS = 1.0
+
+    def load_model(self):
+        from faster_whisper import WhisperModel
+        compute_type = 'int8' if self.device == 'cpu' else 'int8_float16'
+        return WhisperModel(self.model_type, device=self.device, compute_type=compute_type, cpu_threads=self.threads)
+
+    def decode_options(self, decode_params: Dict) -> Dict:
+        # (it has no equivalent of detect_disfluencies, so there won't be any [*] words)
+        temperature = decode_params.get('temperature', 0.0)
+        return {
+            "beam_size": decode_params.get('beam_size') or 1,
+            "best_of": decode_params.get('best_of') or 1,
+            "temperature": list(temperature) if isinstance(temperature, (list, tuple)) else temperature,
+            "word_timestamps": True,
+        }
+
+    def transcribe(self, audio: np.ndarray, decode_params: Dict) -> Dict:
+        segments, info = self.model.transcribe(audio, vad_filter=bool(decode_params.get('vad')), **self.decode_options(decode_params))
+        results_segments = []
+        for segment in segments:
+            words = [self.convert_word(word, 0.0) for word in (segment.words or [])]
+            results_segments.append(self.convert_segment(segment, words, len(results_segments)))
+        return {"text": "".join(segment['text'] for segment in results_segments), "segments": results_segments, "language": info.language}
+
+    def transcribe_batch(self, audios: List[np.ndarray], decode_params: Dict) -> List[Dict]:
+        try:
+            from faster_whisper import BatchedInferencePipeline
+        except ImportError:
+            # (versions before 1.1 can't batch)
+            return super().transcribe_batch(audios, decode_params)
+
+        # the pieces go in end to end with a gap between them, and are each given to it as a clip of their own
+        gap = np.zeros(int(self.BATCH_GAP_SECONDS * SAMPLE_RATE), dtype=np.float32)
+        pieces = []
+        clips = []
+        offsets = []
+        position = 0
+        for audio in audios:
+            if pieces:
+                pieces.append(gap)
+                position += len(gap)
+            clips.append({"start": position, "end": position + len(audio)})
+            offsets.append(position / SAMPLE_RATE)
+            pieces.append(audio)
+            position += len(audio)
+        segments, info = BatchedInferencePipeline(model=self.model).transcribe(
+            np.concatenate(pieces), clip_timestamps=clips, batch_size=len(audios), **self.decode_options(decode_params))
+
+        # neighbouring clips can end up decoded together, so each word goes back to whichever piece it starts in
+        results = [{"text": "", "segments": [], "language": info.language} for _ in audios]
+        for segment in segments:
+            by_piece = {}
+            for word in (segment.words or []):
+                index = max(0, bisect.bisect_right(offsets, word.start) - 1)
+                by_piece.setdefault(index, []).append(self.convert_word(word, offsets[index]))
+            for index, words in by_piece.items():
+                piece_segments = results[index]['segments']
+                piece_segments.append(self.convert_segment(segment, words, len(piece_segments)))
+        for piece_results in results:
+            piece_results['text'] = "".join(segment['text'] for segment in piece_results['segments'])
+        return results
+
+    def convert_word(self, word, offset: float) -> Dict:
+        return {"text": word.word.strip(), "start": round(word.start - offset, 2), "end": round(word.end - offset, 2), "confidence": round(word.probability, 3)}
+
+    def convert_segment(self, segment, words: List[Dict], index: int) -> Dict:
+        # the same fields whisper_timestamped gives a segment, with its times (and text) going by its words
+        return {
+            "id": index,
+            "seek": segment.seek,
+            "start": words[0]['start'] if words else round(segment.start, 2),
+            "end": words[-1]['end'] if words else round(segment.end, 2),
+            "text": " " + " ".join(word['text'] for word in words) if words else segment.text,
+            "tokens": list(segment.tokens),
+            "temperature": segment.temperature,
+            "avg_logprob": segment.avg_logprob,
+            "compression_ratio": segment.compression_ratio,
+            "no_speech_prob": segment.no_speech_prob,
+            "confidence": round(float(np.mean([word['confidence'] for word in words])), 3) if words else 0.0,
+            "words": words,
+        }
+
+class StubEngine(RecognitionEngine):
+    """
+    Doesn't recognize anything: it just finds where the audio is loud enough to be speech and makes
+    up words to fill it, the same ones every time. For trying out everything around recognize
+    (workers, windows, batch and daemon modes, assemble) without a model or a GPU.
+    """
+    name = 'stub'
+
+    FRAME_SECONDS = 0.02
+    THRESHOLD = 0.01
+    MAX_SILENCE = 0.3
+    WORD_SECONDS = 0.35
+    WORDS = ["well", "I", "think", "we", "should", "go", "to", "the", "tavern", "first", "and", "then", "find", "the", "wizard"]
+
+    def load_model(self):
+        return True
+
+    def speech_runs(self, audio: np.ndarray) -> List[Tuple[float, float]]:
+        frame = int(self.FRAME_SECONDS * SAMPLE_RATE)
+        count = len(audio) // frame
+        if count == 0:
+            return []
+        energy = np.sqrt(np.mean(np.square(audio[:count * frame].reshape(count, frame), dtype=np.float64), axis=1))
+        runs = []
+        for index in np.flatnonzero(energy > self.THRESHOLD):
+            start = index * self.FRAME_SECONDS
+            if runs and start - runs[-1][1] <= self.MAX_SILENCE:
+                runs[-1][1] = start + self.FRAME_SECONDS
+            else:
+                runs.append([start, start + self.FRAME_SECONDS])
+        return [(start, end) for start, end in runs]
+
+    def transcribe(self, audio: np.ndarray, decode_params: Dict) -> Dict:
+        segments = []
+        for start, end in self.speech_runs(audio):
+            count = max(1, int(round((end - start) / self.WORD_SECONDS)))
+            length = (end - start) / count
+            words = []
+            for index in range(count):
+                word_start = start + index * length
+                text = self.WORDS[zlib.crc32(f"{word_start:.2f}".encode()) % len(self.WORDS)]
+                words.append({"text": text + ("." if index == count - 1 else ""), "start": round(word_start, 2),
+                              "end": round(word_start + length, 2), "confidence": 1.0})
+            text = " " + " ".join(word['text'] for word in words)
+            segments.append({"id": len(segments), "seek": 0, "start": round(start, 2), "end": round(end, 2), "text": text,
+                             "tokens": [], "temperature": 0.0, "avg_logprob": 0.0, "compression_ratio": 1.0,
+                             "no_speech_prob": 0.0, "confidence": 1.0, "words": words})
+        return {"text": "".join(segment['text'] for segment in segments), "segments": segments, "language": "en"}
+
+ENGINES = {engine.name: engine for engine in [WhisperEngine, FasterWhisperEngine, StubEngine]}
+
+def create_engine(name: str, model_type: str, device: Optional[str] = None, threads: int = 0) -> RecognitionEngine:
+    if name not in ENGINES:
+        raise ValueError(f"Unknown recognition engine '{name}' (expected one of {', '.join(ENGINES)})")
+    return ENGINES[name](model_type, device, threads)
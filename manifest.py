@@ -0,0 +1,95 @@
+import os
+import json
+from typing import Dict, Optional, Tuple
+
+from utils import get_cache_dir, file_sha256, write_file_atomically
+
+# what the manifest says about a stem, as returned by RecognizeManifest.check
+NEW = 'new'                # never transcribed
+CURRENT = 'current'        # the .words.json is still valid for this audio and these settings
+STALE = 'stale'            # the audio or the settings have changed since it was transcribed
+EDITED = 'edited'          # the .words.json has been changed by hand since it was written
+UNRECORDED = 'unrecorded'  # there is a .words.json, but it wasn't written by a run that kept a manifest
+
+class RecognizeManifest:
+    """
+    Keeps track of which audio file (by hash), model and decode settings each .words.json in a
+    session was produced from, so that recognize can skip anything that is still up to date.
+    """
+    def __init__(self, input_dir: str):
+        self.path = os.path.join(get_cache_dir(input_dir), 'recognize_manifest.json')
+        self.stems = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.stems = json.load(f).get('stems', {})
+            except (OSError, ValueError):
+                print(f"  Could not read {self.path}, starting a new one.")
+
+    def save(self):
+        write_file_atomically(self.path, json.dumps({"version": 1, "stems": self.stems}, indent=2))
+
+    def audio_hash(self, audio_file: str) -> str:
+        # if the file hasn't been touched since it was hashed, don't read through the whole thing again
+        stat = os.stat(audio_file)
+        entry = self.stems.get(os.path.basename(audio_file))
+        if entry and entry.get('audio_size') == stat.st_size and entry.get('audio_mtime_ns') == stat.st_mtime_ns:
+            return entry['audio_sha256']
+        return file_sha256(audio_file)
+
+    def begin(self, files: Dict[str, str], settings: Dict):
+        """
+        Notes down the files (and the hashes of their audio) that are about to be transcribed, before
+        any of them are, so that a .words.json saved by a run that died before it could record it is
+        still known to be that run's, rather than being kept as unrecorded forever.
+        """
+        for audio_file, audio_sha256 in files.items():
+            json_file = audio_file + '.words.json'
+            entry = self.stems.setdefault(os.path.basename(audio_file), {})
+            entry['pending'] = {
+                'audio_sha256': audio_sha256,
+                'settings': normalize_settings(settings),
+                # so that the .words.json that was already there isn't mistaken for the new one
+                'previous_words_sha256': file_sha256(json_file) if os.path.exists(json_file) else None,
+            }
+        self.save()
+
+    def check(self, audio_file: str, settings: Dict) -> Tuple[str, Optional[str]]:
+        json_file = audio_file + '.words.json'
+        entry = self.stems.get(os.path.basename(audio_file))
+        audio_sha256 = self.audio_hash(audio_file)
+
+        pending = entry.get('pending') if entry else None
+        if (pending is not None and pending['audio_sha256'] == audio_sha256 and os.path.exists(json_file)
+                and file_sha256(json_file) != pending['previous_words_sha256']):
+            # saved by a run that didn't get as far as recording it, so it's recorded now
+            self.record(audio_file, audio_sha256, pending['settings'], json_file)
+            entry = self.stems[os.path.basename(audio_file)]
+        if entry is not None and 'words_sha256' not in entry:
+            # only ever begun
+            entry = None
+
+        if not os.path.exists(json_file):
+            return (NEW if entry is None else STALE), audio_sha256
+        if entry is None:
+            return UNRECORDED, audio_sha256
+        if file_sha256(json_file) != entry.get('words_sha256'):
+            return EDITED, audio_sha256
+        if entry.get('audio_sha256') != audio_sha256 or entry.get('settings') != normalize_settings(settings):
+            return STALE, audio_sha256
+        return CURRENT, audio_sha256
+
+    def record(self, audio_file: str, audio_sha256: str, settings: Dict, json_file: str):
+        stat = os.stat(audio_file)
+        self.stems[os.path.basename(audio_file)] = {
+            'audio_sha256': audio_sha256,
+            'audio_size': stat.st_size,
+            'audio_mtime_ns': stat.st_mtime_ns,
+            'settings': normalize_settings(settings),
+            'words_sha256': file_sha256(json_file),
+        }
+        self.save()
+
+def normalize_settings(settings: Dict) -> Dict:
+    # round trip through json so that tuples and lists compare equal to what was loaded from disk
+    return json.loads(json.dumps(settings, sort_keys=True))
@@ -0,0 +1,97 @@
+import os
+import glob
+import time
+import subprocess
+import numpy as np
+
+from audio import SAMPLE_RATE
+from utils import get_user_cache_dir
+
+# how long a half-written entry has to have gone untouched before it's taken to be left over from a run
+# that died, rather than still being written by another process sharing the cache
+STALE_TEMP_SECONDS = 3600
+
+class PcmCache:
+    """
+    Keeps the decoded 16kHz mono float32 audio of each file on disk, named by the hash of the source
+    file (so a changed file is simply a different entry), and hands it back memory-mapped rather than
+    read into memory. Once the entries add up to more than budget_bytes, the least recently used
+    ones are removed.
+    """
+    def __init__(self, budget_bytes: int):
+        self.directory = get_user_cache_dir('pcm')
+        self.budget_bytes = budget_bytes
+        self.remove_stale_temp_files()
+
+    def remove_stale_temp_files(self):
+        # they don't count towards the budget, so otherwise they'd pile up forever
+        cutoff = time.time() - STALE_TEMP_SECONDS
+        for path in glob.glob(os.path.join(self.directory, '*.f32.tmp')):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                # another process got to it first
+                continue
+
+    def path_for(self, audio_sha256: str) -> str:
+        return os.path.join(self.directory, f'{audio_sha256}.f32')
+
+    def load(self, audio_file: str, audio_sha256: str) -> np.ndarray:
+        path = self.path_for(audio_sha256)
+        if os.path.exists(path):
+            # the modified time doubles as the last used time for eviction
+            os.utime(path)
+        else:
+            decode_to_file(audio_file, path)
+            self.evict(keep=path)
+
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.float32)
+        # copy-on-write, so whisper is free to treat it like any other array without touching the file
+        return np.memmap(path, dtype=np.float32, mode='c')
+
+    def evict(self, keep: str):
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.f32')):
+            try:
+                entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                # another process got to it first
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.budget_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+def decode_to_file(audio_file: str, path: str, block_size: int = 1024 * 1024):
+    """
+    Streams the file through ffmpeg into `path` a block at a time, converting the samples exactly the
+    way whisper.load_audio does, so the whole file is never in memory at once.
+    """
+    command = ["ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0", "-i", audio_file,
+               "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(SAMPLE_RATE), "-"]
+    temp_path = path + '.tmp'
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process, open(temp_path, 'wb') as out:
+        leftover = b''
+        while True:
+            block = process.stdout.read(block_size)
+            if not block:
+                break
+            block = leftover + block
+            # samples are two bytes, so an odd byte has to wait for the next block
+            usable = len(block) - (len(block) % 2)
+            leftover = block[usable:]
+            out.write((np.frombuffer(block[:usable], np.int16).astype(np.float32) / 32768.0).tobytes())
+        errors = process.stderr.read()
+    if process.returncode != 0:
+        os.remove(temp_path)
+        raise RuntimeError(f"Failed to load audio from {audio_file}: {errors.decode()}")
+    os.replace(temp_path, path)
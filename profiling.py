@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+try:
+    import resource
+except ImportError:
+    # not on Windows, where the peak memory just isn't reported
+    resource = None
+
+REPORT_FILE = 'profile.json'
+TRACE_FILE = 'profile.trace.json'
+
+_profile = None
+
+class Profile:
+    """
+    Everything recorded during a --profile run: a list of timed stages (which can nest and overlap),
+    plus counters and lists of values that get summed up in the report.
+    """
+    def __init__(self, input_dir: str):
+        self.input_dir = input_dir
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.stages = []
+        self.counters: Dict[str, float] = {}
+        self.metrics: Dict[str, list] = {}
+        self.lock = threading.Lock()
+
+    def add_stage(self, name: str, start: float, wall: float, cpu: Optional[float] = None, lane=None, **args):
+        stage = {
+            'name': name,
+            'start_seconds': round(start - self.origin, 6),
+            'wall_seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6) if cpu is not None else None,
+            'lane': lane if lane is not None else threading.current_thread().name,
+        }
+        stage.update(args)
+        with self.lock:
+            self.stages.append(stage)
+
+    def count(self, name: str, amount: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record(self, name: str, value: float):
+        with self.lock:
+            self.metrics.setdefault(name, []).append(value)
+
+    def report(self) -> Dict:
+        totals = {}
+        for stage in self.stages:
+            total = totals.setdefault(stage['name'], {'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+            total['count'] += 1
+            total['wall_seconds'] = round(total['wall_seconds'] + stage['wall_seconds'], 6)
+            total['cpu_seconds'] = round(total['cpu_seconds'] + (stage['cpu_seconds'] or 0), 6)
+
+        metrics = {name: {'count': len(values), 'total': round(sum(values), 6), 'mean': round(sum(values) / len(values), 6),
+                          'min': round(min(values), 6), 'max': round(max(values), 6)}
+                   for name, values in self.metrics.items() if values}
+
+        report = {
+            'input_dir': self.input_dir,
+            'started_at': self.started_at,
+            'wall_seconds': round(time.perf_counter() - self.origin, 6),
+            'cpu_seconds': round(time.process_time(), 6),
+            'peak_rss_mb': get_peak_rss_mb(),
+            'stage_totals': totals,
+            'counters': self.counters,
+            'metrics': metrics,
+            'stages': self.stages,
+        }
+        # how many seconds of audio get transcribed per second of work
+        if 'recognize.audio_seconds' in metrics and metrics.get('recognize.compute_seconds', {}).get('total'):
+            report['recognize_real_time_factor'] = round(metrics['recognize.audio_seconds']['total'] / metrics['recognize.compute_seconds']['total'], 3)
+        # and with tiered decoding, how much of it had to be decoded a second time
+        if metrics.get('recognize.first_pass_seconds', {}).get('total'):
+            report['recognize_second_pass_share'] = round(metrics['recognize.second_pass_seconds']['total'] / metrics['recognize.first_pass_seconds']['total'], 3)
+        return report
+
+    def chrome_trace(self) -> Dict:
+        # one row in the trace viewer per thread or prompt, in the order they first show up
+        lanes = {}
+        events = []
+        for stage in self.stages:
+            tid = lanes.setdefault(stage['lane'], len(lanes) + 1)
+            args = {key: value for key, value in stage.items() if key not in ('name', 'start_seconds', 'wall_seconds', 'lane')}
+            events.append({'name': stage['name'], 'cat': stage['name'].split('.')[0], 'ph': 'X', 'pid': 1, 'tid': tid,
+                           'ts': int(stage['start_seconds'] * 1e6), 'dur': max(1, int(stage['wall_seconds'] * 1e6)), 'args': args})
+        for lane, tid in lanes.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': str(lane)}})
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'tasmas'}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def get_rss_mb() -> Optional[float]:
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return round(int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2, 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def get_peak_rss_mb() -> Optional[float]:
+    # the high water mark so far, of this process and (separately) of any worker processes that have finished
+    if resource is None:
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    scale = 1024 ** 2 if os.uname().sysname == 'Darwin' else 1024
+    return round(max(own, children) / scale, 1)
+
+def start(input_dir: str):
+    global _profile
+    _profile = Profile(input_dir)
+
+def enabled() -> bool:
+    return _profile is not None
+
+@contextmanager
+def stage(name: str, **args):
+    """
+    Times whatever runs inside it as a stage called name, when profiling; args end up in the report
+    alongside it, and more can be added to the yielded dict while it runs.
+    """
+    if _profile is None:
+        yield args
+        return
+    rss_start = get_rss_mb()
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield args
+    finally:
+        wall = time.perf_counter() - start_time
+        cpu = time.process_time() - start_cpu
+        _profile.add_stage(name, start_time, wall, cpu, rss_start_mb=rss_start, rss_end_mb=get_rss_mb(), peak_rss_mb=get_peak_rss_mb(), **args)
+        # so that whoever is using it can see how long it took, once it's done
+        args['wall_seconds'] = wall
+        args['cpu_seconds'] = cpu
+
+def add_stage(name: str, start: float, wall: float, cpu: Optional[float] = None, lane=None, **args):
+    # for a stage timed somewhere else (another process, or a coroutine that shares its thread with others)
+    if _profile is not None:
+        _profile.add_stage(name, start, wall, cpu, lane, **args)
+
+def count(name: str, amount: float = 1):
+    if _profile is not None:
+        _profile.count(name, amount)
+
+def record(name: str, value: float):
+    if _profile is not None:
+        _profile.record(name, value)
+
+def finish():
+    """
+    Writes the report and the Chrome trace (open it in chrome://tracing or ui.perfetto.dev) into the
+    session folder, and stops profiling.
+    """
+    global _profile
+    if _profile is None:
+        return
+    profile, _profile = _profile, None
+    report_path = os.path.join(profile.input_dir, REPORT_FILE)
+    trace_path = os.path.join(profile.input_dir, TRACE_FILE)
+    with open(report_path, 'w') as f:
+        json.dump(profile.report(), f, indent=2)
+    with open(trace_path, 'w') as f:
+        json.dump(profile.chrome_trace(), f)
+    print()
+    print(f" Profile saved as {report_path} (and {TRACE_FILE}, to open in chrome://tracing or ui.perfetto.dev).")
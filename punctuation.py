@@ -0,0 +1,133 @@
+import os
+import json
+import hashlib
+import warnings
+from typing import Dict, List
+
+from utils import get_cache_dir, write_file_atomically
+import profiling
+
+MODEL_NAME = "oliverguhr/fullstop-punctuation-multilang-large"
+# PunctuationModel.predict only sends a text to the model in one piece up to this many words
+CHUNK_SIZE = 230
+BATCH_SIZE = 16
+
+_model = None
+
+def load_punctuation_model():
+    # loaded at most once per process, and only once something actually needs it
+    global _model
+    if _model is None:
+        with profiling.stage('punctuation.load_model'):
+            from deepmultilingualpunctuation import PunctuationModel
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                _model = PunctuationModel(MODEL_NAME)
+    return _model
+
+def model_version() -> str:
+    try:
+        from importlib.metadata import version
+        package_version = version('deepmultilingualpunctuation')
+    except Exception:
+        package_version = 'unknown'
+    return f"{MODEL_NAME}@{package_version}"
+
+def restore_punctuation_batch(model, texts: List[str], batch_size: int = BATCH_SIZE) -> List[str]:
+    """
+    The same as calling model.restore_punctuation on each text, but with the texts sent through the
+    model's pipeline in batches rather than one at a time.
+    """
+    results = [None] * len(texts)
+    batched_words = []
+    batched_indexes = []
+    for index, text in enumerate(texts):
+        words = model.preprocess(text)
+        if 0 < len(words) <= CHUNK_SIZE:
+            batched_words.append(words)
+            batched_indexes.append(index)
+        else:
+            # too long to go in one piece (or nothing to punctuate), so let the model chunk it up itself
+            results[index] = model.restore_punctuation(text)
+            profiling.count('punctuation.unbatched_calls')
+
+    if batched_words:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            predictions = model.pipe([" ".join(words) for words in batched_words], batch_size=batch_size)
+        profiling.count('punctuation.pipe_calls')
+        profiling.count('punctuation.batched_texts', len(batched_words))
+        for index, words, prediction in zip(batched_indexes, batched_words, predictions):
+            results[index] = model.prediction_to_text(tag_words(words, prediction))
+
+    return results
+
+def tag_words(words: List[str], prediction: List[Dict]) -> List[list]:
+    # labels each word with the last label of any of its subtokens, as PunctuationModel.predict does
+    tagged_words = []
+    char_index = 0
+    result_index = 0
+    for word in words:
+        char_index += len(word) + 1
+        label = "0"
+        score = None
+        while result_index < len(prediction) and char_index > prediction[result_index]["end"]:
+            label = prediction[result_index]['entity']
+            score = prediction[result_index]['score']
+            result_index += 1
+        tagged_words.append([word, label, score])
+    return tagged_words
+
+class PunctuationCache:
+    """
+    Remembers the punctuation model's output for each text a session has sent through it, so that
+    re-running assemble after fixing up a .words.json doesn't have to run the model again.
+    """
+    def __init__(self, input_dir: str, version: str):
+        self.path = os.path.join(get_cache_dir(input_dir), 'punctuation_cache.json')
+        self.version = version
+        self.results = {}
+        self.changed = False
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    self.results = json.load(f)
+            except (OSError, ValueError):
+                print(f"  Could not read {self.path}, starting a new one.")
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.version}\n{text}".encode('utf-8')).hexdigest()
+
+    def get(self, text: str):
+        return self.results.get(self.key(text))
+
+    def put(self, text: str, result: str):
+        self.results[self.key(text)] = result
+        self.changed = True
+
+    def save(self):
+        if self.changed:
+            write_file_atomically(self.path, json.dumps(self.results))
+            self.changed = False
+
+def restore_punctuation_cached(input_dir: str, texts: List[str]) -> List[str]:
+    cache = PunctuationCache(input_dir, model_version())
+    results = [cache.get(text) for text in texts]
+    # the same text only needs to go through the model once
+    missing = list(dict.fromkeys(text for text, result in zip(texts, results) if result is None))
+    profiling.count('punctuation.cache_hits', len(texts) - len(missing))
+    profiling.count('punctuation.cache_misses', len(missing))
+    if len(missing) < len(texts):
+        print(f"  Reused {len(texts) - len(missing)} punctuation result{'s' if len(texts) - len(missing) != 1 else ''} from the cache.")
+
+    if missing:
+        print(f"  Running the punctuation model on {len(missing)} line{'s' if len(missing) != 1 else ''}...")
+        model = load_punctuation_model()
+        with profiling.stage('punctuation.run', texts=len(missing)):
+            repunctuated = restore_punctuation_batch(model, missing)
+        for text, result in zip(missing, repunctuated):
+            cache.put(text, result)
+        cache.save()
+        results = [cache.get(text) for text in texts]
+
+    return results
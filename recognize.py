@@ -1,21 +1,53 @@
 import os
 import json
 import glob
-from typing import Dict
-import whisper_timestamped as whisper
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
 
-from utils import extract_speaker_name
+from audio import SAMPLE_RATE, get_audio_duration, load_audio, load_audio_window
+from engines import RecognitionEngine, DEFAULT_ENGINE, create_engine
+from utils import extract_speaker_name, write_file_atomically, prefetch
+import profiling
+from pcm_cache import PcmCache
+from manifest import RecognizeManifest, CURRENT, EDITED, UNRECORDED
+from vad import VAD_PARAMS, find_speech_regions, load_speech_regions, pack_speech_regions, map_results_to_session_time
+from windowing import WindowCheckpoint, plan_windows, offset_results, merge_window_results
+from batching import StemResults, cut_speech_segments, plan_batches
+from tiered import MIN_SEGMENT_CONFIDENCE, redecode_weak_stretches
+from sidecar import write_sidecar, words_from_results
+from wordtable import StemWords
 
-def recognize(input_dir: str, names: Dict[str, str], fast: bool = False, model_type: str = "small", device: str = "cuda", audio_ext: str = "ogg"):
-    model_type = "tiny" if fast else model_type
-    model = whisper.load_model(model_type, device=device)
+# each worker process loads its own copy of the model once, in _init_worker
+_worker_engine = None
+_worker_settings = None
+_worker_pcm_cache = None
+
+MODEL_TYPE = "small"
+
+# engines (with their models) loaded in this process, by (engine, model type, device, threads)
+_engines = {}
+
+def get_decode_params(fast: bool) -> Dict:
+    if fast:
+        return {"detect_disfluencies": True, "vad": "auditok"}
+    return {"detect_disfluencies": True, "vad": "auditok", "beam_size": 5, "best_of": 5, "temperature": (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)}
+
+def recognize(input_dir: str, names: Dict[str, str], fast: bool = False, model_type: str = MODEL_TYPE, device: Optional[str] = None, audio_ext: str = "ogg", workers: int = 1, vad_prepass: bool = False, window_minutes: float = 0, pcm_cache_gb: float = 0,
+              engine: str = DEFAULT_ENGINE, threads: int = 0, batch_segments: int = 0, tiered: bool = False, tiered_confidence: float = MIN_SEGMENT_CONFIDENCE):
+    model_type = get_model_type(fast, model_type)
+    workers = max(1, workers or 1)
+    batched = (batch_segments or 0) > 1
+    settings = get_settings(model_type, fast, vad_prepass, window_minutes, engine, batched, tiered, tiered_confidence)
 
     print()
     print("--------------------")
     print("RECOGNIZE")
     print("--------------------")
     print()
-    
+
     files = glob.glob(os.path.join(input_dir, '*.' + audio_ext))
 
     if not files:
@@ -24,23 +56,313 @@ def recognize(input_dir: str, names: Dict[str, str], fast: bool = False, model_t
         return
 
     print(f" {len(files)} {audio_ext} files found at {input_dir}.")
+    manifest = RecognizeManifest(input_dir)
+    files_to_do, reused, kept = check_files(manifest, files, names, audio_ext, settings)
+
+    def on_saved(audio_file, json_file):
+        manifest.record(audio_file, files_to_do[audio_file], settings, json_file)
+        print(f"  Saved to {json_file}")
+
+    pcm_cache_bytes = int((pcm_cache_gb or 0) * 1024 ** 3)
+    if files_to_do and batched:
+        if workers > 1 or window_minutes:
+            print(" (With --batchSegments everything is transcribed together in this one process, so --workers and --windowMinutes don't apply.)")
+            print()
+        recognition_engine = load_engine(engine, model_type, device, threads)
+        pcm_cache = PcmCache(pcm_cache_bytes) if pcm_cache_bytes else None
+        recognize_batched(recognition_engine, input_dir, files_to_do, settings, pcm_cache, batch_segments, on_saved)
+    elif files_to_do and workers > 1:
+        recognize_in_pool(input_dir, files_to_do, engine, model_type, device, threads, settings, pcm_cache_bytes, workers, on_saved)
+    elif files_to_do:
+        recognition_engine = load_engine(engine, model_type, device, threads)
+        pcm_cache = PcmCache(pcm_cache_bytes) if pcm_cache_bytes else None
+        # the next file is decoded (or pulled from the cache) while the model is busy with the current one
+        load = lambda audio_file: load_stem_audio(audio_file, files_to_do[audio_file], settings, pcm_cache)
+        for audio_file, audio in prefetch(list(files_to_do), load):
+            print(f" - {audio_file}...")
+            with profiling.stage('recognize.transcribe', stem=os.path.basename(audio_file)) as stage:
+                json_file = transcribe_file(recognition_engine, input_dir, audio_file, files_to_do[audio_file], settings, audio)
+            record_transcription(audio_file, audio, stage)
+            on_saved(audio_file, json_file)
+            print()
+
+    print(f" Transcribed {len(files_to_do)}, reused {reused} up to date and kept {kept} edited .words.json file{'s' if kept != 1 else ''}.")
+    print("--------------------")
+
+def get_settings(model_type: str, fast: bool = False, vad_prepass: bool = False, window_minutes: float = 0, engine: str = DEFAULT_ENGINE,
+                 batched: bool = False, tiered: bool = False, tiered_confidence: float = MIN_SEGMENT_CONFIDENCE) -> Dict:
+    # everything that affects what ends up in a .words.json, which is also what the manifest checks
+    if batched:
+        # each speech segment is transcribed on its own, however many go in a batch
+        settings = {
+            "model_type": model_type,
+            "decode_params": get_decode_params(fast),
+            "batched_segments": True,
+        }
+    else:
+        settings = {
+            "model_type": model_type,
+            "decode_params": get_decode_params(fast),
+            "vad_prepass": vad_prepass,
+            "window_minutes": window_minutes or 0,
+        }
+    if tiered:
+        # a quick greedy pass over everything first, and the accurate settings only for what it wasn't sure of
+        settings["decode_params"] = get_decode_params(False)
+        settings["tiered"] = {"first_pass_params": get_decode_params(True), "min_confidence": tiered_confidence}
+    if engine != DEFAULT_ENGINE:
+        # (only when it isn't the default, so .words.json files transcribed before there was a choice still count as up to date)
+        settings["engine"] = engine
+    return settings
+
+def check_files(manifest: RecognizeManifest, files: List[str], names: Dict[str, str], audio_ext: str, settings: Dict) -> Tuple[Dict[str, str], int, int]:
+    """
+    Which of the files need transcribing (along with the hash of each one's audio, and noted down in
+    the manifest as about to be), and how many .words.json files were reused and kept.
+    """
+    files_to_do = {}
+    reused = 0
+    kept = 0
     for audio_file in files:
-        print(f" - {audio_file}...")
         speaker = extract_speaker_name(audio_file, audio_ext)
         if speaker in names and (names[speaker] is None or names[speaker] == ''):
+            print(f" - {audio_file}...")
             print(f"  Skipping {audio_file} because '{speaker}' is specified as blank.")
-            print()
             continue
+
+        with profiling.stage('recognize.check', stem=os.path.basename(audio_file)):
+            status, audio_sha256 = manifest.check(audio_file, settings)
+        json_file = audio_file + '.words.json'
+        if status == CURRENT:
+            print(f" - {audio_file}...")
+            print(f"  Reusing {json_file}, which is already up to date.")
+            reused += 1
+        elif status == EDITED:
+            print(f" - {audio_file}...")
+            print(f"  Keeping {json_file}, which has been edited since it was transcribed (delete it to transcribe again).")
+            kept += 1
+        elif status == UNRECORDED:
+            print(f" - {audio_file}...")
+            print(f"  Keeping {json_file}, which wasn't written by a run that can be checked (delete it to transcribe again).")
+            kept += 1
         else:
-            audio = whisper.load_audio(os.path.join(input_dir, audio_file))
-            if fast:
-                results = whisper.transcribe(model, audio, detect_disfluencies=True, vad="auditok")
-            else:
-                results = whisper.transcribe(model, audio, detect_disfluencies=True, vad="auditok", beam_size=5, best_of=5, temperature=(0.0, 0.2, 0.4, 0.6, 0.8, 1.0))
-
-            json_file = os.path.join(input_dir, audio_file + '.words.json')
-            with open(json_file, 'w') as f:
-                f.write(json.dumps(results))
-            print(f"  Saved to {json_file}")
+            files_to_do[audio_file] = audio_sha256
+    if files_to_do:
+        manifest.begin(files_to_do, settings)
+    print()
+    return files_to_do, reused, kept
+
+def get_model_type(fast: bool, model_type: str = MODEL_TYPE) -> str:
+    return "tiny" if fast else model_type
+
+def load_engine(engine: str, model_type: str, device: Optional[str] = None, threads: int = 0) -> RecognitionEngine:
+    # kept for as long as the process runs, so that the daemon and batch modes only ever load it once
+    key = (engine, model_type, device, threads)
+    if key not in _engines:
+        recognition_engine = create_engine(engine, model_type, device, threads)
+        with profiling.stage('recognize.load_model', engine=engine, model=model_type, device=recognition_engine.device):
+            _engines[key] = recognition_engine.load()
+    return _engines[key]
+
+def record_transcription(audio_file: str, audio: Optional[np.ndarray], stage: Dict):
+    # for the real-time factor in the profile
+    if profiling.enabled():
+        audio_seconds = len(audio) / SAMPLE_RATE if audio is not None else get_audio_duration(audio_file)
+        profiling.record('recognize.audio_seconds', audio_seconds)
+        profiling.record('recognize.compute_seconds', stage['wall_seconds'])
+
+def load_stem_audio(audio_file: str, audio_sha256: str, settings: Dict, pcm_cache: Optional[PcmCache]) -> Optional[np.ndarray]:
+    with profiling.stage('recognize.decode', stem=os.path.basename(audio_file)):
+        return _load_stem_audio(audio_file, audio_sha256, settings, pcm_cache)
+
+def _load_stem_audio(audio_file: str, audio_sha256: str, settings: Dict, pcm_cache: Optional[PcmCache]) -> Optional[np.ndarray]:
+    if pcm_cache is not None:
+        return pcm_cache.load(audio_file, audio_sha256)
+    if settings.get('window_minutes'):
+        # without the cache, windows are decoded one at a time as they're needed
+        return None
+    return load_audio(audio_file)
+
+def transcribe_file(recognition_engine: RecognitionEngine, input_dir: str, audio_file: str, audio_sha256: str, settings: Dict, audio: Optional[np.ndarray] = None) -> str:
+    results = transcribe_audio_file(recognition_engine, input_dir, audio_file, audio_sha256, settings, audio)
+    return save_results(input_dir, audio_file, results)
+
+def transcribe_audio_file(recognition_engine: RecognitionEngine, input_dir: str, audio_file: str, audio_sha256: str, settings: Dict, audio: Optional[np.ndarray] = None) -> Dict:
+    if settings['window_minutes']:
+        results = transcribe_in_windows(recognition_engine, input_dir, audio_file, audio_sha256, settings, audio)
+    else:
+        if audio is None:
+            audio = load_audio(audio_file)
+        if settings['vad_prepass']:
+            results = transcribe_speech_only(recognition_engine, audio, load_speech_regions(input_dir, audio_file, audio), settings)
+        else:
+            results = decode(recognition_engine, audio, settings)
+    return results
+
+def save_results(input_dir: str, audio_file: str, results: Dict) -> str:
+    json_file = audio_file + '.words.json'
+    write_file_atomically(json_file, json.dumps(results))
+    # plus just the words, which is all that assemble needs and is a lot quicker for it to read
+    words = StemWords([], [], [])
+    words_from_results(results, words)
+    write_sidecar(input_dir, json_file, words)
+    return json_file
+
+def decode(recognition_engine: RecognitionEngine, audio: np.ndarray, settings: Dict) -> Dict:
+    tiered = settings.get('tiered')
+    if tiered is None:
+        return recognition_engine.transcribe(audio, settings['decode_params'])
+    first_pass = recognition_engine.transcribe(audio, tiered['first_pass_params'])
+    results, second_pass_seconds = redecode_weak_stretches(recognition_engine, [audio], [first_pass], settings['decode_params'], tiered['min_confidence'])
+    report_second_pass(len(audio) / SAMPLE_RATE, second_pass_seconds)
+    return results[0]
+
+def decode_batch(recognition_engine: RecognitionEngine, audios: List[np.ndarray], settings: Dict) -> Tuple[List[Dict], float]:
+    # along with how many seconds had to be decoded a second time
+    tiered = settings.get('tiered')
+    if tiered is None:
+        return recognition_engine.transcribe_batch(audios, settings['decode_params']), 0.0
+    first_pass = recognition_engine.transcribe_batch(audios, tiered['first_pass_params'])
+    return redecode_weak_stretches(recognition_engine, audios, first_pass, settings['decode_params'], tiered['min_confidence'])
+
+def report_second_pass(first_pass_seconds: float, second_pass_seconds: float):
+    share = second_pass_seconds / first_pass_seconds if first_pass_seconds else 0.0
+    print(f"  {second_pass_seconds:.0f}s of {first_pass_seconds:.0f}s ({share:.0%}) had to be decoded again with the accurate settings.")
+    profiling.record('recognize.first_pass_seconds', first_pass_seconds)
+    profiling.record('recognize.second_pass_seconds', second_pass_seconds)
+
+def transcribe_speech_only(recognition_engine: RecognitionEngine, audio, regions, settings: Dict) -> Dict:
+    speech_seconds = sum(end - start for start, end in regions)
+    print(f"  {speech_seconds:.0f}s of speech found in {len(audio) / SAMPLE_RATE:.0f}s of audio ({len(regions)} region{'s' if len(regions) != 1 else ''}).")
+    if not regions:
+        return {"text": "", "segments": [], "language": None}
+
+    packed_audio, timeline = pack_speech_regions(audio, regions, VAD_PARAMS['gap'])
+    results = decode(recognition_engine, packed_audio, settings)
+    map_results_to_session_time(results, timeline)
+    return results
+
+def transcribe_in_windows(recognition_engine: RecognitionEngine, input_dir: str, audio_file: str, audio_sha256: str, settings: Dict, audio: Optional[np.ndarray] = None) -> Dict:
+    duration = len(audio) / SAMPLE_RATE if audio is not None else get_audio_duration(audio_file)
+    windows = plan_windows(duration, settings['window_minutes'] * 60)
+    checkpoint = WindowCheckpoint(input_dir, audio_file, {"audio_sha256": audio_sha256, "settings": settings, "windows": windows})
+    finished = checkpoint.finished_count()
+    if finished:
+        print(f"  Resuming after {finished} of {len(windows)} windows already finished.")
+
+    for index, (start, end) in enumerate(windows):
+        if checkpoint.load(index) is not None:
+            continue
+        print(f"  Window {index + 1} of {len(windows)} ({start:.0f}s-{end:.0f}s)...")
+        # only ever one window of audio is decoded into memory at a time
+        if audio is not None:
+            window_audio = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        else:
+            window_audio = load_audio_window(audio_file, start, end - start)
+        if settings['vad_prepass']:
+            results = transcribe_speech_only(recognition_engine, window_audio, find_speech_regions(window_audio), settings)
+        else:
+            results = decode(recognition_engine, window_audio, settings)
+        offset_results(results, start)
+        checkpoint.save(index, {"segments": results.get('segments', []), "language": results.get('language')})
+
+    results = merge_window_results(windows, [checkpoint.load(index) for index in range(len(windows))])
+    checkpoint.clear()
+    return results
+
+def recognize_batched(recognition_engine: RecognitionEngine, input_dir: str, files: Dict[str, str], settings: Dict, pcm_cache: Optional[PcmCache],
+                      batch_size: int, on_saved: Callable[[str, str], None]):
+    """
+    Cuts the speech out of every file, and transcribes all of it together, batch_size segments at
+    a time, with segments of about the same length in each batch, whichever files they're from.
+    Each file's .words.json is saved as soon as the last of its segments is done.
+    """
+    stem_results = StemResults()
+    segments = []
+    audio_seconds = 0.0
+    load = lambda audio_file: load_stem_audio(audio_file, files[audio_file], settings, pcm_cache)
+    for audio_file, audio in prefetch(list(files), load):
+        print(f" - {audio_file}...")
+        with profiling.stage('recognize.segment', stem=os.path.basename(audio_file)):
+            stem_segments = cut_speech_segments(audio_file, audio, load_speech_regions(input_dir, audio_file, audio))
+        speech_seconds = sum(len(segment.audio) for segment in stem_segments) / SAMPLE_RATE
+        audio_seconds += len(audio) / SAMPLE_RATE
+        print(f"  {speech_seconds:.0f}s of speech found in {len(audio) / SAMPLE_RATE:.0f}s of audio ({len(stem_segments)} segment{'s' if len(stem_segments) != 1 else ''}).")
+        stem_results.expect(audio_file, len(stem_segments))
+        if not stem_segments:
+            on_saved(audio_file, save_results(input_dir, audio_file, stem_results.finish(audio_file)))
+        segments.extend(stem_segments)
+        # only the speech is kept from here on
+        del audio
+    print()
+
+    batches = plan_batches(segments, batch_size)
+    print(f" Transcribing {len(segments)} speech segments from {len(files)} files in {len(batches)} batches of up to {batch_size}...")
+    print()
+    compute_seconds = 0.0
+    second_pass_seconds = 0.0
+    for number, batch in enumerate(batches):
+        if number % max(1, len(batches) // 10) == 0:
+            print(f"  Batch {number + 1} of {len(batches)}...")
+        batch_seconds = sum(len(segment.audio) for segment in batch) / SAMPLE_RATE
+        with profiling.stage('recognize.batch', size=len(batch), audio_seconds=round(batch_seconds, 2)) as stage:
+            batch_results, batch_second_pass_seconds = decode_batch(recognition_engine, [segment.audio for segment in batch], settings)
+        second_pass_seconds += batch_second_pass_seconds
+        if profiling.enabled():
+            compute_seconds += stage['wall_seconds']
+        for segment, results in zip(batch, batch_results):
+            finished = stem_results.add(segment, results)
+            if finished is not None:
+                print(f" - {segment.audio_file}...")
+                on_saved(segment.audio_file, save_results(input_dir, segment.audio_file, finished))
+    print()
+    if settings.get('tiered'):
+        report_second_pass(sum(len(segment.audio) for segment in segments) / SAMPLE_RATE, second_pass_seconds)
+        print()
+    if profiling.enabled():
+        profiling.record('recognize.audio_seconds', audio_seconds)
+        profiling.record('recognize.compute_seconds', compute_seconds)
+
+def recognize_in_pool(input_dir: str, files: Dict[str, str], engine: str, model_type: str, device: Optional[str], threads: int, settings: Dict, pcm_cache_bytes: int, workers: int, on_saved: Callable[[str, str], None]):
+    if not files:
+        return
+    workers = min(workers, len(files))
+    # unless told otherwise, split the available cores between the workers so they don't all fight over every core
+    threads_per_worker = threads or max(1, (os.cpu_count() or 1) // workers)
+    # the biggest stems go first so that one long file doesn't end up running alone at the end
+    ordered_files = sorted(files, key=os.path.getsize, reverse=True)
+
+    print(f" Transcribing {len(ordered_files)} files with {workers} workers ({threads_per_worker} thread{'s' if threads_per_worker > 1 else ''} each)...")
+    print()
+    # spawn rather than fork, since a forked CUDA context is not usable in the child
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(engine, model_type, device, settings, pcm_cache_bytes, threads_per_worker)) as executor:
+        futures = {executor.submit(_transcribe_in_worker, input_dir, audio_file, files[audio_file]): audio_file for audio_file in ordered_files}
+        for future in as_completed(futures):
+            audio_file = futures[future]
+            print(f" - {audio_file}...")
+            try:
+                json_file, timing = future.result()
+                # the worker timed itself, as the time spent waiting in the queue doesn't count
+                profiling.add_stage('recognize.transcribe', timing['start'], timing['wall_seconds'], timing['cpu_seconds'],
+                                    lane=f"worker {timing['pid']}", stem=os.path.basename(audio_file))
+                record_transcription(audio_file, None, timing)
+                on_saved(audio_file, json_file)
+            except Exception as ex:
+                print(f"  Failed to transcribe {audio_file}: {str(ex)}")
             print()
-    print("--------------------")
\ No newline at end of file
+
+def _init_worker(engine: str, model_type: str, device: Optional[str], settings: Dict, pcm_cache_bytes: int, threads: int):
+    global _worker_engine, _worker_settings, _worker_pcm_cache
+    _worker_engine = create_engine(engine, model_type, device, threads).load()
+    _worker_settings = settings
+    _worker_pcm_cache = PcmCache(pcm_cache_bytes) if pcm_cache_bytes else None
+
+def _transcribe_in_worker(input_dir: str, audio_file: str, audio_sha256: str) -> Tuple[str, Dict]:
+    start = time.perf_counter()
+    start_cpu = time.process_time()
+    audio = load_stem_audio(audio_file, audio_sha256, _worker_settings, _worker_pcm_cache)
+    json_file = transcribe_file(_worker_engine, input_dir, audio_file, audio_sha256, _worker_settings, audio)
+    # perf_counter is system-wide on the platforms that matter here, so it lines up with the main process's
+    return json_file, {'pid': os.getpid(), 'start': start, 'wall_seconds': time.perf_counter() - start, 'cpu_seconds': time.process_time() - start_cpu}
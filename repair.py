@@ -0,0 +1,209 @@
+import bisect
+from typing import Iterable, List, Optional, Tuple
+
+from wordtable import WordTable, WtWordList
+
+# the same characters normalize_items ends a sentence on
+BREAK_CHARACTERS = ['.', '!', '?', '-', ',', '~']
+# once the lines that need redoing are more than one in this many, it's quicker to just redo the lot
+REDO_ALL_SHARE = 4
+
+class Stretch:
+    """
+    A run of lines, lines[lo:hi], along with each speaker's range of rows within it.
+    """
+    def __init__(self, lo: int, hi: int):
+        self.lo = lo
+        self.hi = hi
+        self.ranges = {}
+        # the key of each speaker's first sentence, for as long as their range starts at the same row
+        self.first_keys = {}
+        self.added_lo = lo
+        self.added_hi = lo
+
+    def merge(self, other: 'Stretch'):
+        # the two overlap or meet, so between them they still cover one run of lines
+        for speaker_id, (first, last) in other.ranges.items():
+            mine = self.ranges.get(speaker_id, (first, last))
+            self.ranges[speaker_id] = (min(mine[0], first), max(mine[1], last))
+        self.lo, self.added_lo = min(self.lo, other.lo), min(self.added_lo, other.added_lo)
+        self.hi, self.added_hi = max(self.hi, other.hi), max(self.added_hi, other.added_hi)
+
+class LineRepair:
+    """
+    Works out which lines of an already collapsed transcript have to be redone after some of the
+    words' texts have changed, and redoes just those.
+
+    Every line is a run of one speaker's sentences, and normalize_items puts out each sentence when
+    it gets to the word that ends it (and each speaker's last, unfinished sentence at the very end,
+    in order of where they start). So a changed word can only move sentences around within a
+    stretch of lines that starts and ends on sentence boundaries for every speaker in it, and whose
+    sentences, in that order, still fit between the lines either side of it. The stretch starts as
+    the line the word is in, and grows a line at a time until that's true.
+    """
+    def __init__(self, table: WordTable, lines: List[WtWordList]):
+        self.table = table
+        self.lines = lines
+        self.block_los = [lo for lo, _ in table.blocks]
+        # where each speaker's lines start, in order, so a word's line can be found by bisecting
+        self.line_los = {}
+        self.line_indexes = {}
+        for index, line in enumerate(lines):
+            speaker_id = table.speaker_column[line.lo]
+            self.line_los.setdefault(speaker_id, []).append(line.lo)
+            self.line_indexes.setdefault(speaker_id, []).append(index)
+        # unfinished sentences that start at the same time go in the order their speakers first spoke
+        first_spoke = sorted((self.word_key(lo), table.speaker_column[lo]) for lo, hi in table.blocks if hi > lo)
+        self.speaker_order = {speaker_id: order for order, (_, speaker_id) in enumerate(first_spoke)}
+
+    def is_break(self, word_id: int) -> bool:
+        return self.table.texts[word_id].strip()[-1] in BREAK_CHARACTERS
+
+    def word_key(self, word_id: int) -> Tuple:
+        # the order merge_chunk_streams yields words in
+        table = self.table
+        return (table.starts[word_id], table.speakers[table.speaker_column[word_id]], table.ends[word_id], word_id)
+
+    def sentence_key(self, first: int, last: int) -> Tuple:
+        # the order normalize_items puts out the sentence of rows [first, last) in
+        if self.is_break(last - 1):
+            return (0,) + self.word_key(last - 1)
+        return (1, self.table.starts[first], self.speaker_order[self.table.speaker_column[first]])
+
+    def block(self, word_id: int) -> Tuple[int, int]:
+        return self.table.blocks[bisect.bisect_right(self.block_los, word_id) - 1]
+
+    def line_of(self, word_id: int) -> int:
+        speaker_id = self.table.speaker_column[word_id]
+        return self.line_indexes[speaker_id][bisect.bisect_right(self.line_los[speaker_id], word_id) - 1]
+
+    def first_sentence_key(self, first: int, last: int) -> Optional[Tuple]:
+        # None if the rows don't end on a sentence boundary, so the first sentence ends somewhere past them
+        end = next((word_id + 1 for word_id in range(first, last) if self.is_break(word_id)), None)
+        if end is None:
+            if last != self.block(first)[1]:
+                return None
+            end = last
+        return self.sentence_key(first, end)
+
+    def last_sentence_key(self, first: int, last: int) -> Tuple:
+        start = last - 1
+        while start > first and not self.is_break(start - 1):
+            start -= 1
+        return self.sentence_key(start, last)
+
+    def add_lines(self, stretch: Stretch):
+        # takes in any lines the stretch has grown to cover since last time
+        for index in list(range(stretch.lo, stretch.added_lo)) + list(range(stretch.added_hi, stretch.hi)):
+            line = self.lines[index]
+            speaker_id = self.table.speaker_column[line.lo]
+            first, last = stretch.ranges.get(speaker_id, (line.lo, line.hi))
+            stretch.ranges[speaker_id] = (min(first, line.lo), max(last, line.hi))
+        stretch.added_lo, stretch.added_hi = stretch.lo, stretch.hi
+
+    def settle(self, stretch: Stretch):
+        """
+        Grows the stretch until it can be redone on its own.
+        """
+        lines = self.lines
+        table = self.table
+        while True:
+            self.add_lines(stretch)
+            grown = False
+            for first, last in stretch.ranges.values():
+                block_lo, block_hi = self.block(first)
+                if first > block_lo and not self.is_break(first - 1):
+                    # its first sentence now carries on from the speaker's line before
+                    stretch.lo = min(stretch.lo, self.line_of(first - 1))
+                    grown = True
+                if last < block_hi and not self.is_break(last - 1):
+                    stretch.hi = max(stretch.hi, self.line_of(last) + 1)
+                    grown = True
+            if grown:
+                continue
+
+            # within a speaker, later sentences always come later, so the stretch's first sentence is
+            # whichever speaker's first sentence comes first, and its last whichever's last comes last
+            first_keys = []
+            for speaker_id, (first, last) in stretch.ranges.items():
+                cached = stretch.first_keys.get(speaker_id)
+                if cached is not None and cached[0] == first:
+                    first_keys.append((cached[1], speaker_id))
+                    continue
+                key = self.first_sentence_key(first, last)
+                if key[0] == 0:
+                    # (an unfinished sentence's key can't change, but it's rare enough not to bother)
+                    stretch.first_keys[speaker_id] = (first, key)
+                first_keys.append((key, speaker_id))
+            first_key, first_speaker = min(first_keys)
+            last_key, last_speaker = max((self.last_sentence_key(first, last), speaker_id) for speaker_id, (first, last) in stretch.ranges.items())
+
+            if stretch.lo > 0:
+                previous = lines[stretch.lo - 1]
+                if first_key <= self.last_sentence_key(previous.lo, previous.hi) or table.speaker_column[previous.lo] == first_speaker:
+                    stretch.lo -= 1
+                    continue
+            if stretch.hi < len(lines):
+                following = lines[stretch.hi]
+                following_key = self.first_sentence_key(following.lo, following.hi)
+                if following_key is None or last_key >= following_key or table.speaker_column[following.lo] == last_speaker:
+                    stretch.hi += 1
+                    continue
+            return
+
+    def redo(self, stretch: Stretch) -> List[WtWordList]:
+        # normalize_items and collapse_adjacent, for just the words in the stretch
+        sentences = []
+        for first, last in stretch.ranges.values():
+            start = first
+            for word_id in range(first, last):
+                if self.is_break(word_id) or word_id == last - 1:
+                    sentences.append((self.sentence_key(start, word_id + 1), start, word_id + 1))
+                    start = word_id + 1
+        sentences.sort()
+        return collapse_ranges(self.table, ((start, end) for _, start, end in sentences))
+
+def collapse_ranges(table: WordTable, ranges: Iterable[Tuple[int, int]]) -> List[WtWordList]:
+    # what collapse_adjacent does to sentences in order, with them as row ranges
+    lines = []
+    for start, end in ranges:
+        if lines and lines[-1].speaker == table.speaker(start):
+            lines[-1].extend(WtWordList(table, start, end))
+        else:
+            lines.append(WtWordList(table, start, end))
+    return lines
+
+def repair_collapsed_items(table: WordTable, collapsed_items: List[WtWordList], changed_ids: Iterable[int]) -> Optional[List[WtWordList]]:
+    """
+    The same lines that merging, normalizing and collapsing the whole table again would give, after
+    the words in changed_ids have had their texts changed, but only redoing the lines around them.
+    Returns None if so much has changed that it'd be quicker to just redo the lot.
+    """
+    if table.disfluencies:
+        # a word that's turned back into a scrubbed disfluency drops out of its sentence (as normalize_items
+        # skips it), which the stretches don't account for, so it's all redone
+        return None
+    repair = LineRepair(table, collapsed_items)
+    stretches = []
+    covered = 0
+    for index in sorted({repair.line_of(word_id) for word_id in changed_ids}):
+        if stretches and index < stretches[-1].hi:
+            # already taken care of
+            continue
+        stretch = Stretch(index, index + 1)
+        repair.settle(stretch)
+        # stretches that meet have to be redone as one, as each one relies on the lines either side of it staying put
+        while stretches and stretches[-1].hi >= stretch.lo:
+            previous = stretches.pop()
+            covered -= previous.hi - previous.lo
+            stretch.merge(previous)
+            repair.settle(stretch)
+        stretches.append(stretch)
+        covered += stretch.hi - stretch.lo
+        if covered * REDO_ALL_SHARE > len(collapsed_items):
+            return None
+
+    repaired = list(collapsed_items)
+    for stretch in reversed(stretches):
+        repaired[stretch.lo:stretch.hi] = repair.redo(stretch)
+    return repaired
@@ -0,0 +1,63 @@
+import os
+import glob
+from typing import Dict, List, Optional, Sequence
+
+from tasmas import load_names, load_corrections
+
+STEPS = ['recognize', 'assemble']
+
+def fingerprint_files(session_dir: str, extension: str) -> List:
+    # enough to tell whether any of the files have been added, removed or changed since last time
+    files = sorted(glob.glob(os.path.join(session_dir, f'*.{extension}')))
+    return [[os.path.basename(file), os.stat(file).st_size, os.stat(file).st_mtime_ns] for file in files]
+
+class SessionRunner:
+    """
+    Runs recognize and/or assemble on one session folder after another without asking anything:
+    names.json and corrections.json are picked up from the session folder (or the one above it) as
+    they are found, and speakers that aren't in the names just keep their recorded names. Since it's
+    all in the one process, the whisper and punctuation models are only ever loaded once.
+    """
+    def __init__(self, config: Dict):
+        self.config = config
+
+    def warm_up(self, steps: Sequence[str] = STEPS):
+        # load the recognition model now, rather than when the first session needs it; with --workers each
+        # worker process loads its own, so there's nothing worth loading here (and the punctuation
+        # model is left until assemble actually finds something to repunctuate)
+        config = self.config
+        if 'recognize' in steps and (config.get('workers', 1) <= 1 or config.get('batchSegments', 0) > 1):
+            from recognize import load_engine, get_model_type
+            print(" Loading models...")
+            load_engine(config.get('engine', 'whisper'), get_model_type(config.get('fast', False)), threads=config.get('threads', 0))
+
+    def load_settings(self, session_dir: str, names: Optional[Dict[str, str]] = None, corrections: Optional[Dict[str, str]] = None):
+        if names is None:
+            names = load_names(self.config.get('names'), session_dir, interactive=False) or {}
+        if corrections is None:
+            corrections = load_corrections(self.config.get('corrections'), session_dir, interactive=False)
+        return names, corrections
+
+    def run(self, session_dir: str, steps: Sequence[str] = STEPS, names: Optional[Dict[str, str]] = None, corrections: Optional[Dict[str, str]] = None):
+        """
+        Runs each of the steps on the session, in order, raising if one of them can't be done.
+        """
+        config = self.config
+        names, corrections = self.load_settings(session_dir, names, corrections)
+        for step in steps:
+            if step == 'recognize':
+                from recognize import recognize
+                recognize(session_dir, names, config.get('fast', False), workers=config.get('workers', 1), vad_prepass=config.get('vadPrepass', False),
+                          window_minutes=config.get('windowMinutes', 0), pcm_cache_gb=config.get('pcmCacheGB', 0),
+                          engine=config.get('engine', 'whisper'), threads=config.get('threads', 0),
+                          batch_segments=config.get('batchSegments', 0),
+                          tiered=config.get('tiered', False), tiered_confidence=config.get('tieredConfidence', 0.6))
+            elif step == 'assemble':
+                from assemble import assemble
+                if not any(file_name.endswith('.words.json') for file_name in os.listdir(session_dir)):
+                    raise RuntimeError(f"No .words.json files were found at {session_dir}.")
+                assemble(session_dir, corrections, names, config.get('noEllipses', False), config.get('disfluentComma', False),
+                         config.get('noAsterisks', False), config.get('showTimestamps', False),
+                         config.get('correctionsWholeWords', False), config.get('correctionsIgnoreCase', False), config.get('store'))
+            else:
+                raise ValueError(f"Unknown step '{step}' (expected one of {', '.join(STEPS)})")
@@ -4,13 +4,16 @@ setup(name='tasmas',
       version='0.1',    
       author='Kadda OK',
       description='TASMAS (Transcribe And Summarize Multiple Audio Stems) transcribes and interleaves per-speaker audio recordings into a single threaded transcript, which it can optionally then summarize.',
-      py_modules=['tasmas', 'assemble', 'configuration', 'recognize', 'summarize', 'utils'],
+      py_modules=['tasmas', 'assemble', 'configuration', 'recognize', 'summarize', 'utils', 'vad', 'manifest', 'audio', 'windowing', 'pcm_cache', 'wordtable', 'punctuation', 'corrections', 'sidecar', 'tokens', 'compact', 'profiling', 'session_runner', 'daemon', 'batch', 'stemcache', 'repair', 'store', 'engines', 'batching', 'tiered', 'distributed'],
       install_requires=[
         'whisper_timestamped',
         'auditok',
         'deepmultilingualpunctuation',
         'openai'
       ],
+      extras_require={
+        'cpu': ['faster-whisper']
+      },
       entry_points={
         'console_scripts': [
           'tasmas=tasmas:main'
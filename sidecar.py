@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+from utils import get_cache_dir, file_sha256, write_file_atomically
+from wordtable import StemWords
+
+# bump this whenever what goes into a sidecar changes, and every old one just gets rebuilt
+SIDECAR_VERSION = 1
+
+def sidecar_path(input_dir: str, json_file: str) -> str:
+    return os.path.join(get_cache_dir(input_dir, 'words'), os.path.basename(json_file) + 'l')
+
+def words_from_results(results: Dict, words: StemWords):
+    """
+    Pulls just the text, start and end of every word out of a whisper_timestamped result (which is
+    what a .words.json holds), adding them to words.
+    """
+    for segment in results['segments']:
+        for word in segment['words']:
+            words.texts.append(word['text'].strip() if word['text'] else "")
+            words.starts.append(word['start'])
+            words.ends.append(word['end'])
+
+def source_header(json_file: str, source_stat: Optional[os.stat_result] = None, json_sha256: Optional[str] = None) -> Dict:
+    # what a cache of a .words.json needs to remember about it to tell if it's changed since
+    stat = source_stat or os.stat(json_file)
+    return {
+        'source': os.path.basename(json_file),
+        'source_size': stat.st_size,
+        'source_mtime_ns': stat.st_mtime_ns,
+        'source_sha256': json_sha256 or file_sha256(json_file),
+    }
+
+def source_unchanged(header: Dict, json_file: str) -> bool:
+    stat = os.stat(json_file)
+    if header.get('source_size') != stat.st_size or header.get('source_mtime_ns') != stat.st_mtime_ns:
+        # it might only have been touched or copied, so it's the contents that really decide it
+        if header.get('source_size') != stat.st_size or header.get('source_sha256') != file_sha256(json_file):
+            return False
+    return True
+
+def write_words_file(path: str, header: Dict, words: StemWords):
+    """
+    Saves words as a header line followed by one [text, start, end] line per word.
+    """
+    header = dict(header, count=len(words.texts))
+    lines = [json.dumps(header)]
+    lines.extend(json.dumps(row) for row in zip(words.texts, words.starts, words.ends))
+    write_file_atomically(path, "\n".join(lines) + "\n")
+
+def read_words_file(path: str) -> Optional[Tuple[Dict, str]]:
+    # the header, and the rest still unparsed, so that nothing more gets parsed than has to be
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.loads(f.readline()), f.read()
+    except (OSError, ValueError):
+        return None
+
+def parse_words_body(header: Dict, body: str) -> Optional[StemWords]:
+    try:
+        # parsing it all as one list is a lot quicker than parsing it a line at a time
+        rows = json.loads("[" + body.rstrip().replace("\n", ",") + "]")
+    except ValueError:
+        return None
+    if len(rows) != header.get('count'):
+        return None
+    if not rows:
+        return StemWords([], [], [])
+    texts, starts, ends = zip(*rows)
+    return StemWords(list(texts), list(starts), list(ends))
+
+def write_sidecar(input_dir: str, json_file: str, words: StemWords, source_stat: Optional[os.stat_result] = None, json_sha256: Optional[str] = None):
+    """
+    Saves the words of a .words.json, along with a description of the .words.json they came from.
+    """
+    header = {'version': SIDECAR_VERSION, **source_header(json_file, source_stat, json_sha256)}
+    write_words_file(sidecar_path(input_dir, json_file), header, words)
+
+def read_sidecar_header(input_dir: str, json_file: str) -> Optional[Dict]:
+    saved = read_words_file(sidecar_path(input_dir, json_file))
+    return saved[0] if saved is not None else None
+
+def read_sidecar(input_dir: str, json_file: str) -> Optional[StemWords]:
+    """
+    The words saved for a .words.json, or None if there aren't any or if the .words.json has been
+    changed (say, by hand) since they were saved.
+    """
+    saved = read_words_file(sidecar_path(input_dir, json_file))
+    if saved is None:
+        return None
+    header, body = saved
+    if header.get('version') != SIDECAR_VERSION or not source_unchanged(header, json_file):
+        return None
+    return parse_words_body(header, body)
+
+def parse_words_json(input_dir: str, json_file: str) -> StemWords:
+    """
+    The words of a .words.json, read from the .words.json itself, saving a new sidecar for next time.
+    """
+    words = StemWords([], [], [])
+    try:
+        # the sidecar has to describe exactly what was read, even if the file changes in the meantime
+        stat = os.stat(json_file)
+        with open(json_file, 'rb') as file:
+            content = file.read()
+        words_from_results(json.loads(content), words)
+    except Exception as ex:
+        print(f"Error processing file {json_file}: {str(ex)}")
+        return words
+
+    try:
+        write_sidecar(input_dir, json_file, words, stat, hashlib.sha256(content).hexdigest())
+    except OSError as ex:
+        print(f"  Could not save the words sidecar for {json_file}: {str(ex)}")
+    return words
+
+def load_all_stem_words(input_dir: str, json_files: List[str]) -> Dict[str, Tuple[StemWords, bool]]:
+    """
+    The words of each of the files, and whether they came from its sidecar. Any that have to be
+    parsed from the .words.json itself are parsed in separate processes at the same time.
+    """
+    loaded = {}
+    to_parse = []
+    for json_file in json_files:
+        words = read_sidecar(input_dir, json_file)
+        if words is not None:
+            loaded[json_file] = (words, True)
+        else:
+            to_parse.append(json_file)
+
+    if len(to_parse) > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn rather than fork, as by now this process may have torch (and its threads, or a CUDA
+        # context) loaded from recognize, which a forked child can't safely use or even tidy up
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(len(to_parse), os.cpu_count() or 1), mp_context=context) as executor:
+            for json_file, words in zip(to_parse, executor.map(parse_words_json, [input_dir] * len(to_parse), to_parse)):
+                loaded[json_file] = (words, False)
+    else:
+        for json_file in to_parse:
+            loaded[json_file] = (parse_words_json(input_dir, json_file), False)
+
+    return loaded
@@ -0,0 +1,33 @@
+import os
+from typing import Dict, Optional
+
+from utils import get_cache_dir
+from sidecar import read_words_file, parse_words_body, write_words_file, read_sidecar_header, source_unchanged
+from wordtable import StemWords
+
+# bump this whenever the way a stem gets cleaned up changes, so that none of the old ones get used
+STEM_CACHE_VERSION = 1
+
+def stem_cache_path(input_dir: str, json_file: str) -> str:
+    return os.path.join(get_cache_dir(input_dir, 'assemble'), os.path.basename(json_file) + 'l')
+
+def read_cleaned_stem(input_dir: str, json_file: str, flags: Dict[str, bool]) -> Optional[StemWords]:
+    """
+    The words of a .words.json as they were after being cleaned up (disfluencies, ellipses and all)
+    the last time, or None if the .words.json has changed since or they were cleaned up differently.
+    """
+    saved = read_words_file(stem_cache_path(input_dir, json_file))
+    if saved is None:
+        return None
+    header, body = saved
+    if header.get('version') != STEM_CACHE_VERSION or header.get('flags') != flags or not source_unchanged(header, json_file):
+        return None
+    return parse_words_body(header, body)
+
+def write_cleaned_stem(input_dir: str, json_file: str, flags: Dict[str, bool], words: StemWords):
+    # the words sidecar has only just been checked (or written), so it knows exactly which version of the file these came from
+    header = read_sidecar_header(input_dir, json_file)
+    if header is None or not source_unchanged(header, json_file):
+        return
+    source = {key: header[key] for key in ('source', 'source_size', 'source_mtime_ns', 'source_sha256')}
+    write_words_file(stem_cache_path(input_dir, json_file), {'version': STEM_CACHE_VERSION, 'flags': flags, **source}, words)
@@ -0,0 +1,197 @@
+import os
+import re
+import time
+import sqlite3
+from typing import Dict, List, Optional, Sequence
+
+from wordtable import WtWordList
+
+# the name the store gets if it's just given a folder
+STORE_FILE = 'tasmas.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    line_no INTEGER NOT NULL,
+    speaker TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lines_by_session ON lines(session_id, line_no);
+CREATE TABLE IF NOT EXISTS words (
+    line_id INTEGER NOT NULL REFERENCES lines(id),
+    session_id INTEGER NOT NULL REFERENCES sessions(id),
+    speaker TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS words_by_line ON words(line_id);
+CREATE INDEX IF NOT EXISTS words_by_session ON words(session_id, start);
+-- the text of each line (with corrections applied), for full-text search
+CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(speaker, text, content='lines', content_rowid='id', tokenize='unicode61 remove_diacritics 2');
+-- each line as a box of (session, session) by (start, end), so the lines overlapping a stretch of time in a session can be found without scanning
+CREATE VIRTUAL TABLE IF NOT EXISTS line_times USING rtree(id, session_lo, session_hi, start, end);
+"""
+
+def resolve_store_path(path: str) -> str:
+    # a folder means the store in it
+    if os.path.isdir(path):
+        return os.path.join(path, STORE_FILE)
+    return path
+
+def connect(store_path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(resolve_store_path(store_path))
+    connection.row_factory = sqlite3.Row
+    # several sessions' worth of writes can go in while it's being queried
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+def save_session(store_path: str, input_dir: str, collapsed_items: Sequence[WtWordList], texts: Sequence[str]):
+    """
+    Puts a session's lines (with the corrected text that went into transcript.txt) and their words
+    into the store, replacing whatever was there for the session before.
+    """
+    input_dir = os.path.abspath(input_dir)
+    connection = connect(store_path)
+    try:
+        with connection:
+            row = connection.execute("SELECT id FROM sessions WHERE path = ?", (input_dir,)).fetchone()
+            if row is None:
+                session_id = connection.execute("INSERT INTO sessions (path, name, updated_at) VALUES (?, ?, ?)",
+                                                (input_dir, os.path.basename(input_dir), time.time())).lastrowid
+            else:
+                session_id = row['id']
+                # the search index only holds a copy of the text, so it has to be told what's going
+                connection.execute("INSERT INTO lines_fts (lines_fts, rowid, speaker, text) SELECT 'delete', id, speaker, text FROM lines WHERE session_id = ?", (session_id,))
+                connection.execute("DELETE FROM line_times WHERE id IN (SELECT id FROM lines WHERE session_id = ?)", (session_id,))
+                connection.execute("DELETE FROM words WHERE session_id = ?", (session_id,))
+                connection.execute("DELETE FROM lines WHERE session_id = ?", (session_id,))
+                connection.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (time.time(), session_id))
+
+            first_line_id = (connection.execute("SELECT COALESCE(MAX(id), 0) FROM lines").fetchone()[0]) + 1
+            line_rows = []
+            word_rows = []
+            for line_no, (item, text) in enumerate(zip(collapsed_items, texts)):
+                line_id = first_line_id + line_no
+                speaker = item.speaker
+                line_rows.append((line_id, session_id, line_no, speaker, item.start, item.end, text))
+                table = item.table
+                word_rows.extend((line_id, session_id, speaker, table.starts[word_id], table.ends[word_id], table.texts[word_id]) for word_id in item.ids)
+            connection.executemany("INSERT INTO lines (id, session_id, line_no, speaker, start, end, text) VALUES (?, ?, ?, ?, ?, ?, ?)", line_rows)
+            connection.executemany("INSERT INTO lines_fts (rowid, speaker, text) VALUES (?, ?, ?)", ((row[0], row[3], row[6]) for row in line_rows))
+            connection.executemany("INSERT INTO line_times (id, session_lo, session_hi, start, end) VALUES (?, ?, ?, ?, ?)",
+                                   ((row[0], session_id, session_id, row[4], row[5]) for row in line_rows))
+            connection.executemany("INSERT INTO words (line_id, session_id, speaker, start, end, text) VALUES (?, ?, ?, ?, ?, ?)", word_rows)
+    finally:
+        connection.close()
+    print(f"  {len(line_rows)} lines and {len(word_rows)} words saved to the store at {resolve_store_path(store_path)}")
+
+def parse_time(value: Optional[str]) -> Optional[float]:
+    # seconds, m:ss or h:mm:ss
+    if value is None or value == '':
+        return None
+    seconds = 0.0
+    for part in value.strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def format_time(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+def search_phrase(search: str) -> str:
+    # each word as its own quoted term (all of which have to be there), so that things like
+    # apostrophes in names don't get read as query syntax
+    terms = re.findall(r'"[^"]*"|\S+', search)
+    return " ".join('"' + term.strip('"').replace('"', '""') + '"' for term in terms if term.strip('"'))
+
+def query_lines(connection: sqlite3.Connection, search: Optional[str] = None, session: Optional[str] = None, speaker: Optional[str] = None,
+                from_time: Optional[float] = None, to_time: Optional[float] = None, limit: int = 50) -> List[sqlite3.Row]:
+    """
+    The lines matching all of the given conditions, in session and time order. session and speaker
+    can use * and ? wildcards.
+    """
+    conditions = []
+    parameters: Dict[str, object] = {'limit': limit}
+    joins = ""
+    if search:
+        joins += " JOIN lines_fts ON lines_fts.rowid = lines.id"
+        conditions.append("lines_fts MATCH :search")
+        # only what was said, not who said it (--speaker is for that)
+        parameters['search'] = f"text : ({search_phrase(search)})"
+    if session:
+        conditions.append("sessions.name GLOB :session")
+        parameters['session'] = session
+    if speaker:
+        conditions.append("lines.speaker GLOB :speaker")
+        parameters['speaker'] = speaker
+    if from_time is not None or to_time is not None:
+        # the r-tree narrows it down to the lines overlapping the time range (its boxes are rounded
+        # outwards to 32-bit floats, so the exact check is done on the lines themselves as well)
+        joins += " JOIN line_times ON line_times.id = lines.id"
+        parameters['from_time'] = from_time if from_time is not None else 0.0
+        parameters['to_time'] = to_time if to_time is not None else 1e12
+        conditions.append("line_times.end >= :from_time AND line_times.start <= :to_time AND lines.end >= :from_time AND lines.start <= :to_time")
+        if session:
+            conditions.append("line_times.session_lo >= :session_lo AND line_times.session_hi <= :session_hi")
+            ids = [row[0] for row in connection.execute("SELECT id FROM sessions WHERE name GLOB ?", (session,))]
+            parameters['session_lo'] = min(ids) if ids else 0
+            parameters['session_hi'] = max(ids) if ids else -1
+
+    sql = f"""
+        SELECT sessions.name AS session, lines.speaker, lines.start, lines.end, lines.text
+        FROM lines JOIN sessions ON sessions.id = lines.session_id{joins}
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY sessions.name, lines.start, lines.line_no
+        LIMIT :limit
+    """
+    return connection.execute(sql, parameters).fetchall()
+
+def run_query(input_path: str, config: Dict):
+    print()
+    print("--------------------")
+    print("QUERY")
+    print("--------------------")
+    print()
+
+    store_path = resolve_store_path(config.get('store') or input_path)
+    if not os.path.exists(store_path):
+        print(f" No store was found at {store_path}. Run assemble with --store first.")
+        return
+    search = config.get('search')
+    session = config.get('session')
+    from_time = parse_time(config.get('fromTime'))
+    to_time = parse_time(config.get('toTime'))
+    if not search and from_time is None and to_time is None and not session:
+        print(" Give a --search, a --session, and/or a --fromTime/--toTime to look for.")
+        return
+
+    started = time.perf_counter()
+    connection = connect(store_path)
+    try:
+        rows = query_lines(connection, search, session, config.get('speaker'), from_time, to_time, config.get('limit', 50))
+    except sqlite3.OperationalError as ex:
+        print(f" Could not run that query: {str(ex)}")
+        return
+    finally:
+        connection.close()
+    elapsed = time.perf_counter() - started
+
+    if rows:
+        session_width = max(len(row['session']) for row in rows)
+        speaker_width = max(len(row['speaker']) for row in rows)
+        for row in rows:
+            print(f" {row['session'].ljust(session_width)}  [{format_time(row['start'])}]  {row['speaker'].rjust(speaker_width)}: \"{row['text']}\"")
+        print()
+    print(f" {len(rows)} line{'s' if len(rows) != 1 else ''} found in {elapsed * 1000:.0f}ms{' (there may be more, see --limit)' if len(rows) == config.get('limit', 50) else ''}.")
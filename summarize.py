@@ -1,27 +1,273 @@
 import os
 import sys
-import glob 
+import glob
+import time
+import zlib
+import random
+import shutil
+import asyncio
+import hashlib
 import textwrap
-from openai import OpenAI
+from typing import Dict, List, Optional
+import httpx
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError
+from tokens import count_tokens
+from compact import describe_token_savings, split_legend
+import profiling
+from utils import get_cache_dir, write_file_atomically
 
-def do_summary(transcript, client, prompt_file):
+MODEL = "gpt-4-0125-preview"
+SYSTEM_PROMPT = "You are a chatbot which can summarize long transcripts."
+# only these are worth trying again after a bit; anything else (a bad key, say) won't get any better
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+BACKOFF_SECONDS = 2.0
+MAX_BACKOFF_SECONDS = 60.0
+
+MAP_INSTRUCTIONS = """
+
+The transcript is too long to work with all at once, so this is only one part of it. Don't write the final result yet: instead, write down everything from this part that the instructions above will need (who did what, what happened, what was decided, in order), as it will be combined with the same for the other parts afterwards.
+
+"""
+REDUCE_INSTRUCTIONS = """
+
+The transcript was too long to work with all at once, so what follows are notes taken from each part of it, in order. Use them in place of the transcript.
+
+"""
+
+def get_summary_path(input_dir, prompt_file):
+    filename = os.path.splitext(os.path.basename(prompt_file))[0].replace("prompt_", "")
+    return os.path.join(input_dir, f"summary_{filename}.txt")
+
+def get_retry_delay(ex: Exception, attempt: int) -> float:
+    # if the API says how long to wait, wait that long
+    if isinstance(ex, APIStatusError):
+        retry_after = ex.response.headers.get('retry-after')
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), MAX_BACKOFF_SECONDS)
+        except ValueError:
+            pass
+    # otherwise back off exponentially, with some jitter so the prompts don't all come back at once
+    return min(BACKOFF_SECONDS * 2 ** attempt, MAX_BACKOFF_SECONDS) * random.uniform(0.5, 1.0)
+
+def split_transcript(transcript: str, max_tokens: int) -> List[str]:
+    """
+    Splits the transcript into chunks of whole lines, each of up to about max_tokens. Besides when a
+    chunk is full, a chunk also ends after any line that happens to hash the right way once it's at
+    least half full, so that after an edit the chunks line back up with the old ones again straight
+    afterwards, rather than every chunk after the edit moving along and having to be summarized again.
+    A compact transcript's legend goes at the top of every chunk (counted in its tokens), as otherwise
+    the aliases would mean nothing to the model in any chunk but the first.
+    """
+    legend, transcript = split_legend(transcript)
+    if legend is not None:
+        max_tokens = max(1, max_tokens - count_tokens(legend + '\n', MODEL))
+    chunks = []
+    current_lines = []
+    current_tokens = 0
+    for line in transcript.split('\n'):
+        line_tokens = count_tokens(line + '\n', MODEL)
+        if current_lines and current_tokens + line_tokens > max_tokens:
+            chunks.append('\n'.join(current_lines))
+            current_lines, current_tokens = [], 0
+        current_lines.append(line)
+        current_tokens += line_tokens
+        if current_tokens >= max_tokens // 2 and zlib.crc32(line.encode('utf-8')) % 8 == 0:
+            chunks.append('\n'.join(current_lines))
+            current_lines, current_tokens = [], 0
+    if current_lines:
+        chunks.append('\n'.join(current_lines))
+    if legend is not None:
+        chunks = [legend + '\n' + chunk for chunk in chunks]
+    return chunks
+
+class SummaryCache:
+    """
+    The model's answer for each chunk of a chunked summary, by the hash of everything that went into
+    it, so re-running summarize after a small change only asks about the chunks that changed.
+    """
+    def __init__(self, input_dir: str):
+        self.dir = get_cache_dir(input_dir, 'summaries')
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, messages: List[Dict]) -> str:
+        key = hashlib.sha256(MODEL.encode('utf-8'))
+        for message in messages:
+            key.update(f"\n{message['role']}\n{message['content']}".encode('utf-8'))
+        return os.path.join(self.dir, key.hexdigest() + '.txt')
+
+    def get(self, messages: List[Dict]) -> Optional[str]:
+        path = self.path(messages)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        with open(path, 'r') as f:
+            return f.read()
+
+    def put(self, messages: List[Dict], summary: str):
+        write_file_atomically(self.path(messages), summary)
+
+async def stream_completion(client: AsyncOpenAI, messages: List[Dict], output_path: Optional[str], timing: Optional[Dict] = None) -> str:
+    summary_parts = []
+    stream = await client.chat.completions.create(model=MODEL, messages=messages, stream=True)
+    # written as it arrives, so a long summary can be read (or tail -f'd) before it's finished
+    with open(output_path, 'w') if output_path else open(os.devnull, 'w') as file:
+        async for chunk in stream:
+            if timing is not None and getattr(chunk, 'usage', None):
+                timing['usage'] = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                if timing is not None and 'first_token' not in timing:
+                    timing['first_token'] = time.perf_counter()
+                summary_parts.append(chunk.choices[0].delta.content)
+                file.write(chunk.choices[0].delta.content)
+                file.flush()
+    return "".join(summary_parts)
+
+async def complete(client, messages, semaphore, max_retries, label, output_path=None) -> str:
+    for attempt in range(max_retries + 1):
+        try:
+            async with semaphore:
+                started = time.perf_counter()
+                timing = {}
+                summary = await stream_completion(client, messages, output_path, timing)
+                record_request(label, messages, summary, started, timing)
+                return summary
+        except (APIConnectionError, APIStatusError, httpx.TransportError) as ex:
+            profiling.count('summarize.failed_requests')
+            status_code = getattr(ex, 'status_code', None)
+            if attempt == max_retries or (status_code is not None and status_code not in RETRY_STATUS_CODES):
+                raise
+            delay = get_retry_delay(ex, attempt)
+            reason = f"HTTP {status_code}" if status_code is not None else type(ex).__name__
+            print(f"    {label}: {reason}, trying again in {delay:.1f}s ({attempt + 1}/{max_retries})...")
+            await asyncio.sleep(delay)
+
+def record_request(label: str, messages: List[Dict], summary: str, started: float, timing: Dict):
+    if not profiling.enabled():
+        return
+    elapsed = time.perf_counter() - started
+    usage = timing.get('usage')
+    # the API only says how many tokens were used if it's asked to, so otherwise they're counted here
+    prompt_tokens = usage.prompt_tokens if usage else sum(count_tokens(message['content'], MODEL) for message in messages)
+    completion_tokens = usage.completion_tokens if usage else count_tokens(summary, MODEL)
+    first_token = timing['first_token'] - started if 'first_token' in timing else None
+    profiling.add_stage('summarize.request', started, elapsed, lane=label, prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens, first_token_seconds=first_token, tokens_counted_locally=usage is None)
+    profiling.count('summarize.requests')
+    profiling.count('summarize.prompt_tokens', prompt_tokens)
+    profiling.count('summarize.completion_tokens', completion_tokens)
+    profiling.record('summarize.latency_seconds', elapsed)
+    if first_token is not None:
+        profiling.record('summarize.first_token_seconds', first_token)
+
+def make_messages(content: str) -> List[Dict]:
+    return [
+        {"role": "system", "content" : SYSTEM_PROMPT},
+        {"role": "user", "content" : content},
+    ]
+
+async def do_summary(transcript, client, prompt_file, output_path, semaphore, max_retries=5):
+    with open(prompt_file, 'r') as file:
+        prompt = file.read()
+
+    return await complete(client, make_messages(f'{prompt}{transcript}'), semaphore, max_retries, os.path.basename(prompt_file), output_path)
+
+async def do_chunked_summary(transcript, client, prompt_file, output_path, semaphore, max_retries, chunk_tokens, cache: SummaryCache):
+    """
+    Summarizes each chunk of the transcript on its own (all at the same time), then combines those
+    into the final summary, first combining them in groups if there are too many to send at once.
+    """
     with open(prompt_file, 'r') as file:
         prompt = file.read()
+    label = os.path.basename(prompt_file)
+
+    async def summarize_parts(parts: List[str]) -> List[str]:
+        async def summarize_part(index, part):
+            # the part's number isn't in it, so the answer can be reused even if the parts around it change
+            messages = make_messages(prompt + MAP_INSTRUCTIONS + part)
+            summary = cache.get(messages)
+            if summary is None:
+                summary = await complete(client, messages, semaphore, max_retries, f"{label} part {index + 1}/{len(parts)}")
+                cache.put(messages, summary)
+            return summary
+        return await asyncio.gather(*(summarize_part(index, part) for index, part in enumerate(parts)))
+
+    notes = await summarize_parts(split_transcript(transcript, chunk_tokens))
+    while len(notes) > 1:
+        combined = "\n\n".join(f"Part {index + 1}:\n{note}" for index, note in enumerate(notes))
+        if count_tokens(combined, MODEL) <= chunk_tokens:
+            break
+        # too much to send at once, so boil the notes down a level further first
+        grouped = split_transcript(combined, chunk_tokens)
+        if len(grouped) >= len(notes):
+            break
+        notes = await summarize_parts(grouped)
+
+    combined = "\n\n".join(f"Part {index + 1}:\n{note}" for index, note in enumerate(notes))
+    return await complete(client, make_messages(prompt + REDUCE_INSTRUCTIONS + combined), semaphore, max_retries, label, output_path)
+
+def print_summary(summary, output_path):
+    print()
+    print("    Result:")
+    print("    ---------")
+    terminal_width = shutil.get_terminal_size().columns
+    # Split the summary into lines, then indent and wrap each line
+    summary_lines = summary.split('\n')
+    wrapped_summary = '\n'.join('\n'.join(textwrap.wrap(line, width=terminal_width, initial_indent='     ', subsequent_indent='     ')) for line in summary_lines)
+    print(wrapped_summary)
+    print("    ---------")
+    print(f"    Written to {output_path}.")
+    print()
+    print()
+
+async def summarize_all(input_dir, transcript, prompt_files, client, concurrency, max_retries, chunk_tokens=0) -> Dict[str, Optional[float]]:
+    """
+    Runs every prompt at the same time (with up to concurrency requests out at once), printing each
+    summary as soon as it's finished. Returns how many seconds each prompt took, or None for the
+    ones that failed.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    cache = SummaryCache(input_dir) if chunk_tokens else None
+
+    async def run_prompt(prompt_file):
+        started = time.perf_counter()
+        output_path = get_summary_path(input_dir, prompt_file)
+        try:
+            if chunk_tokens:
+                summary = await do_chunked_summary(transcript, client, prompt_file, output_path, semaphore, max_retries, chunk_tokens, cache)
+            else:
+                summary = await do_summary(transcript, client, prompt_file, output_path, semaphore, max_retries)
+        except Exception as ex:
+            print()
+            print(f"  - Prompt {prompt_file} FAILED: {str(ex)}")
+            # don't leave half a summary lying around looking like a whole one
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            return None
+        elapsed = time.perf_counter() - started
+        print()
+        print(f"  - Prompt {prompt_file} ({elapsed:.1f}s):")
+        print_summary(summary, output_path)
+        return elapsed
 
-    completion = client.chat.completions.create(model="gpt-4-0125-preview", 
-        messages=[
-        {"role": "system", "content" : "You are a chatbot which can summarize long transcripts."},
-        {"role": "user", "content" : f'{prompt}{transcript}'},
-        ])
-    
-    return completion.choices[0].message.content
+    timings = await asyncio.gather(*(run_prompt(prompt_file) for prompt_file in prompt_files))
+    if cache is not None:
+        print(f"  Summarized {cache.misses} chunk{'s' if cache.misses != 1 else ''} and reused {cache.hits} from the cache.")
+    return dict(zip(prompt_files, timings))
 
-def summarize(input_dir, prompt_files, openai_api_key):
+async def summarize_with_client(input_dir, transcript, prompt_files, openai_api_key, concurrency, max_retries, base_url, chunk_tokens):
+    # retries are handled in complete(), which can also retry a stream that breaks partway through
+    async with AsyncOpenAI(api_key=openai_api_key, base_url=base_url, max_retries=0) as client:
+        return await summarize_all(input_dir, transcript, prompt_files, client, concurrency, max_retries, chunk_tokens)
+
+def summarize(input_dir, prompt_files, openai_api_key, concurrency=4, max_retries=5, base_url=None, chunk_tokens=0, compact=False):
 
     if input_dir is None:
         print("Please provide an input directory.")
         return
-    
+
     print()
     print("--------------------")
     print("SUMMARIZE")
@@ -36,35 +282,31 @@ def summarize(input_dir, prompt_files, openai_api_key):
     with open(transcript_path, 'r') as file:
         transcript = file.read()
 
+    if compact:
+        compact_path = os.path.join(input_dir, 'transcript.compact.txt')
+        if os.path.exists(compact_path):
+            with open(compact_path, 'r') as file:
+                compact_transcript = file.read()
+            print(f"  Using {compact_path}, {describe_token_savings(compact_transcript, transcript)}.")
+            transcript = compact_transcript
+        else:
+            print(f"  {compact_path} not found (run assemble again to make it), so using transcript.txt.")
+
     if not prompt_files:
         print("  No prompts to use to summarize.")
         return
 
-    client = OpenAI(api_key=openai_api_key)
-
-    for prompt_file in prompt_files:
-        # Call your command here
-        print()
-        print(f"  - Prompt {prompt_file}...")
-        
-        summary = do_summary(transcript, client, prompt_file)
-
-        filename = os.path.splitext(os.path.basename(prompt_file))[0].replace("prompt_", "")
-        filename = f"summary_{filename}.txt"
-        output_path = os.path.join(input_dir, filename)
-        with open(output_path, 'w') as file:
-            file.write(summary)
-        print()
-        print("    Result:")
-        print("    ---------")
-        terminal_width = os.get_terminal_size().columns
-        # Split the summary into lines, then indent and wrap each line
-        summary_lines = summary.split('\n')
-        wrapped_summary = '\n'.join('\n'.join(textwrap.wrap(line, width=terminal_width, initial_indent='     ', subsequent_indent='     ')) for line in summary_lines)
-        print(wrapped_summary)
-        print("    ---------")
-        print(f"    Written to {output_path}.")
-        print()
-        print()
-
+    if chunk_tokens:
+        chunk_count = len(split_transcript(transcript, chunk_tokens))
+        print(f"  The transcript is about {count_tokens(transcript, MODEL)} tokens, which makes {chunk_count} chunk{'s' if chunk_count != 1 else ''} of up to {chunk_tokens} tokens.")
+    print(f"  Sending {len(prompt_files)} prompt{'s' if len(prompt_files) != 1 else ''}, with up to {max(1, concurrency)} requests at a time...")
+    started = time.perf_counter()
+    timings = asyncio.run(summarize_with_client(input_dir, transcript, prompt_files, openai_api_key, concurrency, max_retries, base_url, chunk_tokens))
+    elapsed = time.perf_counter() - started
 
+    finished = [timing for timing in timings.values() if timing is not None]
+    failed = len(timings) - len(finished)
+    print(f"  Finished {len(finished)} summar{'ies' if len(finished) != 1 else 'y'} in {elapsed:.1f}s"
+          + (f" (the slowest prompt took {max(finished):.1f}s)" if finished else "")
+          + (f", {failed} failed." if failed else "."))
+    print("--------------------")
@@ -5,13 +5,14 @@ import re
 import glob
 import readline
 from typing import Dict, Optional
-import torch
-import whisper_timestamped as whisper
 from configuration import get_configuration
-from recognize import recognize
-from assemble import assemble
-from summarize import summarize
 from utils import extract_speaker_name
+import profiling
+
+# modes that run recognize on the session (and so load a model onto the GPU, if the engine uses one)
+RECOGNIZE_OPERATIONS = ['recognize', 'semiauto', 'fullauto']
+# modes that keep running until they're stopped (or, for query, don't have a folder to save a profile into)
+UNPROFILED_OPERATIONS = ['daemon', 'worker', 'query']
 
 def json_string_or_path(json_string_or_path):
     if not json_string_or_path:
@@ -28,7 +29,7 @@ def json_string_or_path(json_string_or_path):
 
     return deserialized_object
 
-def load_names(names_setting, input_dir):
+def load_names(names_setting, input_dir, interactive=True):
     names = json_string_or_path(names_setting)
     if names is None:
         # Look for names.json in input_dir
@@ -37,8 +38,8 @@ def load_names(names_setting, input_dir):
             # If not found, look one folder up
             names_file_path = os.path.join(input_dir, '..', 'names.json')
         if os.path.exists(names_file_path):
-            # If found, prompt the user whether to use it
-            use_names_file = input(f"  Found a names file at {names_file_path}. Do you want to use it? (y/n): ")
+            # If found, prompt the user whether to use it (or just use it, if there's nobody to ask)
+            use_names_file = input(f"  Found a names file at {names_file_path}. Do you want to use it? (y/n): ") if interactive else 'y'
             if use_names_file.lower() == 'y':
                 with open(names_file_path, 'r') as f:
                     names = json.load(f)
@@ -48,7 +49,7 @@ def load_names(names_setting, input_dir):
 
     return names
 
-def load_corrections(corrections_setting, input_dir):
+def load_corrections(corrections_setting, input_dir, interactive=True):
     corrections = None
     correction_setting_dic = json_string_or_path(corrections_setting)
     if correction_setting_dic is None:
@@ -59,7 +60,7 @@ def load_corrections(corrections_setting, input_dir):
             corrections_file_path = os.path.join(input_dir, '..', 'corrections.json')
         if os.path.exists(corrections_file_path):
             # If found, prompt the user whether to use it
-            use_corrections_file = input(f"  Found a corrections file at {corrections_file_path}. Do you want to use it? (y/n): ")
+            use_corrections_file = input(f"  Found a corrections file at {corrections_file_path}. Do you want to use it? (y/n): ") if interactive else 'y'
             if use_corrections_file.lower() == 'y':
                 with open(corrections_file_path, 'r') as f:
                     correction_setting_dic = json.load(f)
@@ -74,9 +75,12 @@ def load_corrections(corrections_setting, input_dir):
 
     return corrections
 
-def check_names(names: Optional[Dict[str, str]], files, extension):
+def check_names(names: Optional[Dict[str, str]], files, extension, interactive=True):
     if names is None:
         names = {}
+    if not interactive:
+        # speakers that aren't in the names file just keep the name they were recorded with
+        return names
     for file in files:
         speaker_name = extract_speaker_name(file, extension)
         if speaker_name not in names:
@@ -112,7 +116,8 @@ def load_prompt_files(input_dir, prompt_type):
         print("  No prompt files found.")
 
     return prompt_files
-def check_cuda():
+def check_cuda(interactive=True):
+    import torch
     if not torch.cuda.is_available():
         print("\033[93m WARNING: CUDA (gpu support) is not available!\n"
               "\n If you are in Docker, you may have forgotten to specify `--gpus all`."
@@ -123,12 +128,19 @@ def check_cuda():
               "\n  - RECOGNIZE may be excruciatingly slow, or just not work at all."
               "\n  - ASSEMBLE may fail when trying to auto-repunctuate out of sync items.\n"
               "\n (SUMMARIZE workloads should be unaffected.)\n \033[0m")
+        if not interactive:
+            return
         response = input("Do you want to continue running? (y/n): ")
         if response.lower() not in ["y", "yes"]:
             exit()
     else:
         print("  CUDA is available.")
 
+def recognize_uses_gpu(config, steps=('recognize',)):
+    # whether any of the steps loads a recognition engine that runs on the GPU (and so needs torch)
+    from engines import ENGINES
+    return 'recognize' in steps and ENGINES[config['engine']].uses_gpu
+
 def main():
     # sys.argv contains the command-line arguments
     # sys.argv[0] is the script name
@@ -147,11 +159,49 @@ def main():
     print("--------------------")
     print()
 
-    check_cuda()
+    operation = config['operationMode']
+    if config['profile']:
+        if operation in UNPROFILED_OPERATIONS:
+            print(f" (--profile doesn't do anything in {operation} mode.)")
+            print()
+        else:
+            profiling.start(inputDir)
+    if operation == 'daemon':
+        # nobody is around to answer any questions, so nothing gets asked
+        if recognize_uses_gpu(config):
+            check_cuda(interactive=False)
+        from daemon import run_daemon
+        run_daemon(inputDir, config)
+        return
+    if operation == 'query':
+        # nothing to check, it only reads the store
+        from store import run_query
+        run_query(inputDir, config)
+        return
+    if operation == 'coordinator':
+        # the workers do the transcribing, so it's their GPUs that matter
+        from distributed import run_coordinator
+        run_coordinator(inputDir, config)
+        profiling.finish()
+        return
+    if operation == 'worker':
+        # which engine it runs (and so whether it needs the GPU, or even torch) is up to the coordinator
+        from distributed import run_worker
+        run_worker(inputDir, config)
+        return
+    if operation == 'batch':
+        # this does its own asking, once for all of the sessions
+        if recognize_uses_gpu(config, [step.strip() for step in config.get('batchSteps', '').split(',')]):
+            check_cuda()
+        from batch import run_batch
+        run_batch(inputDir, config)
+        profiling.finish()
+        return
+    if operation in RECOGNIZE_OPERATIONS and recognize_uses_gpu(config):
+        check_cuda()
     corrections = load_corrections(config.get('corrections'), inputDir)
 
-    operation = config['operationMode']
-    if operation in ['recognize', 'semiauto', 'fullauto']:
+    if operation in RECOGNIZE_OPERATIONS:
         check_names_extension = config.get('extension', 'ogg').strip() or 'ogg'
     else:
         check_names_extension = 'words.json'
@@ -187,20 +237,39 @@ def main():
             print("  OpenAI API key is required for summarize (or fullauto) operation mode.")
             sys.exit()
 
+    # each mode only imports what it actually uses, so that e.g. assemble doesn't sit waiting for torch to load
+    def run_recognize():
+        from recognize import recognize
+        with profiling.stage('recognize'):
+            recognize(inputDir, names, config['fast'], workers=config['workers'], vad_prepass=config['vadPrepass'], window_minutes=config['windowMinutes'], pcm_cache_gb=config['pcmCacheGB'],
+                      engine=config['engine'], threads=config['threads'], batch_segments=config['batchSegments'],
+                      tiered=config['tiered'], tiered_confidence=config['tieredConfidence'])
+
+    def run_assemble():
+        from assemble import assemble
+        with profiling.stage('assemble'):
+            assemble(inputDir, corrections, names, no_ellipses, disfluent_comma, no_asterisks, show_timestamps, config['correctionsWholeWords'], config['correctionsIgnoreCase'], config['store'])
+
+    def run_summarize():
+        from summarize import summarize
+        with profiling.stage('summarize'):
+            summarize(inputDir, prompt_files, openai_api_key, config['summaryConcurrency'], config['summaryRetries'], config['openAiBaseUrl'], config['summaryChunkTokens'], config['compactTranscript'])
+
     operation_modes = {
-        'recognize': lambda: recognize(inputDir, names, config['fast']),
-        'assemble': lambda: assemble(inputDir, corrections, names, no_ellipses, disfluent_comma, no_asterisks, show_timestamps),
-        'summarize': lambda: summarize(inputDir, prompt_files, openai_api_key),
-        'semiauto': lambda: [recognize(inputDir, names, config['fast']), assemble(inputDir, corrections, names, no_ellipses, disfluent_comma, no_asterisks, show_timestamps)],
-        'fullauto': lambda: [recognize(inputDir, names, config['fast']), assemble(inputDir, corrections, names, no_ellipses, disfluent_comma, no_asterisks, show_timestamps), summarize(inputDir, prompt_files, openai_api_key)]
+        'recognize': run_recognize,
+        'assemble': run_assemble,
+        'summarize': run_summarize,
+        'semiauto': lambda: [run_recognize(), run_assemble()],
+        'fullauto': lambda: [run_recognize(), run_assemble(), run_summarize()]
     }
 
     print("--------------------")
 
     if operation in operation_modes:
         operation_modes[operation]()
+        profiling.finish()
     else:
         print(f"Invalid operation: {operation}")    
 
 if __name__ == '__main__':
-    main(sys.argv[1:])
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,107 @@
+from typing import Dict, List, Tuple
+import numpy as np
+
+from audio import SAMPLE_RATE
+from batching import MAX_SEGMENT_SECONDS, split_region
+from engines import RecognitionEngine
+from windowing import offset_results
+
+# a first pass segment is worth decoding again if it's less sure of itself than this
+MIN_SEGMENT_CONFIDENCE = 0.6
+# or if any one of its words is less sure than this
+MIN_WORD_CONFIDENCE = 0.15
+# or if whisper itself would have fallen back to a higher temperature on it
+LOGPROB_THRESHOLD = -1.0
+COMPRESSION_RATIO_THRESHOLD = 2.4
+# how much audio either side of a stretch the second pass also gets to hear, for context
+PADDING_SECONDS = 0.5
+# stretches closer together than this are decoded again as one
+JOIN_GAP_SECONDS = 1.0
+
+def is_weak(segment: Dict, min_confidence: float) -> bool:
+    if segment.get('confidence', 1.0) < min_confidence:
+        return True
+    if segment.get('avg_logprob', 0.0) < LOGPROB_THRESHOLD or segment.get('compression_ratio', 0.0) > COMPRESSION_RATIO_THRESHOLD:
+        return True
+    return any(word.get('confidence', 1.0) < MIN_WORD_CONFIDENCE for word in segment.get('words', []))
+
+def find_weak_stretches(results: Dict, min_confidence: float) -> List[Tuple[float, float]]:
+    stretches = []
+    for segment in sorted(results.get('segments', []), key=lambda segment: segment['start']):
+        if not is_weak(segment, min_confidence):
+            continue
+        if stretches and segment['start'] - stretches[-1][1] <= JOIN_GAP_SECONDS:
+            stretches[-1] = (stretches[-1][0], max(stretches[-1][1], segment['end']))
+        else:
+            stretches.append((segment['start'], segment['end']))
+    return stretches
+
+def replace_stretches(results: Dict, stretches: List[Tuple[float, float]], stretch_results: List[Dict]) -> Dict:
+    """
+    The first pass results with every word that starts in one of the stretches swapped for the words
+    the second pass found starting in it.
+    """
+    def in_stretch(start: float) -> bool:
+        return any(lo <= start < hi for lo, hi in stretches)
+
+    segments = []
+    for segment in results.get('segments', []):
+        words = [word for word in segment.get('words', []) if not in_stretch(word['start'])]
+        if words:
+            segments.append(trim_segment(segment, words))
+    for (lo, hi), second_pass in zip(stretches, stretch_results):
+        for segment in second_pass.get('segments', []):
+            words = [word for word in segment.get('words', []) if lo <= word['start'] < hi]
+            if words:
+                segments.append(trim_segment(segment, words))
+
+    segments.sort(key=lambda segment: segment['start'])
+    for index, segment in enumerate(segments):
+        segment['id'] = index
+    return {
+        "text": "".join(segment['text'] for segment in segments),
+        "segments": segments,
+        "language": results.get('language'),
+    }
+
+def trim_segment(segment: Dict, words: List[Dict]) -> Dict:
+    if len(words) == len(segment.get('words', [])):
+        return segment
+    segment = dict(segment)
+    segment['words'] = words
+    segment['start'] = words[0]['start']
+    segment['end'] = max(word['end'] for word in words)
+    segment['text'] = " " + " ".join(word['text'].strip() for word in words)
+    return segment
+
+def redecode_weak_stretches(recognition_engine: RecognitionEngine, audios: List[np.ndarray], results: List[Dict], second_pass_params: Dict,
+                            min_confidence: float = MIN_SEGMENT_CONFIDENCE) -> Tuple[List[Dict], float]:
+    """
+    Given the first pass results for each of the audios, decodes just the stretches of them that it
+    wasn't confident about again with second_pass_params (all of them as one batch), and puts the
+    two together. Returns the results, and how many seconds of audio were decoded a second time.
+    """
+    pieces = []
+    for index, (audio, first_pass) in enumerate(zip(audios, results)):
+        duration = len(audio) / SAMPLE_RATE
+        for stretch_lo, stretch_hi in find_weak_stretches(first_pass, min_confidence):
+            # short enough (padding and all) to go through the model in one go, and so to be batched
+            for lo, hi in split_region(audio, stretch_lo, stretch_hi, MAX_SEGMENT_SECONDS - 2 * PADDING_SECONDS):
+                start = max(0.0, lo - PADDING_SECONDS)
+                end = min(duration, hi + PADDING_SECONDS)
+                pieces.append((index, lo, hi, start, audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]))
+    if not pieces:
+        return results, 0.0
+
+    second_pass = recognition_engine.transcribe_batch([piece[4] for piece in pieces], second_pass_params)
+    results = list(results)
+    for index in sorted({piece[0] for piece in pieces}):
+        stretches = []
+        stretch_results = []
+        for (piece_index, lo, hi, start, _), piece_results in zip(pieces, second_pass):
+            if piece_index == index:
+                offset_results(piece_results, start)
+                stretches.append((lo, hi))
+                stretch_results.append(piece_results)
+        results[index] = replace_stretches(results[index], stretches, stretch_results)
+    return results, sum(len(piece[4]) for piece in pieces) / SAMPLE_RATE
@@ -0,0 +1,28 @@
+import re
+
+# roughly one token per word or punctuation mark, which is close enough for English when tiktoken isn't around
+_TOKEN_ESTIMATE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+_encodings = {}
+
+def _get_encoding(model: str):
+    # tiktoken is optional; without it (or without a download of its tables) counts are estimated instead
+    if model not in _encodings:
+        try:
+            import tiktoken
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encodings[model] = None
+    return _encodings[model]
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(_TOKEN_ESTIMATE_PATTERN.findall(text))
+
+def counts_are_exact(model: str = "gpt-4") -> bool:
+    return _get_encoding(model) is not None
@@ -1,5 +1,8 @@
 import os
 import re
+import hashlib
+import queue
+import threading
 
 def extract_speaker_name(file, extension):
     file_name = os.path.basename(file)  # strip off the path
@@ -8,4 +11,76 @@ def extract_speaker_name(file, extension):
     if match:
         return match.group(1)
     else:
-        raise ValueError(f"Could not parse speaker name from filename '{file_name}'")
\ No newline at end of file
+        raise ValueError(f"Could not parse speaker name from filename '{file_name}'")
+
+def get_cache_dir(input_dir, *parts):
+    # everything TASMAS keeps around between runs for a session lives in a hidden folder inside it
+    cache_dir = os.path.join(input_dir, '.tasmas', *parts)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def file_sha256(file_path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_file_atomically(file_path, content):
+    # write next to the destination and swap it in, so an interrupted run never leaves half a file behind
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(content)
+    os.replace(temp_path, file_path)
+
+def get_user_cache_dir(*parts):
+    # caches that aren't tied to a single session (and can get big) live outside of it
+    base_dir = os.environ.get('TASMAS_CACHE_DIR') or os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'tasmas')
+    cache_dir = os.path.join(base_dir, *parts)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def prefetch(items, load):
+    """
+    Yields (item, load(item)) for each item, loading the next one on a background thread while the
+    caller is still busy with the current one.
+    """
+    results = queue.Queue(maxsize=1)
+    # set if the caller stops early (an error, or just not wanting the rest), so the producer doesn't sit
+    # waiting forever for room in the queue
+    stop = threading.Event()
+
+    def put(result) -> bool:
+        while not stop.is_set():
+            try:
+                results.put(result, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        for item in items:
+            if stop.is_set():
+                return
+            try:
+                result = (item, load(item), None)
+            except Exception as ex:
+                put((item, None, ex))
+                return
+            if not put(result):
+                return
+        put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            result = results.get()
+            if result is None:
+                return
+            item, loaded, error = result
+            if error is not None:
+                raise error
+            yield item, loaded
+    finally:
+        stop.set()
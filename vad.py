@@ -0,0 +1,103 @@
+import os
+import json
+import bisect
+from typing import Dict, List, Tuple
+import numpy as np
+
+from audio import SAMPLE_RATE
+from utils import get_cache_dir
+
+VAD_PARAMS = {
+    "min_dur": 0.3,
+    "max_silence": 0.8,
+    "energy_threshold": 50,
+    "padding": 0.5,
+    "gap": 1.0,
+}
+
+def detect_speech_regions(audio: np.ndarray, min_dur: float, max_silence: float, energy_threshold: float) -> List[Tuple[float, float]]:
+    import auditok
+
+    duration = len(audio) / SAMPLE_RATE
+    if duration <= min_dur:
+        return []
+    data = (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+    regions = auditok.split(data, sampling_rate=SAMPLE_RATE, sample_width=2, channels=1,
+                            min_dur=min_dur, max_dur=duration, max_silence=max_silence,
+                            energy_threshold=energy_threshold, drop_trailing_silence=True)
+    return [(region.meta.start, region.meta.end) for region in regions]
+
+def pad_and_merge_regions(regions: List[Tuple[float, float]], duration: float, padding: float, gap: float) -> List[Tuple[float, float]]:
+    merged = []
+    for start, end in regions:
+        start = max(0.0, start - padding)
+        end = min(duration, end + padding)
+        # regions that would be closer together in the packed audio than they are in the
+        # original might as well just stay joined
+        if merged and start - merged[-1][1] <= gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def find_speech_regions(audio: np.ndarray) -> List[Tuple[float, float]]:
+    raw_regions = detect_speech_regions(audio, VAD_PARAMS['min_dur'], VAD_PARAMS['max_silence'], VAD_PARAMS['energy_threshold'])
+    return pad_and_merge_regions(raw_regions, len(audio) / SAMPLE_RATE, VAD_PARAMS['padding'], VAD_PARAMS['gap'])
+
+def load_speech_regions(input_dir: str, audio_file: str, audio: np.ndarray) -> List[Tuple[float, float]]:
+    stat = os.stat(audio_file)
+    source = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    cache_path = os.path.join(get_cache_dir(input_dir, 'vad'), os.path.basename(audio_file) + '.json')
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+            if cached.get('source') == source and cached.get('params') == VAD_PARAMS:
+                return [tuple(region) for region in cached['regions']]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    regions = find_speech_regions(audio)
+
+    with open(cache_path, 'w') as f:
+        f.write(json.dumps({"source": source, "params": VAD_PARAMS, "regions": regions}))
+    return regions
+
+def pack_speech_regions(audio: np.ndarray, regions: List[Tuple[float, float]], gap: float) -> Tuple[np.ndarray, List[Tuple[float, float, float]]]:
+    """
+    Concatenates just the speech regions of the audio, with a short silence between each, and returns
+    the packed audio along with the (packed start, session start, length) of every region in it.
+    """
+    silence = np.zeros(int(gap * SAMPLE_RATE), dtype=audio.dtype)
+    pieces = []
+    timeline = []
+    packed_position = 0
+    for start, end in regions:
+        piece = audio[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+        if pieces:
+            pieces.append(silence)
+            packed_position += len(silence)
+        timeline.append((packed_position / SAMPLE_RATE, start, len(piece) / SAMPLE_RATE))
+        pieces.append(piece)
+        packed_position += len(piece)
+    packed = np.concatenate(pieces) if pieces else np.zeros(0, dtype=audio.dtype)
+    return packed, timeline
+
+def to_session_time(packed_time: float, timeline: List[Tuple[float, float, float]], packed_starts: List[float]) -> float:
+    index = max(0, bisect.bisect_right(packed_starts, packed_time) - 1)
+    packed_start, session_start, length = timeline[index]
+    # anything that lands in the silence between two regions belongs to the end of the earlier one
+    offset = min(max(0.0, packed_time - packed_start), length)
+    return round(session_start + offset, 2)
+
+def map_results_to_session_time(results: Dict, timeline: List[Tuple[float, float, float]]):
+    if not timeline:
+        return
+    packed_starts = [packed_start for packed_start, _, _ in timeline]
+    for segment in results.get('segments', []):
+        segment['start'] = to_session_time(segment['start'], timeline, packed_starts)
+        segment['end'] = to_session_time(segment['end'], timeline, packed_starts)
+        for word in segment.get('words', []):
+            word['start'] = to_session_time(word['start'], timeline, packed_starts)
+            word['end'] = to_session_time(word['end'], timeline, packed_starts)
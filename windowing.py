@@ -0,0 +1,106 @@
+import os
+import json
+import glob
+import math
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+from utils import get_cache_dir, write_file_atomically
+
+WINDOW_OVERLAP = 15.0
+
+def plan_windows(duration: float, window_seconds: float, overlap: float = WINDOW_OVERLAP) -> List[Tuple[float, float]]:
+    """
+    Splits the length of a file into (start, end) windows of window_seconds that overlap their
+    neighbors by `overlap` seconds.
+    """
+    if duration <= window_seconds:
+        return [(0.0, duration)]
+    step = window_seconds - overlap
+    if step <= 0:
+        # every window would start where the last one did
+        raise ValueError(f"Windows of {window_seconds:g} seconds have to be longer than their {overlap:g} second overlap.")
+    count = int(math.ceil((duration - overlap) / step))
+    return [(i * step, min(duration, i * step + window_seconds)) for i in range(count)]
+
+def offset_results(results: Dict, offset: float):
+    for segment in results.get('segments', []):
+        segment['start'] = round(segment['start'] + offset, 2)
+        segment['end'] = round(segment['end'] + offset, 2)
+        for word in segment.get('words', []):
+            word['start'] = round(word['start'] + offset, 2)
+            word['end'] = round(word['end'] + offset, 2)
+
+def merge_window_results(windows: List[Tuple[float, float]], window_results: List[Dict]) -> Dict:
+    """
+    Stitches the results of overlapping windows back together into one result. Each word is kept from
+    only one window: whichever one it starts in, splitting each overlap down the middle, since the
+    words right at the edge of a window are the least reliable ones.
+    """
+    cuts = [0.0] + [(windows[i + 1][0] + windows[i][1]) / 2 for i in range(len(windows) - 1)] + [math.inf]
+    segments = []
+    language = None
+    for i, results in enumerate(window_results):
+        language = language or results.get('language')
+        for segment in results.get('segments', []):
+            words = [word for word in segment.get('words', []) if cuts[i] <= word['start'] < cuts[i + 1]]
+            if not words:
+                continue
+            if len(words) < len(segment['words']):
+                segment = dict(segment)
+                segment['words'] = words
+                segment['start'] = words[0]['start']
+                segment['end'] = max(word['end'] for word in words)
+                segment['text'] = " " + " ".join(word['text'].strip() for word in words)
+            segment['id'] = len(segments)
+            segments.append(segment)
+
+    return {
+        "text": "".join(segment['text'] for segment in segments),
+        "segments": segments,
+        "language": language,
+    }
+
+class WindowCheckpoint:
+    """
+    Saves the results of each finished window of a file as it goes, so that an interrupted
+    transcription of a long file can pick back up from the last window that finished.
+    """
+    def __init__(self, input_dir: str, audio_file: str, key: Dict):
+        self.directory = os.path.join(get_cache_dir(input_dir, 'checkpoints'), os.path.basename(audio_file))
+        key_path = os.path.join(self.directory, 'key.json')
+        key = json.loads(json.dumps(key, sort_keys=True))
+        existing_key = None
+        if os.path.exists(key_path):
+            try:
+                with open(key_path, 'r') as f:
+                    existing_key = json.load(f)
+            except (OSError, ValueError):
+                pass
+        if existing_key != key:
+            # a checkpoint for different audio or different settings is no use to anybody
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory)
+            write_file_atomically(key_path, json.dumps(key))
+
+    def window_path(self, index: int) -> str:
+        return os.path.join(self.directory, f'window_{index:05d}.json')
+
+    def load(self, index: int) -> Optional[Dict]:
+        path = self.window_path(index)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, index: int, results: Dict):
+        write_file_atomically(self.window_path(index), json.dumps(results))
+
+    def finished_count(self) -> int:
+        return len(glob.glob(os.path.join(self.directory, 'window_*.json')))
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
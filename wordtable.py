@@ -0,0 +1,219 @@
+import json
+import heapq
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Sequence, Tuple
+
+# a scrubbed disfluency, which never makes it into the transcript
+DISFLUENCY = "[*]"
+
+class StemWords(NamedTuple):
+    """
+    The words of a single .words.json file, as parallel lists, while they're still being cleaned up
+    and before they go into a WordTable.
+    """
+    texts: List[str]
+    starts: List[float]
+    ends: List[float]
+
+class WtWordEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, (WtWord, WtWordList)):
+            return o.to_dict()
+        return super().default(o)
+
+class WordTable:
+    """
+    Every word of a session, stored column by column rather than as an object per word. A word's id
+    is just its row number. Each speaker's words are kept together in one block of rows, in
+    (start, end) order, which means that any run of consecutive words by one speaker (so every
+    sentence and every line of the transcript) is just a range of rows.
+    """
+    def __init__(self):
+        self.speakers: List[str] = []
+        self.speaker_ids: Dict[str, int] = {}
+        self.speaker_column = array('I')
+        self.texts: List[str] = []
+        self.starts = array('d')
+        self.ends = array('d')
+        self.blocks: List[Tuple[int, int]] = []
+        # the rows that are just a scrubbed disfluency (which only happens when repunctuating turns a word back
+        # into one), and so are left out of whatever sentence or line they're in the middle of
+        self.disfluencies = set()
+        # bumped whenever a word's text changes, so phrases know when their cached text is stale
+        self.text_version = 0
+
+    def __len__(self):
+        return len(self.texts)
+
+    @classmethod
+    def from_stems(cls, stems: List[Tuple[str, StemWords]]) -> 'WordTable':
+        """
+        Builds the table from each file's (speaker, words), with the words of each file already in
+        (start, end) order. Files that have the same speaker name end up in the same block, merged
+        in the order they were given in when there are ties.
+        """
+        table = cls()
+        by_speaker: Dict[str, List[StemWords]] = {}
+        for speaker, words in stems:
+            if words.texts:
+                by_speaker.setdefault(speaker, []).append(words)
+
+        for speaker, speaker_stems in by_speaker.items():
+            rows = heapq.merge(*(zip(words.starts, words.ends, words.texts) for words in speaker_stems),
+                               key=lambda row: (row[0], row[1]))
+            table.add_block(speaker, rows)
+        return table
+
+    def add_block(self, speaker: str, rows):
+        speaker_id = self.speaker_ids.get(speaker)
+        if speaker_id is None:
+            speaker_id = self.speaker_ids[speaker] = len(self.speakers)
+            self.speakers.append(speaker)
+        lo = len(self.texts)
+        for start, end, text in rows:
+            if text == DISFLUENCY:
+                self.disfluencies.add(len(self.texts))
+            self.speaker_column.append(speaker_id)
+            self.texts.append(text)
+            self.starts.append(start)
+            self.ends.append(end)
+        self.blocks.append((lo, len(self.texts)))
+
+    def speaker(self, word_id: int) -> str:
+        return self.speakers[self.speaker_column[word_id]]
+
+    def set_text(self, word_id: int, text: str):
+        self.texts[word_id] = text
+        if text == DISFLUENCY:
+            self.disfluencies.add(word_id)
+        else:
+            self.disfluencies.discard(word_id)
+        self.text_version += 1
+
+    def word(self, word_id: int) -> 'WtWord':
+        return WtWord(self, word_id)
+
+    def merged_order(self) -> Iterator[int]:
+        """
+        Yields every word id ordered by start, speaker and end, the way the words of all of the
+        speakers interleave in the conversation.
+        """
+        starts, ends, speaker_column, speakers = self.starts, self.ends, self.speaker_column, self.speakers
+        return heapq.merge(*(range(lo, hi) for lo, hi in self.blocks),
+                           key=lambda i: (starts[i], speakers[speaker_column[i]], ends[i]))
+
+class WtWord:
+    """
+    A view of one row of a WordTable.
+    """
+    __slots__ = ('table', 'id')
+
+    def __init__(self, table: WordTable, word_id: int):
+        self.table = table
+        self.id = word_id
+
+    @property
+    def speaker(self):
+        return self.table.speaker(self.id)
+
+    @property
+    def text(self):
+        return self.table.texts[self.id]
+
+    @text.setter
+    def text(self, value):
+        self.table.set_text(self.id, value)
+
+    @property
+    def start(self):
+        return self.table.starts[self.id]
+
+    @property
+    def end(self):
+        return self.table.ends[self.id]
+
+    def to_dict(self):
+        return {
+            'id': str(self.id),
+            'speaker': self.speaker,
+            'text': self.text,
+            'start': self.start,
+            'end': self.end
+        }
+
+class WtWordList:
+    """
+    A run of consecutive words by one speaker, as the range of rows [lo, hi) of a WordTable (minus
+    any scrubbed disfluencies in it), with its bounds and text worked out once rather than on every
+    access.
+    """
+    __slots__ = ('table', 'lo', 'hi', '_start', '_end', '_text', '_text_version')
+
+    def __init__(self, table: WordTable, lo: int, hi: int):
+        if table.speaker_column[lo] != table.speaker_column[hi - 1]:
+            raise ValueError("All words in a WtWordList must have the same speaker")
+        self.table = table
+        self.lo = lo
+        self.hi = hi
+        self._clear_cache()
+
+    def _clear_cache(self):
+        self._start = None
+        self._end = None
+        self._text = None
+        self._text_version = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def extend(self, other: 'WtWordList'):
+        if other.table is not self.table or other.lo < self.hi or any(word_id not in self.table.disfluencies for word_id in range(self.hi, other.lo)):
+            raise ValueError("Only the words directly following a WtWordList can be added to it")
+        self.hi = other.hi
+        self._clear_cache()
+
+    @property
+    def ids(self) -> Sequence[int]:
+        disfluencies = self.table.disfluencies
+        if not disfluencies:
+            return range(self.lo, self.hi)
+        return [word_id for word_id in range(self.lo, self.hi) if word_id not in disfluencies]
+
+    @property
+    def words(self) -> List[WtWord]:
+        return [WtWord(self.table, word_id) for word_id in self.ids]
+
+    @property
+    def speaker(self):
+        return self.table.speaker(self.lo)
+
+    @property
+    def start(self):
+        if self._start is None:
+            starts = self.table.starts
+            self._start = min(starts[word_id] for word_id in self.ids) if self.table.disfluencies else min(starts[self.lo:self.hi])
+        return self._start
+
+    @property
+    def end(self):
+        if self._end is None:
+            ends = self.table.ends
+            self._end = max(ends[word_id] for word_id in self.ids) if self.table.disfluencies else max(ends[self.lo:self.hi])
+        return self._end
+
+    @property
+    def text(self):
+        if self._text is None or self._text_version != self.table.text_version:
+            texts = self.table.texts
+            self._text = " ".join(texts[word_id] for word_id in self.ids) if self.table.disfluencies else " ".join(texts[self.lo:self.hi])
+            self._text_version = self.table.text_version
+        return self._text
+
+    def to_dict(self):
+        return {
+            'speaker': self.speaker,
+            'start': self.start,
+            'end': self.end,
+            'text': self.text,
+            'words': [word.to_dict() for word in self.words]
+        }